@@ -0,0 +1,293 @@
+#!/Users/lorismarini/anaconda3/bin/python
+
+USAGE = """
+Benchmarks plan() and execute() stage by stage on a synthetic dump,
+optionally behind a simulated slow (network) mount.
+Results are appended as JSON lines to --out.
+
+Example 1:
+    python bench.py --files 5000 --latency-ms 2 --engine scandir --workers 8 --out bench.jsonl
+"""
+
+from imports import *
+from helpers import *
+from plan import *
+from execute import *
+import io
+import math
+import random
+import tempfile
+import builtins
+import platform
+from contextlib import contextmanager
+
+# Filename styles for synthetic files, {n} is a counter, {t} a timestamp
+FILENAME_STYLES = {"camera": "IMG_{n:04d}",
+                   "phone": "IMG_{t:%Y%m%d_%H%M%S}",
+                   "whatsapp": "IMG-{t:%Y%m%d}-WA{n:04d}",
+                   "screenshot": "Screenshot_{t:%Y-%m-%d-%H-%M-%S}",
+                   "plain": "holiday picture {n}"}
+
+# Log-normal size distributions: (median bytes, sigma)
+SIZE_PROFILES = {"small": (20_000, 1.0),
+                 "photo": (3_000_000, 0.5),
+                 "mixed": (200_000, 2.0)}
+
+EXTENSIONS = [".jpg", ".JPG", ".png", ".mp4", ".mov", ".mp3", ".pdf", ".xmp"]
+
+
+def generate_dump(root:str, *, files:int=1000, depth:int=3, fanout:int=4,
+                  sizes:str="small", styles:List[str]=list(FILENAME_STYLES),
+                  seed:int=0) -> dict:
+    """
+    Creates a synthetic dump in root: `files` files spread over a tree of
+    directories `depth` levels deep with `fanout` subdirectories each, with
+    sizes drawn from SIZE_PROFILES[sizes] and names from FILENAME_STYLES.
+    Returns a summary of what was generated.
+    """
+    rng = random.Random(seed)
+    median, sigma = SIZE_PROFILES[sizes]
+    block = rng.randbytes(1024 * 1024) if hasattr(rng, "randbytes") else os.urandom(1024 * 1024)
+
+    # Build the directory tree
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [os.path.join(parent, f"dir_{d}_{i}") for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    total = 0
+    start = pd.Timestamp("2015-01-01").timestamp()
+    for n in range(files):
+        t = pd.Timestamp.fromtimestamp(start + rng.random() * 5 * 365 * 86400)
+        name = FILENAME_STYLES[rng.choice(styles)].format(n=n, t=t)
+        path = os.path.join(rng.choice(dirs), f"{name}_{n}{rng.choice(EXTENSIONS)}")
+        size = int(rng.lognormvariate(math.log(median), sigma))
+
+        with open(path, "wb") as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:min(len(block), size - offset)])
+        os.utime(path, (t.timestamp(), t.timestamp()))
+        total += size
+
+    return {"files": files, "dirs": len(dirs), "bytes": total, "sizes": sizes, "seed": seed}
+
+
+class SlowDirEntry:
+    """
+    Wraps an os.DirEntry so that stat() pays the simulated latency.
+    """
+
+    def __init__(self, entry, delay):
+        self._entry = entry
+        self._delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def __fspath__(self):
+        return self._entry.path
+
+    def stat(self, **kwargs):
+        self._delay("stat")
+        return self._entry.stat(**kwargs)
+
+
+class SlowScandir:
+    """
+    Wraps the iterator returned by os.scandir.
+    """
+
+    def __init__(self, iterator, delay):
+        self._iterator = iterator
+        self._delay = delay
+
+    def __iter__(self):
+        return (SlowDirEntry(e, self._delay) for e in self._iterator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._iterator.close()
+
+    def close(self):
+        self._iterator.close()
+
+
+@contextmanager
+def slow_mount(root:str, *, stat:float=0.0, open_:float=0.0, readdir:float=0.0):
+    """
+    Simulates a network mount without FUSE: while active, os.stat, os.lstat,
+    os.scandir (and DirEntry.stat) and open() sleep for the given latency
+    (in seconds) when called on paths under root. Sleeping releases the
+    GIL like a blocking network call, so concurrency behaves as on a NAS.
+    Yields a dict counting the delayed calls.
+    """
+    root = os.path.abspath(root)
+    counts = {"stat": 0, "open": 0, "readdir": 0}
+    latency = {"stat": stat, "open": open_, "readdir": readdir}
+    original = {"stat": os.stat, "lstat": os.lstat, "scandir": os.scandir,
+                "open": builtins.open, "io_open": io.open}
+
+    def under_root(path) -> bool:
+        if isinstance(path, int):
+            return False
+        return os.path.abspath(os.fsdecode(path)).startswith(root)
+
+    def delay(kind):
+        counts[kind] += 1
+        time.sleep(latency[kind])
+
+    def slow_stat(path, *args, **kwargs):
+        if under_root(path):
+            delay("stat")
+        return original["stat"](path, *args, **kwargs)
+
+    def slow_lstat(path, *args, **kwargs):
+        if under_root(path):
+            delay("stat")
+        return original["lstat"](path, *args, **kwargs)
+
+    def slow_scandir(path=".", *args, **kwargs):
+        iterator = original["scandir"](path, *args, **kwargs)
+        if under_root(path):
+            delay("readdir")
+            return SlowScandir(iterator, delay)
+        return iterator
+
+    def slow_open(file, *args, **kwargs):
+        if under_root(file):
+            delay("open")
+        return original["open"](file, *args, **kwargs)
+
+    os.stat, os.lstat, os.scandir = slow_stat, slow_lstat, slow_scandir
+    builtins.open = io.open = slow_open
+    try:
+        yield counts
+    finally:
+        os.stat, os.lstat, os.scandir = original["stat"], original["lstat"], original["scandir"]
+        builtins.open, io.open = original["open"], original["io_open"]
+
+
+@contextmanager
+def timed(results:list, stage:str, files:int=0, size:int=0):
+    """
+    Times a block and appends a result record to results. The number of
+    files and bytes can be set after the block by updating the record.
+    """
+    record = {"stage": stage, "files": files, "bytes": size}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        seconds = max(record["seconds"], 1e-9)
+        record["files_per_s"] = round(record["files"] / seconds, 1)
+        record["mb_per_s"] = round(record["bytes"] / seconds / 1e6, 3)
+        results.append(record)
+
+
+def benchmark(*, dump:str, server:str, engine:str="scandir", stat_workers:int=0,
+              workers:int=1, mode:str="copy") -> List[dict]:
+    """
+    Runs the stages of plan() and execute() one by one on dump,
+    migrating to server, and returns one timing record per stage.
+    """
+    results = []
+    destinations = server_paths(server)
+
+    with timed(results, "ls_recursive") as r:
+        if engine == "scandir":
+            entries = ls_entries(src_dir=dump)
+            files = [e.path for e in entries]
+        else:
+            files = ls_recursive(src_dir=dump)
+        r["files"] = len(files)
+
+    with timed(results, "filedesc_shallow", files=len(files)):
+        shallow = filedesc_shallow(files=files)
+
+    with timed(results, "filedesc_deep", files=len(files)) as r:
+        if engine == "scandir":
+            deep = filedesc_entries(entries=entries)
+        else:
+            deep = filedesc_deep(files=files, workers=stat_workers)
+        r["bytes"] = int(deep["st_size"].sum())
+
+    description = pd.merge(shallow, deep, how="inner", on="abspath_src")
+    with timed(results, "migration_table", files=len(description)):
+        table = migration_table(df=description, dirs=destinations, save=False)
+
+    with timed(results, "execute", files=len(table), size=int(table["st_size"].sum())):
+        report = run_migrations(df=table, mode=mode, replace=False, workers=workers)
+
+    errors = int(report["error"].count())
+    for r in results:
+        r["errors"] = errors if r["stage"] == "execute" else 0
+    return results
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     usage=USAGE)
+    parser.add_argument('--files', type=int, default=1000, help="Number of files in the dump.")
+    parser.add_argument('--depth', type=int, default=3, help="Depth of the directory tree.")
+    parser.add_argument('--fanout', type=int, default=4, help="Subdirectories per directory.")
+    parser.add_argument('--sizes', type=str, default="small", choices=list(SIZE_PROFILES),
+                        help="Size distribution of the files.")
+    parser.add_argument('--styles', type=str, nargs="*", default=list(FILENAME_STYLES),
+                        choices=list(FILENAME_STYLES), help="Filename styles.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help="Simulated latency of stat, open and readdir on the dump and server.")
+    parser.add_argument('-e', '--engine', type=str, default="scandir", choices=["glob", "scandir"])
+    parser.add_argument('--stat-workers', type=int, default=0, help="See filedesc_deep (glob engine).")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="See execute.")
+    parser.add_argument('-m', '--mode', type=str, default="copy", choices=["copy", "move"])
+    parser.add_argument('--out', type=str, default=None, help="Append results (JSON lines) to this file.")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated directories.")
+    cli_args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="synology_bench_")
+    dump = os.path.join(home, "dump")
+    server = os.path.join(home, "server")
+    try:
+        print(f"\nGenerating {cli_args.files} files in {dump}...")
+        generated = generate_dump(dump, files=cli_args.files, depth=cli_args.depth,
+                                  fanout=cli_args.fanout, sizes=cli_args.sizes,
+                                  styles=cli_args.styles, seed=cli_args.seed)
+
+        latency = cli_args.latency_ms / 1000
+        with slow_mount(home, stat=latency, open_=latency, readdir=latency) as counts:
+            results = benchmark(dump=dump, server=server, engine=cli_args.engine,
+                                stat_workers=cli_args.stat_workers,
+                                workers=cli_args.workers, mode=cli_args.mode)
+    finally:
+        if not cli_args.keep:
+            shutil.rmtree(home, ignore_errors=True)
+
+    # Describe the run in each record, so results can be compared over time
+    run = {"timestamp": pd.Timestamp.now().isoformat(),
+           "python": platform.python_version(),
+           "platform": platform.platform(),
+           "dump": generated,
+           "config": {k: v for k, v in vars(cli_args).items() if k not in ["out", "keep"]},
+           "simulated_calls": counts}
+    records = [{**run, **r} for r in results]
+
+    print(f"\nResults:\n")
+    print(tabulate(pd.DataFrame(results), headers="keys", showindex=False))
+
+    if cli_args.out:
+        with open(cli_args.out, "a") as f:
+            for r in records:
+                f.write(json.dumps(r) + "\n")
+        print(f"\nResults appended to {cli_args.out}")
+
+
+if __name__ == "__main__":
+    main()
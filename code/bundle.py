@@ -0,0 +1,326 @@
+from imports import *
+import io
+import uuid
+import tarfile
+from dedup import new_hash
+from transfer import partial_path
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd plans directory
+plans_dir = here.parent / "_plans"
+
+# Files below this size are bundled
+BUNDLE_THRESHOLD = 256 * 1024
+# Maximum size of a bundle
+BUNDLE_BYTES = 64 * 1024 * 1024
+# Folders receiving fewer small files are not worth a bundle
+MIN_FILES = 8
+# Bundles are hidden, listings and plans ignore them
+BUNDLE_PREFIX = ".bundle_"
+INDEX_SUFFIX = ".index.json"
+# Written by unbundle next to the bundle: what happened to each member
+RESULTS_SUFFIX = ".extracted.json"
+# Sources of moved files waiting for their bundle to be unpacked
+PENDING_PATH = plans_dir / "pending_bundles.jsonl"
+
+
+def bundle_groups(df:pd.DataFrame, threshold:int=BUNDLE_THRESHOLD, min_files:int=MIN_FILES,
+                  max_bytes:int=BUNDLE_BYTES) -> List[List[int]]:
+    """
+    Positions of the rows of a migration table to bundle together: files
+    smaller than threshold going to the same destination directory (if
+    there are at least min_files of them), in bundles of up to max_bytes.
+    """
+    if "st_size" not in df.columns:
+        return []
+
+    rows = pd.DataFrame({"dirname": [os.path.dirname(p) for p in df["abspath_dst"]],
+                         "size": df["st_size"].to_numpy()})
+    small = rows[rows["size"] < threshold]
+
+    bundles = []
+    for _, group in small.groupby("dirname", sort=False):
+        if len(group) < min_files:
+            continue
+        current, total = [], 0
+        for position, size in zip(group.index, group["size"]):
+            if current and total + size > max_bytes:
+                bundles.append(current)
+                current, total = [], 0
+            current.append(position)
+            total += size
+        bundles.append(current)
+
+    return bundles
+
+
+def existing_names(dirname:str) -> set:
+    """
+    Names in a directory, listed once (instead of one stat per file).
+    """
+    try:
+        with os.scandir(dirname) as iterator:
+            return {entry.name for entry in iterator}
+    except FileNotFoundError:
+        return set()
+
+
+def write_bundle(members:List[Tuple[str, str]], dirname:str, keep:bool=False,
+                 verify:str=None, throttle=None) -> Tuple[str, List[dict]]:
+    """
+    Packs files into one tar in memory and writes it to dirname in one go
+    (under a temporary name, renamed once on disk). members are pairs of
+    (source path, name in the bundle). Sources that can't be read are left
+    out. An index of the offset and size of each member is saved next to
+    the bundle (see read_member, bundled_names). If keep, the bundle stays
+    as an archive, otherwise unbundle.py unpacks it.
+    If verify is "readback" the bundle is read back and compared ("stat"
+    compares its size). throttle paces the write (see schedule.Bandwidth).
+    Returns the path of the bundle and, for each member, its digest, size
+    and error (None if it was bundled).
+    """
+    buffer = io.BytesIO()
+    results = []
+    with tarfile.open(fileobj=buffer, mode="w", format=tarfile.PAX_FORMAT) as tar:
+        for src, name in members:
+            try:
+                with open(src, "rb") as f:
+                    stats = os.fstat(f.fileno())
+                    data = f.read()
+            except OSError as ex:
+                results.append({"digest": None, "size": 0, "error": str(ex)})
+                continue
+
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = stats.st_mtime
+            info.mode = stats.st_mode & 0o777
+            tar.addfile(info, io.BytesIO(data))
+
+            h = new_hash()
+            h.update(data)
+            results.append({"digest": h.hexdigest(), "size": len(data), "error": None})
+
+    content = buffer.getvalue()
+    timestring = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(dirname, f"{BUNDLE_PREFIX}{timestring}_{uuid.uuid4().hex[:8]}.tar")
+
+    # One large write, then a rename: the bundle is never partial
+    target = partial_path(path)
+    if throttle is not None:
+        throttle(len(content))
+    with open(target, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if verify == "readback":
+        with open(target, "rb") as f:
+            if f.read() != content:
+                os.remove(target)
+                raise ValueError(f"DATA INTEGRITY: bundle {path} failed verification (readback).")
+    elif verify == "stat" and os.stat(target).st_size != len(content):
+        os.remove(target)
+        raise ValueError(f"DATA INTEGRITY: bundle {path} failed verification (stat).")
+
+    os.replace(target, path)
+    save_index(path, content)
+
+    return path, results
+
+
+def save_index(path:str, content:bytes):
+    """
+    Saves the index of a bundle ({name: [offset, size]}), from its content.
+    """
+    with tarfile.open(fileobj=io.BytesIO(content), mode="r") as tar:
+        index = {m.name: [m.offset_data, m.size] for m in tar.getmembers()}
+    with open(path + INDEX_SUFFIX, "w") as f:
+        json.dump(index, f)
+
+
+def bundle_index(path:str) -> dict:
+    """
+    Index of a bundle kept as an archive: {name: [offset, size]}.
+    """
+    with open(path + INDEX_SUFFIX) as f:
+        return json.load(f)
+
+
+def read_member(path:str, name:str, index:dict=None) -> bytes:
+    """
+    Reads one file from a bundle kept as an archive, with a single
+    range read (no need to scan the tar).
+    """
+    index = bundle_index(path) if index is None else index
+    offset, size = index[name]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def bundled_names(listing:dict) -> set:
+    """
+    Names of the files in the bundles of a directory (from the listing
+    of the directory, {name: DirEntry}): files not on disk yet (or kept
+    in an archive), but already migrated.
+    """
+    names = set()
+    for name, entry in listing.items():
+        if name.startswith(BUNDLE_PREFIX) and name.endswith(INDEX_SUFFIX):
+            try:
+                names.update(bundle_index(entry.path[:-len(INDEX_SUFFIX)]))
+            except (OSError, ValueError):
+                continue
+    return names
+
+
+def find_bundles(root:str) -> List[str]:
+    """
+    Paths of the bundles in a directory tree.
+    """
+    bundles = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        bundles += [os.path.join(dirpath, f) for f in filenames
+                    if f.startswith(BUNDLE_PREFIX) and f.endswith(".tar")]
+    return sorted(bundles)
+
+
+def unbundle(path:str, replace:bool=False) -> Tuple[int, int]:
+    """
+    Unpacks a bundle in its directory (meant to run on the server, where
+    files are local), keeping the modification times. Existing files are
+    kept unless replace: the members that conflict with them stay in the
+    bundle (run again with replace to resolve them), otherwise the bundle
+    is removed. What happened to each member is saved next to the bundle
+    (see RESULTS_SUFFIX), for release_sources. Returns the number of
+    files extracted and skipped.
+    """
+    dirname = os.path.dirname(path)
+    existing = existing_names(dirname)
+    results = load_results(path)
+    conflicts = io.BytesIO()
+    extracted = skipped = 0
+
+    with tarfile.open(path, mode="r") as tar, \
+            tarfile.open(fileobj=conflicts, mode="w", format=tarfile.PAX_FORMAT) as kept:
+        for member in tar:
+            # Bundles only hold plain files named after their destination
+            if not member.isfile() or os.path.basename(member.name) != member.name:
+                continue
+            if member.name in existing and not replace:
+                kept.addfile(member, tar.extractfile(member))
+                results[member.name] = "skipped"
+                skipped += 1
+                continue
+
+            dst = os.path.join(dirname, member.name)
+            target = partial_path(dst)
+            with tar.extractfile(member) as fsrc, open(target, "wb") as fdst:
+                shutil.copyfileobj(fsrc, fdst)
+            os.chmod(target, member.mode)
+            os.utime(target, (member.mtime, member.mtime))
+            os.replace(target, dst)
+            results[member.name] = "extracted"
+            extracted += 1
+
+    # Results first: if this is interrupted, members are extracted again
+    target = partial_path(path + RESULTS_SUFFIX)
+    with open(target, "w") as f:
+        json.dump(results, f)
+    os.replace(target, path + RESULTS_SUFFIX)
+
+    if skipped:
+        content = conflicts.getvalue()
+        target = partial_path(path)
+        with open(target, "wb") as f:
+            f.write(content)
+        os.replace(target, path)
+        save_index(path, content)
+    else:
+        os.remove(path)
+        if os.path.exists(path + INDEX_SUFFIX):
+            os.remove(path + INDEX_SUFFIX)
+    return extracted, skipped
+
+
+def load_results(path:str) -> dict:
+    """
+    What unbundle did with each member of a bundle so far, {name: status}
+    ("extracted" or "skipped"), empty if it didn't run yet.
+    """
+    try:
+        with open(path + RESULTS_SUFFIX) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def add_pending(path:str, members:List[Tuple[str, str]], pending_path:str=None):
+    """
+    Records the sources of the members of a bundle (pairs of source path
+    and name in the bundle), to be removed once unpacked (see release_sources).
+    """
+    pending_path = PENDING_PATH if pending_path is None else pending_path
+    os.makedirs(os.path.dirname(os.path.abspath(pending_path)), exist_ok=True)
+    with open(pending_path, "a") as f:
+        f.write(json.dumps({"bundle": path, "members": members}) + "\n")
+
+
+def release_sources(pending_path:str=None) -> Tuple[int, int]:
+    """
+    Removes the sources of moved files whose bundle has been unpacked on
+    the server (the result of unbundle says "extracted" and the file at
+    destination has the size of the source). Others stay pending.
+    Returns the number of sources removed and still pending.
+    """
+    pending_path = PENDING_PATH if pending_path is None else pending_path
+    if not os.path.exists(pending_path):
+        return 0, 0
+
+    with open(pending_path) as f:
+        pending = [json.loads(line) for line in f if line.strip()]
+
+    removed = 0
+    remaining = []
+    for item in pending:
+        path = item["bundle"]
+        results = load_results(path)
+        dirname = os.path.dirname(path)
+
+        members = []
+        for src, name in item["members"]:
+            if results.get(name) == "extracted" and release(src, os.path.join(dirname, name)):
+                removed += 1
+            else:
+                members.append([src, name])
+
+        if members:
+            remaining.append({"bundle": path, "members": members})
+        elif os.path.exists(path + RESULTS_SUFFIX) and not os.path.exists(path):
+            os.remove(path + RESULTS_SUFFIX)
+
+    target = partial_path(str(pending_path))
+    with open(target, "w") as f:
+        f.writelines(json.dumps(item) + "\n" for item in remaining)
+    os.replace(target, pending_path)
+
+    return removed, sum(len(item["members"]) for item in remaining)
+
+
+def release(src:str, dst:str) -> bool:
+    """
+    Removes src if dst has the same size. True if src is gone.
+    """
+    try:
+        size = os.stat(src).st_size
+    except FileNotFoundError:
+        return True
+    try:
+        if os.stat(dst).st_size != size:
+            return False
+    except FileNotFoundError:
+        return False
+    os.remove(src)
+    return True
@@ -0,0 +1,49 @@
+from imports import *
+import threading
+from incremental import load_snapshot, save_snapshot
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd cache directory
+cache_dir = here.parent / "_plans" / "cache"
+
+
+class FileCache:
+    """
+    Persistent cache of values computed from the content of files
+    (capture times, perceptual hashes...), stored in _plans/cache/{name}.pkl.
+    Values are keyed on (path, size, mtime): a file that changed misses
+    the cache, and its new value replaces the old one.
+    """
+
+    def __init__(self, name:str):
+        self.path = cache_dir / f"{name}.pkl"
+        self.values = load_snapshot(self.path)
+        self.lock = threading.Lock()
+        self.changed = False
+
+    def __len__(self):
+        return len(self.values)
+
+    def __str__(self):
+        return f"FileCache({self.path}, {len(self)} files)"
+
+    def get(self, path:str, size:int, mtime:int, default=None):
+        """
+        The value cached for path, if size and mtime (seconds) still match.
+        """
+        cached = self.values.get(path)
+        if cached is None or cached[:2] != (int(size), int(mtime)):
+            return default
+        return cached[2]
+
+    def put(self, path:str, size:int, mtime:int, value):
+        with self.lock:
+            self.values[path] = (int(size), int(mtime), value)
+            self.changed = True
+
+    def save(self):
+        with self.lock:
+            if self.changed:
+                save_snapshot(self.path, self.values)
+                self.changed = False
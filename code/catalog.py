@@ -0,0 +1,180 @@
+from imports import *
+import sqlite3
+import threading
+from walk import scandir_walk
+from dedup import full_hash, hash_many
+from compact import plan_paths
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd plans directory
+plans_dir = here.parent / "_plans"
+
+
+class Catalog:
+    """
+    On-disk SQLite index of the files on the server (path, size, mtime and
+    optionally content hash). It is built once by walking the server roots,
+    then kept up to date from the migration reports, so plans can check
+    what is already on the server without touching the network share.
+    Can be shared between threads (queries are serialised).
+    """
+
+    def __init__(self, path:str=str(plans_dir / "server_catalog.sqlite")):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                          "path TEXT PRIMARY KEY, "
+                          "size INTEGER, "
+                          "mtime INTEGER, "
+                          "content_hash TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_content_hash ON files (content_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_size ON files (size)")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def __str__(self):
+        return f"Catalog {self.path} ({len(self)} files, {self.hashed()} hashed)"
+
+    def hashed(self) -> int:
+        """
+        Number of files with a content hash.
+        """
+        return self.conn.execute("SELECT COUNT(*) FROM files WHERE content_hash IS NOT NULL").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def build(self, roots:dict, hashes:bool=False, max_workers:int=8):
+        """
+        (Re)indexes every file under the roots of a server_paths() dict.
+        With hashes=True files are also fully hashed (reads everything!),
+        on max_workers threads. Files that can't be read have no hash.
+        """
+        unique_roots = sorted({v for k, v in roots.items() if k != "HOME"})
+        for root in unique_roots:
+            print(f"\nCataloging {root}...")
+            entries = list(tqdm(scandir_walk(root, max_workers=max_workers)))
+            if hashes:
+                content_hashes = hash_many(full_hash, [(e.path,) for e in entries], max_workers)
+            else:
+                content_hashes = [None] * len(entries)
+            rows = [(e.path, e.st_size, int(e.st_mtime), h) for e, h in zip(entries, content_hashes)]
+
+            # Replace everything previously known under this root
+            with self.lock:
+                self.conn.execute("DELETE FROM files WHERE path LIKE ? ESCAPE '\\'",
+                                  (escape_like(root.rstrip("/")) + "/%",))
+                self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows)
+                self.conn.commit()
+            print(f"\t{len(rows)} files cataloged")
+
+    def update_from_report(self, *, report:pd.DataFrame, df:pd.DataFrame):
+        """
+        Records the files that execute() copied or moved to the server,
+        or bundled (they are at destination once unpacked, and bundles are
+        not sent again). `report` is the migration report of `df` (same row order). Sizes
+        and mtimes come from the plan (copy2 preserves them), hashes from
+        the plan or from the digests of verified copies.
+        """
+        df = df.reset_index(drop=True)
+        report = report.reset_index(drop=True)
+        done = report["copied"] | report["moved"] | (report["outcome"] == "bundled")
+        if not done.any():
+            return
+
+        migrated = df[done]
+        mtime = migrated["st_mtime"].astype("int64") // 10**9
+        content_hash = report.loc[done, "digest"]
+        if "content_hash" in migrated.columns:
+            content_hash = migrated["content_hash"].fillna(content_hash)
+
+        rows = zip(plan_paths(migrated, "abspath_dst"), migrated["st_size"], mtime, content_hash)
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                  [(p, int(s), int(m), h if isinstance(h, str) else None)
+                                   for p, s, m, h in rows])
+            self.conn.commit()
+        print(f"\n{done.sum()} files added to catalog")
+
+    def contains(self, paths:pd.Series) -> pd.Series:
+        """
+        True for each path that is in the catalog.
+        """
+        known = self._lookup("SELECT t.value, 1 FROM temp.lookup t "
+                             "JOIN files f ON f.path = t.value", paths)
+        return paths.map(known).notnull()
+
+    def find_content(self, hashes:pd.Series) -> pd.Series:
+        """
+        For each content hash, the path of a file on the server with the
+        same content (None if there is none).
+        """
+        known = self._lookup("SELECT t.value, MIN(f.path) FROM temp.lookup t "
+                             "JOIN files f ON f.content_hash = t.value GROUP BY t.value",
+                             hashes.dropna())
+        return hashes.map(known)
+
+    def hashed_sizes(self, sizes:pd.Series) -> pd.Series:
+        """
+        True for each size that a file with a content hash has on the
+        server (only those files can have their content stored there).
+        """
+        known = self._lookup("SELECT DISTINCT t.value, 1 FROM temp.lookup t "
+                             "JOIN files f ON f.size = t.value "
+                             "WHERE f.content_hash IS NOT NULL", sizes.astype(str))
+        return sizes.astype(str).map(known).notnull()
+
+    def _lookup(self, query:str, values:pd.Series) -> dict:
+        """
+        Joins a set of values against the files table in one query.
+        """
+        with self.lock:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (value TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM temp.lookup")
+            self.conn.executemany("INSERT OR IGNORE INTO temp.lookup VALUES (?)",
+                                  [(v,) for v in values])
+            output = dict(self.conn.execute(query).fetchall())
+            self.conn.execute("DELETE FROM temp.lookup")
+        return output
+
+
+def escape_like(text:str) -> str:
+    """
+    Escapes the wildcards of a SQL LIKE pattern.
+    """
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def skip_cataloged(*, df:pd.DataFrame, catalog:Catalog, replace:bool, workers:int=8) -> pd.DataFrame:
+    """
+    Uses the catalog to drop from a migration table:
+        - files already at their destination (unless replace)
+        - files whose content is already stored elsewhere on the server
+          (for catalogs built with hashes)
+    Files are hashed if they have the size of a hashed file on the server
+    and no content_hash yet (see dedup.content_hashes).
+    Adds the columns `on_server` and `stored_as`.
+    """
+    df["on_server"] = catalog.contains(df["abspath_dst"])
+
+    if "content_hash" not in df.columns:
+        df["content_hash"] = None
+    candidates = df["content_hash"].isnull() & catalog.hashed_sizes(df["st_size"])
+    if candidates.any():
+        args = [(p,) for p in df.loc[candidates, "abspath_src"]]
+        df.loc[candidates, "content_hash"] = hash_many(full_hash, args, workers)
+        print(f"\t{candidates.sum()}/{len(df)} hashed (same size as a file on server)")
+    df["stored_as"] = catalog.find_content(df["content_hash"])
+
+    existing = df["on_server"] & (not replace)
+    elsewhere = df["stored_as"].notnull() & (df["stored_as"] != df["abspath_dst"])
+    output = df[~(existing | elsewhere)].reset_index(drop=True)
+
+    print(f"\t{existing.sum()}/{len(df)} ignored (on server)")
+    print(f"\t{(elsewhere & ~existing).sum()}/{len(df)} ignored (content on server)")
+    return output
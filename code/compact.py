@@ -0,0 +1,117 @@
+from imports import *
+
+# Columns that can be rebuilt from the others
+DERIVED_COLUMNS = ["abspath_src", "abspath_dst", "filename_src", "extension_src", "file_ext"]
+
+# Low cardinality columns, stored as categoricals
+CATEGORY_COLUMNS = ["dirname_src", "dirname_dst", "parentdir_dst", "extension", "file_type"]
+
+# Datetime columns, stored as int64 (ns since epoch, NaT as the minimum int64)
+TIME_COLUMNS = ["st_mtime", "st_ctime", "created_at", "time_src", "captured_at", "taken_at"]
+
+PLAN_FORMATS = ["csv", "parquet", "feather"]
+# Formats that store (and keep in memory) the compact table
+COMPACT_FORMATS = ["parquet", "feather"]
+
+
+def is_compact(df:pd.DataFrame) -> bool:
+    return "abspath_src" not in df.columns
+
+
+def compact_plan(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a compact version of a migration table:
+        - directories are interned: `dirname_src` and `dirname_dst` are
+          categoricals (each directory stored once, rows hold a code)
+        - extension, file type and destination root are categoricals
+        - timestamps are int64
+        - full paths and other derived columns are dropped
+    Use expand_plan() to get the full table back.
+    """
+    if is_compact(df):
+        return df
+
+    output = df.drop(columns=[c for c in DERIVED_COLUMNS if c in df.columns])
+    output.insert(0, "dirname_src", [os.path.dirname(p) for p in df["abspath_src"]])
+
+    for c in CATEGORY_COLUMNS:
+        if c in output.columns:
+            output[c] = output[c].astype("category")
+
+    for c in TIME_COLUMNS:
+        if c in output.columns:
+            output[c] = output[c].values.astype("int64")
+
+    return output
+
+
+def plan_paths(df:pd.DataFrame, column:str="abspath_dst") -> pd.Series:
+    """
+    The abspath_src or abspath_dst column of a full or compact plan,
+    without expanding the rest of it.
+    """
+    if not is_compact(df):
+        return df[column]
+    side = column.rsplit("_", 1)[1]
+    return df[f"dirname_{side}"].astype(str) + "/" + df[f"basename_{side}"]
+
+
+def expand_plan(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Rebuilds the full migration table (as returned by migration_table)
+    from a compact one. Full tables are returned unchanged.
+    """
+    if not is_compact(df):
+        return df
+
+    output = df.copy()
+    output["abspath_src"] = output["dirname_src"].astype(str) + "/" + output["basename_src"]
+    names = [os.path.splitext(b) for b in output["basename_src"]]
+    output["filename_src"] = [n for n, _ in names]
+    output["extension_src"] = [e for _, e in names]
+
+    if "dirname_dst" in output.columns:
+        output["abspath_dst"] = output["dirname_dst"].astype(str) + "/" + output["basename_dst"]
+
+    for c in CATEGORY_COLUMNS:
+        if c in output.columns:
+            output[c] = output[c].astype(str).where(output[c].notnull(), None)
+    output["file_ext"] = output["extension"]
+
+    for c in TIME_COLUMNS:
+        if c in output.columns:
+            output[c] = pd.to_datetime(output[c])
+
+    return output.drop(columns=["dirname_src"])
+
+
+def save_plan(df:pd.DataFrame, path:str, plan_format:str="csv"):
+    """
+    Saves a plan as csv (full table, as before) or as parquet/feather
+    (compact table, much faster to write and reload, requires pyarrow).
+    """
+    if plan_format == "csv":
+        expand_plan(df).to_csv(path)
+    elif plan_format == "parquet":
+        compact_plan(df).to_parquet(path)
+    elif plan_format == "feather":
+        compact_plan(df).reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"plan_format can be one of {PLAN_FORMATS}, passed {plan_format}")
+
+
+def load_plan(path:str) -> pd.DataFrame:
+    """
+    Loads a plan saved by save_plan (compact for parquet/feather).
+    """
+    extension = os.path.splitext(str(path))[1]
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    elif extension == ".feather":
+        return pd.read_feather(path)
+    else:
+        df = pd.read_csv(path, index_col=0)
+        for c in TIME_COLUMNS:
+            if c in df.columns:
+                df[c] = pd.to_datetime(df[c])
+        return df
@@ -0,0 +1,119 @@
+from imports import *
+import threading
+from dedup import partial_hash, full_hash
+
+COMPARE_POLICIES = ["size_mtime", "partial_hash", "full_hash"]
+
+# Some file systems store mtimes with a 2 seconds precision (FAT, SMB)
+MTIME_TOLERANCE = 2
+
+
+class WrittenEntry:
+    """
+    Entry of a file written after its directory was listed, in place of
+    its os.DirEntry (path, name and stat(), fetched on first use).
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.stats = None
+
+    def stat(self):
+        if self.stats is None:
+            self.stats = os.stat(self.path)
+        return self.stats
+
+
+class DestinationIndex:
+    """
+    Lists each destination directory once with os.scandir, and answers
+    "does dst exist, and with which stats" from the listing: one round trip
+    per directory instead of one per file. Stats are only fetched when
+    needed (to compare files) and cached by their DirEntry. Files written
+    or removed after the listing are recorded with add() and remove().
+    """
+
+    def __init__(self):
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    def listing(self, dirname:str) -> dict:
+        with self.lock:
+            entries = self.dirs.get(dirname)
+        if entries is None:
+            try:
+                with os.scandir(dirname) as iterator:
+                    entries = {entry.name: entry for entry in iterator}
+            except FileNotFoundError:
+                entries = {}
+            with self.lock:
+                self.dirs[dirname] = entries
+        return entries
+
+    def lookup(self, path:str):
+        """
+        The DirEntry of path, None if it doesn't exist.
+        """
+        dirname, name = os.path.split(path)
+        return self.listing(dirname).get(name)
+
+    def add(self, path:str):
+        """
+        Records a file written to path (if its directory is listed already,
+        otherwise its listing will have it).
+        """
+        dirname, name = os.path.split(path)
+        with self.lock:
+            entries = self.dirs.get(dirname)
+            if entries is not None:
+                entries[name] = WrittenEntry(path)
+
+    def remove(self, path:str):
+        dirname, name = os.path.split(path)
+        with self.lock:
+            entries = self.dirs.get(dirname)
+            if entries is not None:
+                entries.pop(name, None)
+
+
+def destination_exists(dst:str, index:DestinationIndex=None) -> bool:
+    """
+    True if dst exists (from the index if passed, without a stat).
+    """
+    if index is not None:
+        return index.lookup(dst) is not None
+    return os.path.lexists(dst)
+
+
+def destination_stats(dst:str, index:DestinationIndex=None):
+    """
+    Stats of dst (from the index if passed), None if it doesn't exist.
+    """
+    if index is not None:
+        entry = index.lookup(dst)
+        return entry.stat() if entry is not None else None
+    try:
+        return os.stat(dst)
+    except FileNotFoundError:
+        return None
+
+
+def identical(src:str, dst:str, *, src_stats, dst_stats, policy:str) -> bool:
+    """
+    True if dst is the same file as src, according to policy:
+        - "size_mtime": same size and mtime (copies keep the mtime), free
+        - "partial_hash": same size, first and last bytes (see dedup.py)
+        - "full_hash": same size and content, reads both files
+    """
+    if policy not in COMPARE_POLICIES:
+        raise ValueError(f"compare can be one of {COMPARE_POLICIES}, passed {policy}")
+
+    if src_stats.st_size != dst_stats.st_size:
+        return False
+    if policy == "size_mtime":
+        return abs(src_stats.st_mtime - dst_stats.st_mtime) < MTIME_TOLERANCE
+    if policy == "partial_hash":
+        size = src_stats.st_size
+        return partial_hash(src, size) == partial_hash(dst, size)
+    return full_hash(src) == full_hash(dst)
@@ -0,0 +1,102 @@
+from imports import *
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes hashed at the start and at the end of a file for the partial hash
+EDGE_SIZE = 4096
+# Read size for full hashes
+CHUNK_SIZE = 1024 * 1024
+
+
+def new_hash():
+    """
+    The hash used for file contents across the project.
+    """
+    return hashlib.blake2b(digest_size=16)
+
+
+def partial_hash(path:str, size:int, edge:int=EDGE_SIZE) -> str:
+    """
+    Hashes the first and last `edge` bytes of a file. For files smaller
+    than 2 * edge this reads the whole file, and equals full_hash().
+    """
+    h = new_hash()
+    with open(path, "rb") as f:
+        if size <= 2 * edge:
+            h.update(f.read())
+        else:
+            h.update(f.read(edge))
+            f.seek(-edge, os.SEEK_END)
+            h.update(f.read(edge))
+    return h.hexdigest()
+
+
+def full_hash(path:str) -> str:
+    """
+    Hashes a whole file, streaming it in chunks.
+    """
+    h = new_hash()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_many(function, args:list, workers:int) -> list:
+    """
+    Runs a hash function over a list of argument tuples on a thread pool.
+    Files that can't be read get None.
+    """
+    def task(a):
+        try:
+            return function(*a)
+        except OSError as ex:
+            print(f"\tWARNING: could not hash {a[0]} ({ex})")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(task, args))
+
+
+def content_hashes(df:pd.DataFrame, edge:int=EDGE_SIZE, workers:int=8) -> pd.DataFrame:
+    """
+    Finds files with identical content reading as few bytes as possible.
+    df should have `abspath_src` and `st_size`. Adds two columns:
+        - content_hash: hash of the content, only for files that share
+          their size with another file (NaN for the others)
+        - dup_group: same id for files with identical content
+    Files are compared by size first, then by a partial hash of their
+    first and last bytes, and fully hashed only if those collide too.
+    """
+    print("\nHashing file contents...")
+
+    df["content_hash"] = None
+
+    # Files with a unique size can't have duplicates
+    candidates = df[df.duplicated(subset=["st_size"], keep=False)]
+    args = list(zip(candidates["abspath_src"], candidates["st_size"], [edge] * len(candidates)))
+    partial = pd.Series(hash_many(partial_hash, args, workers), index=candidates.index, dtype=object)
+
+    # Small files were read entirely, their partial hash is a full hash
+    small = candidates["st_size"] <= 2 * edge
+    df.loc[small[small].index, "content_hash"] = partial[small]
+
+    # Fully hash large files whose size and edges collide
+    keys = pd.DataFrame({"st_size": candidates["st_size"], "partial": partial})
+    collide = keys["partial"].notnull() & keys.duplicated(keep=False) & ~small
+    args = [(p,) for p in candidates.loc[collide, "abspath_src"]]
+    full = hash_many(full_hash, args, workers)
+    df.loc[collide[collide].index, "content_hash"] = full
+
+    # Files without a hash are unique
+    unique = pd.Series("row:" + df.index.astype(str), index=df.index)
+    key = df["content_hash"].fillna(unique)
+    df["dup_group"] = pd.factorize(key)[0]
+
+    read = candidates.loc[collide, "st_size"].sum()
+    duplicates = df.duplicated(subset=["dup_group"]).sum()
+    print(f"\t{len(candidates)}/{len(df)} files share their size, {collide.sum()} fully hashed "
+          f"({round(read / 1e6, 1)} MB read)")
+    print(f"\t{duplicates} duplicated files found")
+
+    return df
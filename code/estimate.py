@@ -0,0 +1,238 @@
+from imports import *
+import uuid
+from compare import DestinationIndex, destination_exists, destination_stats, MTIME_TOLERANCE
+from schedule import Bandwidth
+from statpool import mount_point
+from transfer import same_device
+from execute import destination_volumes
+from compact import plan_paths
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd plans directory
+plans_dir = here.parent / "_plans"
+
+# Size of the file written to measure the throughput of a mount
+PROBE_BYTES = 16 * 1024 * 1024
+# Number of small files written to measure the cost of a file
+PROBE_FILES = 16
+
+STATES = ["new", "skip", "replace"]
+
+
+def existing_parent(path:str) -> str:
+    """
+    The closest directory above (or at) path that exists.
+    """
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def probe_mount(dirname:str, size:int=PROBE_BYTES, files:int=PROBE_FILES) -> dict:
+    """
+    Calibrates a mount by writing to dirname (under hidden names, removed
+    after): one file of size bytes, synced, for the throughput, and a few
+    empty files with their times set, for the fixed cost of each file
+    (open, create, setattr and close round trips on a network share).
+    Returns {"mb_per_s", "file_latency_s"}.
+    """
+    prefix = os.path.join(dirname, f".probe_{uuid.uuid4().hex[:8]}")
+    block = os.urandom(1024 * 1024)
+    paths = [f"{prefix}.bin"] + [f"{prefix}_{i}" for i in range(files)]
+    try:
+        started = time.perf_counter()
+        with open(paths[0], "wb") as f:
+            for written in range(0, size, len(block)):
+                f.write(block[:size - written])
+            f.flush()
+            os.fsync(f.fileno())
+        throughput = size / max(time.perf_counter() - started, 1e-6)
+
+        started = time.perf_counter()
+        for path in paths[1:]:
+            with open(path, "wb"):
+                pass
+            os.utime(path, (0, 0))
+        latency = (time.perf_counter() - started) / max(files, 1)
+    finally:
+        # Remove every file, even if one can't be removed
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"\tWARNING: could not remove {path} ({e})")
+
+    return {"mb_per_s": throughput / 1e6, "file_latency_s": latency}
+
+
+def destination_states(df:pd.DataFrame, replace:bool=False, compare:str=None) -> pd.Series:
+    """
+    What execute() will do with each file of a migration table:
+        - "new": not at destination, migrated
+        - "skip": at destination and not replace (or identical by size
+          and mtime, if compare is "size_mtime")
+        - "replace": at destination, migrated again (for the hash compare
+          policies this is an upper bound, identical files are skipped)
+    Uses the `on_server` column set by a catalog (see catalog.py) if
+    present, otherwise lists each destination directory once.
+    """
+    if "on_server" in df.columns:
+        exists = df["on_server"].astype(bool).to_list()
+        dst_stats = [None] * len(df)
+    else:
+        index = DestinationIndex()
+        paths = plan_paths(df, "abspath_dst")
+        exists = [destination_exists(p, index) for p in paths]
+        # Stats are only needed to compare sizes and mtimes
+        if replace and compare == "size_mtime":
+            dst_stats = [destination_stats(p, index) if found else None
+                         for p, found in zip(paths, exists)]
+        else:
+            dst_stats = [None] * len(df)
+
+    # Compact plans store times as int64 (ns)
+    mtimes = pd.to_datetime(df["st_mtime"]).values.astype("datetime64[s]").astype("int64")
+    states = []
+    for found, stats, size, mtime in zip(exists, dst_stats, df["st_size"], mtimes):
+        if not found:
+            states.append("new")
+        elif not replace:
+            states.append("skip")
+        elif (compare == "size_mtime" and stats is not None and stats.st_size == size
+              and abs(stats.st_mtime - mtime) < MTIME_TOLERANCE):
+            states.append("skip")
+        else:
+            states.append("replace")
+
+    return pd.Series(states, index=df.index)
+
+
+def estimate(*, df:pd.DataFrame, mode:str, replace:bool, compare:str=None, workers:int=1,
+             volume_limit:int=2, bandwidth:Bandwidth=None, probe:bool=False) -> pd.DataFrame:
+    """
+    Predicts the cost of executing a migration table (full or compact),
+    per destination volume: files and bytes new, skipped and replaced (see
+    destination_states), and the time to migrate them, from the throughput
+    and per-file latency of each mount, capped by bandwidth, if probe
+    (see probe_mount, measured once per mount: it writes to the server).
+    Moves within a device are renames, which only cost the latency.
+    Without probe only files and bytes are counted, and so are volumes
+    that can't be probed (seconds is NaN).
+    """
+    print("\nEstimating the migration...")
+
+    table = pd.DataFrame({"volume": destination_volumes(df).to_numpy(),
+                          "state": destination_states(df, replace=replace, compare=compare).to_numpy(),
+                          "bytes": df["st_size"].to_numpy()})
+
+    counts = table.pivot_table(index="volume", columns="state", values="bytes",
+                               aggfunc=["count", "sum"], fill_value=0)
+    output = pd.DataFrame(index=counts.index)
+    for state in STATES:
+        output[f"files_{state}"] = counts[("count", state)] if ("count", state) in counts else 0
+        output[f"bytes_{state}"] = counts[("sum", state)] if ("sum", state) in counts else 0
+
+    if not probe:
+        return output.reset_index()
+
+    # Volumes receive files in parallel, each from at most volume_limit threads
+    parallel = max(1, min(workers, volume_limit))
+    volume_cap = bandwidth.volume_limit if bandwidth is not None else None
+    global_cap = bandwidth.global_bucket.rate if bandwidth is not None and bandwidth.global_bucket else None
+
+    probes = {}
+    rates, latencies, seconds = [], [], []
+    for volume in output.index:
+        dirname = existing_parent(volume)
+        mount = mount_point(dirname)
+        if mount not in probes:
+            print(f"\tProbing {mount}...")
+            try:
+                probes[mount] = probe_mount(dirname)
+            except OSError as e:
+                # Read-only, missing or unreachable volume, files and bytes only
+                print(f"\tWARNING: could not probe {volume} ({e}), no time estimate for it")
+                probes[mount] = None
+        if probes[mount] is None:
+            rates.append(np.nan)
+            latencies.append(np.nan)
+            seconds.append(np.nan)
+            continue
+        rate = probes[mount]["mb_per_s"] * 1e6
+        latency = probes[mount]["file_latency_s"]
+        rate = min(r for r in [rate, volume_cap, global_cap] if r)
+
+        files = output.loc[volume, "files_new"] + output.loc[volume, "files_replace"]
+        size = output.loc[volume, "bytes_new"] + output.loc[volume, "bytes_replace"]
+        sources = plan_paths(df.loc[(table["volume"] == volume).to_numpy()], "abspath_src")
+        if mode == "move" and len(sources) and same_device(sources.iloc[0], dirname + "/"):
+            # Renames, no data moved
+            size = 0
+
+        rates.append(rate / 1e6)
+        latencies.append(latency * 1000)
+        seconds.append(size / rate + files * latency / parallel)
+
+    output["mb_per_s"] = rates
+    output["file_latency_ms"] = latencies
+    output["seconds"] = seconds
+    return output.reset_index()
+
+
+def total_seconds(table:pd.DataFrame, workers:int=1, bandwidth:Bandwidth=None) -> float:
+    """
+    Expected duration of the whole migration: volumes one after the
+    other with one worker, otherwise at the pace of the slowest volume
+    (or of the global bandwidth cap). None if a volume could not be probed.
+    """
+    if "seconds" not in table.columns or table["seconds"].isnull().any():
+        return None
+    if workers <= 1:
+        return table["seconds"].sum()
+    seconds = table["seconds"].max()
+    if bandwidth is not None and bandwidth.global_bucket:
+        size = (table["bytes_new"] + table["bytes_replace"]).sum()
+        seconds = max(seconds, size / bandwidth.global_bucket.rate)
+    return seconds
+
+
+def show_estimate(table:pd.DataFrame, seconds:float=None):
+    """
+    Prints the estimate, sizes in MB.
+    """
+    view = table.copy()
+    for state in STATES:
+        view[f"bytes_{state}"] = (view[f"bytes_{state}"] / 1e6).round(1)
+    view = view.rename(columns={f"bytes_{s}": f"mb_{s}" for s in STATES})
+    print(tabulate(view.round(2), headers=list(view.columns), showindex=False))
+
+    new = table["files_new"].sum()
+    replaced = table["files_replace"].sum()
+    size = (table["bytes_new"] + table["bytes_replace"]).sum()
+    summary = f"\n\t{new + replaced} files to migrate ({new} new, {replaced} replaced), {size / 1e9:.2f} GB"
+    if seconds is not None:
+        summary += f", about {pd.Timedelta(seconds=round(seconds))}"
+    print(summary)
+
+
+def save_estimate(table:pd.DataFrame, plan_path:str=None) -> str:
+    """
+    Saves the estimate next to the plan it was made for
+    ({time}_plan.csv -> {time}_estimate.csv).
+    """
+    if plan_path is None:
+        timestring = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S_%f")
+        plan_path = str(plans_dir / f"{timestring}_plan.csv")
+    stem = str(plan_path).rsplit("_plan.", 1)[0]
+    saveas = f"{stem}_estimate.csv"
+    table.to_csv(saveas, index=False)
+    print(f"\n\tEstimate saved ({os.path.basename(saveas)})")
+    return saveas
+
@@ -1,5 +1,15 @@
 from imports import *
 from helpers import *
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from statpool import mount_point
+from transfer import copy_file, copy_verified, move_file
+from journal import Journal, IN_PROGRESS, DONE
+from compact import expand_plan
+from metrics import stage, save_metrics, with_summary, METRICS
+from schedule import schedule_units, Bandwidth, TimeWindow
+from bundle import bundle_groups, bundled_names, write_bundle, add_pending, release_sources, INDEX_SUFFIX
+from compare import DestinationIndex, destination_exists, destination_stats, identical
 
 # Get the directory of this file
 here = pathlib.Path(__file__).parent.absolute()
@@ -7,82 +17,449 @@ here = pathlib.Path(__file__).parent.absolute()
 plans_dir = here.parent / "_plans"
 
 
-def execute(*, df:pd.DataFrame, mode:str, replace:str):
+def execute(*, df:pd.DataFrame, mode:str, replace:str, catalog=None,
+            workers:int=1, volume_limit:int=2, journal:str=None, verify:str=None,
+            metrics:str=None, schedule:bool=False, bandwidth:Bandwidth=None,
+            window:TimeWindow=None, bundle:int=0, bundle_keep:bool=False,
+            compare:str=None):
+    """
+    Migrates each file in df from abspath_src to abspath_dst.
+    If a server catalog is passed, migrated files are added to it.
+    With workers > 1 files are migrated in parallel, with at most
+    volume_limit files in flight on each destination volume.
+    If a journal path is passed, the state of each file is logged there
+    and files are written atomically; running again with the same journal
+    resumes the migration, skipping the files already done.
+    verify ("readback" or "stat") checks each copy, see migrate_file.
+    df can be a compact plan (see compact.py), paths are built here.
+    The timings of the stages of the run (see metrics.py) are added to
+    the report. If metrics ("jsonl" or "prometheus") is passed, they are
+    also saved next to it.
+    With schedule, files are reordered by size and destination volume,
+    small files are migrated in batches (see schedule.py); bandwidth caps
+    the bytes/sec copied and window the time of day migrations start.
+    The report has the start and end time of each file.
+    With bundle > 0, files smaller than bundle bytes going to the same
+    directory are sent as one tar (see migrate_bundle), unpacked on the
+    server by unbundle.py, or kept as indexed archives if bundle_keep.
+    Sources of bundled files are only removed (mode "move") once the
+    bundle has been unpacked, by a later run (see bundle.release_sources).
+    With replace, compare ("size_mtime", "partial_hash" or "full_hash")
+    skips files identical to their destination (see compare.py).
+    """
 
     print(f"\nExecuting...")
 
-    # Create destination directories if they don't exist
-    dst_dirs = df["abspath_dst"].apply(lambda x: os.path.dirname(x))
-    dst_dirs_unique = dst_dirs.unique()
-    _ = [os.makedirs(d, exist_ok=True) for d in dst_dirs_unique]
+    # Stages are timed, the summary is added to the report
+    METRICS.enable()
 
-    reports = []
-    # tqdm wraps the iterable and roduces a progress bar
-    for i in tqdm(df.index):
+    if journal is not None:
+        journal = Journal(journal)
 
-        # Get src and dst directories
-        src = df.loc[i,"abspath_src"]
-        dst = df.loc[i,"abspath_dst"]
+    report_table = run_migrations(df=df, mode=mode, replace=replace, workers=workers,
+                                  volume_limit=volume_limit, journal=journal, verify=verify,
+                                  schedule=schedule, bandwidth=bandwidth, window=window,
+                                  bundle=bundle, bundle_keep=bundle_keep, compare=compare)
 
-        # Migrate file
-        report = migrate_file(src=src, dst=dst, mode=mode, replace=replace)
-        reports.append(report)
+    if journal is not None:
+        journal.close()
 
-    # Build a table of migrations
-    report_table = pd.DataFrame(reports)
+    # Summarise migrations
     copied = report_table["copied"].sum()
     moved = report_table["moved"].sum()
     skipped = report_table["skipped"].sum()
+    identical_files = (report_table["outcome"] == "skipped-identical").sum()
+    replaced = (report_table["outcome"] == "replaced").sum()
+    bundled = (report_table["outcome"] == "bundled").sum()
     error = report_table["error"].count()
 
     print(f"\n - copied {copied}"
           f"\n - moved {moved}"
-          f"\n - skipped {skipped}"
+          f"\n - bundled {bundled}"
+          f"\n - skipped {skipped} ({identical_files} identical)"
+          f"\n - replaced {replaced}"
           f"\n - errors {error}")
 
     # Save plan to file for inspection
     timestring = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S_%f")
     saveas = plans_dir / f"{timestring}_migration_report.csv"
-    report_table.to_csv(saveas)
+    with_summary(report_table, METRICS.summary()).to_csv(saveas)
+
+    if metrics is not None:
+        extension = "prom" if metrics == "prometheus" else metrics
+        save_metrics(plans_dir / f"{timestring}_metrics.{extension}", metrics_format=metrics)
+    else:
+        METRICS.reset()
+
+    if catalog is not None:
+        catalog.update_from_report(report=report_table, df=df)
 
     print(f"\nReport ready ({os.path.basename(saveas)})")
     print(f"Preview:\n")
     print(tabulate(report_table.head(), headers=list(report_table.columns)))
 
 
-def migrate_file(*, src:str, dst:str, mode:str, replace:bool) -> dict:
+def run_migrations(*, df:pd.DataFrame, mode:str, replace:bool, workers:int=1,
+                   volume_limit:int=2, journal:Journal=None, verify:str=None,
+                   schedule:bool=False, bandwidth:Bandwidth=None,
+                   window:TimeWindow=None, bundle:int=0, bundle_keep:bool=False,
+                   compare:str=None) -> pd.DataFrame:
+    """
+    Migrates the files in df (see execute) and returns the migration
+    report, with one row per row of df, in the same order.
+    """
+    if bundle > 0 and bundle_keep and mode == "move":
+        raise ValueError("bundles kept as archives are copies, bundle_keep requires mode 'copy'")
+
+    # Sources of files moved in bundles that have been unpacked since
+    removed, pending = release_sources()
+    if removed or pending:
+        print(f"\t{removed} bundled sources removed, {pending} waiting for unbundle.py")
+
+    df = expand_plan(df)
+
+    # Create destination directories if they don't exist
+    dst_dirs = df["abspath_dst"].apply(lambda x: os.path.dirname(x))
+    dst_dirs_unique = dst_dirs.unique()
+    _ = [os.makedirs(d, exist_ok=True) for d in dst_dirs_unique]
+
+    # Reports of the files migrated by a previous run
+    done = [None] * len(df)
+    if journal is not None:
+        done = [journal.done(s, d) for s, d in zip(df["abspath_src"], df["abspath_dst"])]
+        print(f"\t{len(df) - done.count(None)} files already migrated ({journal.path})")
+
+    # Rows not migrated yet (a mask, an empty list would select columns)
+    todo = df[np.array([d is None for d in done], dtype=bool)]
+    if journal is not None:
+        journal.pending(zip(todo["abspath_src"], todo["abspath_dst"]))
+
+    # Volumes are only needed to schedule, throttle or parallelise
+    if schedule or bandwidth is not None or workers > 1:
+        volumes = destination_volumes(todo)
+    else:
+        volumes = pd.Series(None, index=todo.index, dtype=object)
+
+    # Units of work, in the order they run (one file per unit by default)
+    if schedule:
+        units = schedule_units(todo, volumes)
+    else:
+        units = [[i] for i in range(len(todo))]
+
+    rows = list(zip(todo["abspath_src"], todo["abspath_dst"], volumes))
+    # Destination directories are listed once, not stat'd file by file
+    options = dict(mode=mode, replace=replace, journal=journal, verify=verify,
+                   bandwidth=bandwidth, window=window, index=DestinationIndex(),
+                   compare=compare)
+    todo_reports = [None] * len(todo)
+
+    if bundle > 0:
+        # Send small files in bundles, one per destination directory
+        bundles = bundle_groups(todo, threshold=bundle)
+        bundled = {p for positions in bundles for p in positions}
+        print(f"\t{len(bundled)} small files in {len(bundles)} bundles")
+        for positions in tqdm(bundles):
+            migrate_bundle(positions=positions, rows=rows, reports=todo_reports,
+                           keep=bundle_keep, **options)
+        units = [[p for p in unit if p not in bundled] for unit in units]
+        units = [unit for unit in units if unit]
+
+    if workers > 1:
+        reports = migrate_parallel(rows=rows, units=units, workers=workers,
+                                   volume_limit=volume_limit, **options)
+        for unit in units:
+            for position in unit:
+                todo_reports[position] = reports[position]
+    else:
+        # tqdm produces a progress bar
+        progress = tqdm(total=sum(len(unit) for unit in units))
+        for unit in units:
+
+            # Migrate files
+            migrate_unit(unit=unit, rows=rows, reports=todo_reports, **options)
+            progress.update(len(unit))
+        progress.close()
+
+    # Put reports back in the order of df
+    todo_reports = iter(todo_reports)
+    reports = [d if d is not None else next(todo_reports) for d in done]
+
+    output = pd.DataFrame(reports, columns=list(new_report("", "").keys()))
+    output["started_at"] = pd.to_datetime(output["started_at"])
+    output["finished_at"] = pd.to_datetime(output["finished_at"])
+    return output
+
+
+def destination_volumes(df:pd.DataFrame) -> pd.Series:
+    """
+    The destination root of each file: `parentdir_dst` as set by
+    migration_table, or the mount point of the destination directory.
+    """
+    if "parentdir_dst" in df.columns:
+        return df["parentdir_dst"]
+    return df["abspath_dst"].map(lambda x: mount_point(os.path.dirname(x)))
+
+
+def migrate_unit(*, unit:List[int], rows:list, reports:list, bandwidth:Bandwidth=None,
+                 window:TimeWindow=None, **options):
+    """
+    Migrates the rows (src, dst, volume) at the positions in unit one
+    after the other, storing their reports at the same positions.
+    Waits for the time window to open before starting.
+    """
+    if window is not None:
+        window.wait()
+    for position in unit:
+        src, dst, volume = rows[position]
+        throttle = bandwidth.throttle(volume) if bandwidth is not None else None
+        reports[position] = migrate_row(src=src, dst=dst, throttle=throttle, **options)
+
+
+def migrate_bundle(*, positions:List[int], rows:list, reports:list, mode:str, replace:bool,
+                   journal:Journal=None, verify:str=None, bandwidth:Bandwidth=None,
+                   window:TimeWindow=None, keep:bool=False, index:DestinationIndex=None,
+                   compare:str=None):
+    """
+    Migrates the rows (src, dst, volume) at positions, all going to the
+    same directory, as one bundle (see bundle.write_bundle): one large
+    write instead of an open, create, setattr and close per file. Files
+    already at destination (found in the index) go through migrate_row
+    to be skipped, compared or replaced, files in another bundle of the
+    directory are skipped. Each file still gets its own report, with
+    strategy "bundle" (or "archive" if kept) and outcome "bundled" (not
+    copied or moved: the file is not at destination until unpacked),
+    stored at its position in reports.
+    Sources are not removed (mode "move"), but recorded as pending until
+    the bundle is unpacked (see bundle.release_sources).
+    """
+    if window is not None:
+        window.wait()
+
+    started = pd.Timestamp.now().isoformat()
+    dirname = os.path.dirname(rows[positions[0]][1])
+    throttle = bandwidth.throttle(rows[positions[0]][2]) if bandwidth is not None else None
+    index = DestinationIndex() if index is None else index
+    in_bundles = bundled_names(index.listing(dirname))
+
+    members = []
+    for position in positions:
+        src, dst, _ = rows[position]
+        if os.path.basename(dst) in in_bundles:
+            # Waiting to be unpacked, or kept in an archive
+            report = new_report(src, dst)
+            report["skipped"] = True
+            report["outcome"] = "skipped"
+            report["started_at"] = report["finished_at"] = started
+            reports[position] = report
+        elif not destination_exists(dst, index):
+            report = new_report(src, dst)
+            report["started_at"] = started
+            reports[position] = report
+            members.append(position)
+        else:
+            reports[position] = migrate_row(src=src, dst=dst, mode=mode, replace=replace,
+                                            journal=journal, verify=verify, throttle=throttle,
+                                            index=index, compare=compare)
+    if not members:
+        return
+
+    done = []
+    with stage("migrate_bundle", files=len(members)) as record:
+        if journal is not None:
+            journal.write([{"src": rows[p][0], "dst": rows[p][1], "state": IN_PROGRESS}
+                           for p in members])
+        try:
+            path, results = write_bundle([(rows[p][0], os.path.basename(rows[p][1])) for p in members],
+                                      dirname, keep=keep, verify=verify, throttle=throttle)
+        except Exception as ex:
+            results = [{"digest": None, "size": 0, "error": str(ex)}] * len(members)
+        else:
+            # Next bundles of the directory skip its members
+            index.add(path + INDEX_SUFFIX)
+
+        for position, result in zip(members, results):
+            report = reports[position]
+            report["digest"] = result["digest"]
+            report["error"] = result["error"]
+            if result["error"] is None:
+                report["strategy"] = "archive" if keep else "bundle"
+                report["outcome"] = "bundled"
+                done.append(position)
+
+        record["errors"] = len(members) - len(done)
+        record["bytes"] = sum(r["size"] for r in results if r["error"] is None)
+
+        # Failed files stay in progress, and are retried on the next run
+        if journal is not None:
+            journal.write([{"src": rows[p][0], "dst": rows[p][1], "state": DONE,
+                            "report": reports[p]} for p in done])
+
+        if mode == "move" and done:
+            # Sources are removed once the bundle is unpacked
+            add_pending(path, [(rows[p][0], os.path.basename(rows[p][1])) for p in done])
+
+    finished = pd.Timestamp.now().isoformat()
+    for position in members:
+        reports[position]["finished_at"] = finished
+        if reports[position]["error"] is not None:
+            reports[position]["outcome"] = "error"
+
+
+def migrate_parallel(*, rows:list, units:List[List[int]], workers:int, volume_limit:int,
+                     **options) -> List[dict]:
+    """
+    Runs migrate_unit for each unit on a pool of threads. Each destination
+    volume gets its own pool of volume_limit threads, so a busy share
+    doesn't hold back the others, and at most `workers` units are in
+    flight overall. Reports are returned in the order of rows.
+    """
+    reports = [None] * len(rows)
+    in_flight = threading.BoundedSemaphore(workers)
+    progress = tqdm(total=len(rows))
+
+    def task(unit):
+        with in_flight:
+            migrate_unit(unit=unit, rows=rows, reports=reports, **options)
+        progress.update(len(unit))
+
+    # Units never span volumes
+    volumes = [rows[unit[0]][2] for unit in units]
+    pools = {v: ThreadPoolExecutor(max_workers=volume_limit) for v in set(volumes)}
+    try:
+        futures = [pools[v].submit(task, unit) for unit, v in zip(units, volumes)]
+        for future in futures:
+            future.result()
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+        progress.close()
+
+    return reports
+
+
+def migrate_row(*, src:str, dst:str, journal:Journal=None, **options) -> dict:
+    """
+    Calls migrate_file, logging the state of the file in the journal.
+    """
+    if journal is None:
+        return migrate_file(src=src, dst=dst, **options)
+
+    recovered = (journal.state(src, dst) == IN_PROGRESS
+                 and options["mode"] == "move"
+                 and not os.path.exists(src)
+                 and os.path.exists(dst))
+
+    if recovered:
+        # A previous run crashed after moving the file, before logging it
+        report = new_report(src, dst)
+        report["moved"] = True
+        report["strategy"] = "journal"
+        report["outcome"] = "moved"
+    else:
+        journal.record(src=src, dst=dst, state=IN_PROGRESS)
+        report = migrate_file(src=src, dst=dst, atomic=True, **options)
+
+    # Failed files stay in progress, and are retried on the next run
+    if report["error"] is None:
+        journal.record(src=src, dst=dst, state=DONE, report=report)
+    return report
+
+
+def new_report(src:str, dst:str) -> dict:
 
     report = {"src": os.path.basename(src),
               "dst": os.path.basename(dst),
               "copied": False,
               "moved": False,
               "skipped": False,
-              "error": None}
+              "error": None,
+              "strategy": None,
+              "digest": None,
+              "outcome": None,
+              "started_at": None,
+              "finished_at": None}
+    return report
 
-    try:
-        if not os.path.exists(src):
-            message = f"DATA INTEGRITY: File {src} expected but not found. Skipping"
-            raise ValueError(message)
 
-        if os.path.exists(dst) and not replace:
-            # If it already exists and we don't want to relace skip
-            report["skipped"] = True
-        else:
-            # File in src exists
-            if mode =="copy":
-                # copy file preserving metadata
-                # https://docs.python.org/3/library/shutil.html#shutil.copy2
-                shutil.copy2(src, dst)
-                report["copied"] = True
-            elif mode =="move":
-                # Move file preserving metadata
-                # https://docs.python.org/3/library/shutil.html#shutil.move
-                shutil.move(src, dst, copy_function=shutil.copy2)
-                report["moved"] = True
-            else:
-                message = f"Migration mode {args.mode} not supported."
+def migrate_file(*, src:str, dst:str, mode:str, replace:bool, atomic:bool=False,
+                 verify:str=None, throttle=None, index:DestinationIndex=None,
+                 compare:str=None) -> dict:
+    """
+    Copies or moves src to dst and returns a report of what happened.
+    If atomic, dst is written under a temporary name and renamed when complete.
+    If verify is "readback" or "stat", the content is hashed while copied,
+    the copy is checked (see transfer.copy_verified) and, when moving, src
+    is only deleted after the check. The hash is reported in `digest`.
+    throttle paces the copy (see transfer.copy_file).
+    If dst exists it is skipped, unless replace. With replace and a compare
+    policy (see compare.identical) identical files are skipped too.
+    `outcome` is one of copied, moved, replaced, skipped, skipped-identical
+    or error. dst is looked up in index (see compare.DestinationIndex).
+    """
+    report = new_report(src, dst)
+    report["started_at"] = pd.Timestamp.now().isoformat()
+
+    with stage("migrate_file", files=1) as record:
+        try:
+            try:
+                src_stats = os.stat(src)
+            except FileNotFoundError:
+                message = f"DATA INTEGRITY: File {src} expected but not found. Skipping"
                 raise ValueError(message)
+            record["bytes"] = src_stats.st_size
+            exists = destination_exists(dst, index)
+
+            if exists and not replace:
+                # If it already exists and we don't want to relace skip
+                report["skipped"] = True
+                report["outcome"] = "skipped"
+                record["bytes"] = 0
+            elif exists and compare and identical(src, dst, src_stats=src_stats,
+                                                  dst_stats=destination_stats(dst, index),
+                                                  policy=compare):
+                # Same file already there, nothing to replace
+                report["skipped"] = True
+                report["outcome"] = "skipped-identical"
+                record["bytes"] = 0
+            else:
+                # File in src exists
+                if mode =="copy" and verify:
+                    # copy file hashing it on the way, then check the copy
+                    report["digest"] = copy_verified(src, dst, verify, atomic=atomic,
+                                                     throttle=throttle)
+                    report["strategy"] = "verified"
+                    report["copied"] = True
+                elif mode =="copy":
+                    # copy file preserving metadata (like shutil.copy2),
+                    # with kernel-level copies where possible (see transfer.py)
+                    report["strategy"] = copy_file(src, dst, atomic=atomic, throttle=throttle)
+                    report["copied"] = True
+                elif mode =="move":
+                    # Move file preserving metadata, renaming on the same device
+                    strategy, digest = move_file(src, dst, atomic=atomic, verify=verify,
+                                                 throttle=throttle)
+                    report["strategy"] = strategy
+                    report["digest"] = digest
+                    report["moved"] = True
+                else:
+                    message = f"Migration mode {args.mode} not supported."
+                    raise ValueError(message)
+
+                if exists:
+                    report["outcome"] = "replaced"
+                else:
+                    report["outcome"] = "copied" if mode == "copy" else "moved"
+
+                if index is not None:
+                    index.add(dst)
+                    if mode == "move":
+                        index.remove(src)
+
+        except Exception as ex:
+            report["error"] = str(ex)
+            report["outcome"] = "error"
+            record["errors"] = 1
+            record["bytes"] = 0
 
-    except Exception as ex:
-        report["error"] = str(ex)
+    report["finished_at"] = pd.Timestamp.now().isoformat()
     return report
@@ -35,6 +35,8 @@ class Arguments:
     replace: bool = False
     # Migration mode
     mode: str = 'copy'
+    # Listing engine
+    engine: str = 'scandir'
 
     def __iter__(self):
         for attr, value in self.__dict__.items():
@@ -47,7 +49,8 @@ class Arguments:
                 f"\n  server_home: {self.server['HOME']}"
                 f"\n  ignore: {self.ignore}"
                 f"\n  replace: {self.replace}"
-                f"\n  mode: {self.mode}")
+                f"\n  mode: {self.mode}"
+                f"\n  engine: {self.engine}")
 
     def __post_init__(self):
 
@@ -70,8 +73,13 @@ class Arguments:
         if self.mode not in allowed_modes:
             raise ValueError(f"mode can be one of {allowed_modes}, passes {self.mode}")
 
+        # Check listing engine is allowed
+        allowed_engines = ["glob", "scandir"]
+        if self.engine not in allowed_engines:
+            raise ValueError(f"engine can be one of {allowed_engines}, passed {self.engine}")
+
         # Make sure staging and server direcotry keys match with file types
-        file_types = list(extensions_and_types()["file_type"].unique())
+        file_types = list(FILE_EXTENSIONS)
         # Get keys used to map staging volumes
         staging_keys = [k for k in self.staging.keys() if k is not "HOME"]
         # Find keys that do not appear in file_types
@@ -108,11 +116,12 @@ def add_filetype(*, table:pd.DataFrame) -> pd.DataFrame:
     Expects two columns in table: "basename_src", "extension_src"
     """
 
-    lookup = extensions_and_types()
     table["extension_src"] = table["extension_src"].str.lower()
 
-    # Left join table with file_types
-    output = pd.merge(table, lookup, how="left", left_on="extension_src", right_on="file_ext")
+    # Map extensions to file types
+    output = table
+    output["file_type"] = file_types(output["extension_src"])
+    output["file_ext"] = output["extension_src"].where(output["file_type"].notnull())
 
     missing_types = output["file_type"].isnull()
     missing_types_tot = missing_types.sum()
@@ -125,27 +134,80 @@ def add_filetype(*, table:pd.DataFrame) -> pd.DataFrame:
     return output
 
 
-def extensions_and_types():
+# Known file extensions for each file type (image, video, audio, archive)
+FILE_EXTENSIONS = {
+    "image": [".xmp", ".jpg", ".jpeg", ".png", ".gif", ".cr2",
+              ".tif", ".bmp", ".psd", ".ico", ".svg", ".thm", ".tiff"],
+    "video": [".mp4", ".mov", ".avi", ".wmv",".web", ".mpg", ".swf", ".cmproj", ".3gp"],
+    "audio": [".mid",".mp3",".m4a",".ogg",".fla",".wav",".amr", ".nhzx"],
+    "archive": [".txt", ".epub", ".zip",".tar",".gz",".bz2",".pdf",".exe",".ps",".sqlite",
+                ".doc",".docx",".xls",".xlsx",".ppt",".pptx",".odt",".ods",".odp",
+                ".rtf"],
+}
+
+
+def build_registry(extensions:dict) -> MappingProxyType:
     """
-    Builds a dataframe of known file extensions and their types (image, video, audio, archive).
+    Builds a read-only {extension: file_type} mapping from a
+    {file_type: [extensions]} dict. Extensions are lower case.
     """
-    image_ext = [".xmp", ".jpg", ".jpeg", ".png", ".gif", ".cr2",
-                 ".tif", ".bmp", ".psd", ".ico", ".svg", ".thm", ".tiff"]
+    registry = {}
+    for file_type, exts in extensions.items():
+        for ext in exts:
+            registry[ext.lower()] = file_type
+    return MappingProxyType(registry)
 
-    video_ext = [".mp4", ".mov", ".avi", ".wmv",".web", ".mpg", ".swf", ".cmproj"]
-    audio_ext = [".mid",".mp3",".m4a",".ogg",".fla",".wav",".amr", ".nhzx"]
 
-    archive_ext = [".txt", ".epub", ".zip",".tar",".gz",".bz2",".pdf",".exe",".ps",".sqlite",
-                   ".doc",".docx",".xls",".xlsx",".ppt",".pptx",".odt",".ods",".odp",
-                   ".rtf"]
+# Extension -> file type, built once (see register_extensions)
+EXTENSION_TYPES = build_registry(FILE_EXTENSIONS)
 
-    image = list(zip(["image"]*len(image_ext), image_ext))
-    video = list(zip(["video"]*len(video_ext), video_ext))
-    audio = list(zip(["audio"]*len(audio_ext), audio_ext))
-    archive =  list(zip(["archive"]*len(archive_ext), archive_ext))
 
-    output = pd.DataFrame(image+video+audio+archive, columns=["file_type", "file_ext"])
-    return output
+def register_extensions(extensions:dict):
+    """
+    Adds (or remaps) extensions, e.g. {"image": [".heic"], "video": [".mts"]}.
+    File types must be one of the known ones.
+    """
+    global EXTENSION_TYPES
+
+    unknown = [t for t in extensions if t not in FILE_EXTENSIONS]
+    if unknown:
+        raise ValueError(f"supported files types are {list(FILE_EXTENSIONS)}, passed {unknown}")
+
+    registry = dict(EXTENSION_TYPES)
+    registry.update(build_registry(extensions))
+    EXTENSION_TYPES = MappingProxyType(registry)
+
+
+def load_extensions(path:str):
+    """
+    Registers the extensions in a JSON config file,
+    formatted as {"file_type": [".ext", ...]}.
+    """
+    with open(path) as f:
+        register_extensions(json.load(f))
+
+
+def file_types(extensions:pd.Series) -> pd.Series:
+    """
+    Maps a column of extensions (any case, with the dot)
+    to file types. Unknown extensions get NaN.
+    """
+    return extensions.str.lower().map(EXTENSION_TYPES)
+
+
+def extensions_for(*file_type:str) -> List[str]:
+    """
+    Lists the (lower case) extensions of some file types.
+    """
+    return [ext for ext, t in EXTENSION_TYPES.items() if t in file_type]
+
+
+def extensions_and_types():
+    """
+    Builds a dataframe of known file extensions and their types (image, video, audio, archive).
+    """
+    output = pd.DataFrame(list(EXTENSION_TYPES.items()), columns=["file_ext", "file_type"])
+    return output[["file_type", "file_ext"]]
 
 
 def cli_ask_question(*, question:str, options:List[str]):
@@ -165,6 +227,31 @@ def cli_ask_question(*, question:str, options:List[str]):
     return answer
 
 
+def cli_answer(*, question:str, options:List[str], answer:str=None) -> str:
+    """
+    Like cli_ask_question, but if an answer is passed (headless runs)
+    it is returned without prompting.
+    """
+    if answer is None:
+        return cli_ask_question(question=question, options=options)
+
+    if answer not in options:
+        raise ValueError(f"answer can be one of {options}, passed {answer}")
+    print(f"{question}{answer}")
+    return answer
+
+
+def str_to_bool(value:str) -> bool:
+    """
+    Parses a boolean command line argument ("True", "false", "y", "0"...).
+    """
+    if value.lower() in ["true", "t", "yes", "y", "1"]:
+        return True
+    if value.lower() in ["false", "f", "no", "n", "0"]:
+        return False
+    raise argparse.ArgumentTypeError(f"expected a boolean, got {value}")
+
+
 def any_words_in_column(df, column, words, verbose=True):
 
     if not isinstance(df, pd.DataFrame):
@@ -197,13 +284,21 @@ def create_basename_dst(df:pd.DataFrame) ->pd.DataFrame:
     Creates the column `basename_dst`, based on original
     filename (`filename_src`) and extension (`extension_src`),
      as well as a timestamp if `filename_src` does not contain
-     time info.
+     time info. The time found in the name is kept in `time_src`
+     (names are not parsed again if df has `has_time` and `time_src`).
     """
 
     df["basename_dst"] = None
 
-    # Determine if there is time information in the basename
-    has_time = df["basename_src"].apply(has_time_info)
+    if "has_time" in df.columns:
+        # Parsed already (see plan.describe_incremental)
+        has_time = df.pop("has_time")
+        df["time_src"] = df.pop("time_src")
+    else:
+        # Determine if there is time information in the basename
+        times = detect_time_info(df["basename_src"])
+        has_time = times["has_time"]
+        df["time_src"] = times["time_src"]
 
     # Append time to those that don't have it
     where = has_time == False
@@ -222,21 +317,75 @@ def create_basename_dst(df:pd.DataFrame) ->pd.DataFrame:
     return df
 
 
-def has_time_info(basename:str) -> bool:
+# Date (and optionally time) as written by cameras, phones and apps:
+#   IMG_20200101_123456.jpg, PXL_20200101_123456789.jpg (Android/Pixel)
+#   IMG-20200101-WA0001.jpg (WhatsApp), FILE_20200101.jpg
+#   Screenshot_2020-01-01-12-34-56.png, 2020-01-01 12.34.56.jpg (Dropbox)
+#   2020-01-01.jpg, 20200101_123456(1).jpg (Google Takeout)
+TIME_PATTERN = re.compile(r"(?<!\d)"
+                          r"(?P<year>(?:19|20)\d{2})[-_.]?"
+                          r"(?P<month>[01]\d)[-_.]?"
+                          r"(?P<day>[0-3]\d)"
+                          r"(?:[-_. T]?"
+                          r"(?P<hour>[0-2]\d)[-_.:]?"
+                          r"(?P<minute>[0-5]\d)[-_.:]?"
+                          r"(?P<second>[0-5]\d)"
+                          r"|(?!\d))")
+
+# Names worth handing to the (slow) fallback parser
+YEAR_PATTERN = re.compile(r"(?:19|20)\d{2}")
+
+
+def detect_time_info(basenames:pd.Series) -> pd.DataFrame:
     """
-    Determine if there is time information in the basename.
-    It uses pd.to_datetime() to try and parse a timestamp from the name.
+    Determine if there is time information in each basename, for a whole
+    column at once. Returns a table (same index as basenames) with:
+        - has_time: True if a timestamp was found in the name
+        - time_src: the timestamp (NaT if not found)
+    Known camera/phone/app patterns are parsed with one compiled regex;
+    only the leftovers that contain a year go through parse_time_info.
+    """
+    # Remove the extension
+    names = basenames.astype(str).str.replace(r"(?<=.)\.[^.]*$", "", regex=True)
+
+    # Parse the common patterns in one pass
+    parts = names.str.extract(TIME_PATTERN).astype(float)
+    parts[["hour", "minute", "second"]] = parts[["hour", "minute", "second"]].fillna(0)
+    time = pd.to_datetime(parts, errors="coerce")
+
+    # Fallback on the generic parser for anything else that looks like a date
+    leftovers = time.isnull() & names.str.contains(YEAR_PATTERN)
+    if leftovers.any():
+        time[leftovers] = pd.to_datetime(names[leftovers].apply(parse_time_info))
+
+    output = pd.DataFrame({"has_time": time.notnull(), "time_src": time}, index=basenames.index)
+    return output
+
+
+def parse_time_info(filename:str) -> pd.Timestamp:
     """
-    bn = os.path.splitext(basename)[0].replace("_", " ")
+    Tries to parse a timestamp from a filename (without extension).
+    It uses pd.to_datetime() on the whole name and on each of its parts
+    separated by spaces or "_", and returns the first match (or NaT).
+    """
+    bn = filename.replace("_", " ")
     parts = bn.split(" ")
     parts.append(bn)
 
-    any_time = pd.Series([pd.to_datetime(p, errors="coerce") for p in parts])
-    if any_time.dropna().shape[0] > 0:
-        output = True
-    else:
-        output = False
-    return output
+    for p in parts:
+        time = pd.to_datetime(p, errors="coerce")
+        if not pd.isnull(time):
+            return time
+    return pd.NaT
+
+
+def has_time_info(basename:str) -> bool:
+    """
+    Determine if there is time information in the basename.
+    Single-name version of detect_time_info().
+    """
+    times = detect_time_info(pd.Series([basename]))
+    return bool(times["has_time"].iloc[0])
 
 
 def clean_directory(path:str):
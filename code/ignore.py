@@ -0,0 +1,85 @@
+from imports import *
+import fnmatch
+
+GLOB_CHARS = set("*?[")
+
+
+class IgnoreMatcher:
+    """
+    Compiles ignore patterns into two regular expressions (one for file
+    names, one for directory names), so each name is checked in one go.
+    Patterns are matched against single names, not whole paths:
+        - "name/"     prunes directories called name (globs allowed: "@*/")
+        - "*.tmp"     glob, ignores matching files
+        - ".json"     suffix, ignores files ending with it (any case), and
+                      prunes directories with exactly that name (".thumbnails")
+        - "name"      ignores files and prunes directories called name
+    Pruned directories are never descended into by the walker.
+    """
+
+    def __init__(self, patterns:List[str]):
+        self.patterns = list(patterns or [])
+
+        files = []
+        dirs = []
+        for p in self.patterns:
+            if p.endswith("/"):
+                dirs.append(glob_regex(p.rstrip("/")))
+            elif GLOB_CHARS & set(p):
+                files.append(glob_regex(p))
+            elif p.startswith("."):
+                files.append(f"(?i:.*{re.escape(p)})")
+                dirs.append(re.escape(p))
+            else:
+                files.append(re.escape(p))
+                dirs.append(re.escape(p))
+
+        self.file_regex = compile_alternatives(files)
+        self.dir_regex = compile_alternatives(dirs)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def __str__(self):
+        return f"IgnoreMatcher({self.patterns})"
+
+    def ignore_file(self, name:str) -> bool:
+        return self.file_regex is not None and self.file_regex.match(name) is not None
+
+    def prune_dir(self, name:str) -> bool:
+        return self.dir_regex is not None and self.dir_regex.match(name) is not None
+
+    def ignore_path(self, path:str, root:str="") -> bool:
+        """
+        True if a file path is ignored: its name matches, or any of
+        its directories below root is pruned.
+        """
+        relative = path[len(root):] if root and path.startswith(root) else path
+        *dirs, name = relative.strip("/").split("/")
+        return self.ignore_file(name) or any(self.prune_dir(d) for d in dirs)
+
+    def ignore_paths(self, paths:pd.Series, root:str="") -> pd.Series:
+        """
+        ignore_path() for a column of paths.
+        """
+        if not self:
+            return pd.Series(False, index=paths.index)
+        return paths.map(lambda p: self.ignore_path(p, root))
+
+
+def glob_regex(pattern:str) -> str:
+    """
+    Regex (without end anchor) for a glob pattern matched against a name.
+    """
+    regex = fnmatch.translate(pattern)
+    # translate() anchors the pattern at the end, we do it once for all
+    return regex[:-2] if regex.endswith("\\Z") else regex
+
+
+def compile_alternatives(regexes:List[str]):
+    """
+    Compiles regexes into one, matching a whole name against any of them.
+    """
+    if not regexes:
+        return None
+    return re.compile("(?:" + "|".join(f"(?:{r})" for r in regexes) + r")\Z", re.DOTALL)
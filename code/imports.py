@@ -1,21 +1,44 @@
 import os
+import re
 import sys
 import glob
+import json
 import time
 import shutil
-import requests
 import warnings
 import pathlib
+import importlib
+from types import MappingProxyType
 from pathlib import Path
 from dataclasses import dataclass, field, fields
 import pandas as pd
 import numpy as np
-import matplotlib
 import argparse                 #
 from tabulate import tabulate
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
-import seaborn as sns
 
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Tuple, Iterator
 from tqdm import tqdm
+
+# Plotting and notebook-only dependencies are slow to import and are not
+# needed to plan or execute a migration. They are imported on first use
+# (e.g. imports.plt), notebooks import them in envconfig.py.
+LAZY_IMPORTS = {"matplotlib": ("matplotlib", None),
+                "plt": ("matplotlib.pyplot", None),
+                "rcParams": ("matplotlib", "rcParams"),
+                "sns": ("seaborn", None),
+                "requests": ("requests", None)}
+
+
+def __getattr__(name:str) -> Any:
+
+    if name not in LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+
+    module, attribute = LAZY_IMPORTS[name]
+    value = importlib.import_module(module)
+    if attribute is not None:
+        value = getattr(value, attribute)
+
+    # Next access won't go through __getattr__
+    globals()[name] = value
+    return value
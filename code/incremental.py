@@ -0,0 +1,155 @@
+from imports import *
+import pickle
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from walk import WalkEntry, scan_dir
+from statpool import stat_files
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd snapshots directory
+snapshots_dir = here.parent / "_plans" / "snapshots"
+
+
+def snapshot_path(src_dir:str, patterns:List[str]=[]) -> pathlib.Path:
+    """
+    Where the snapshot of a source directory is stored. Listings depend
+    on the ignore patterns, so each set of patterns has its own snapshot.
+    """
+    key = os.path.abspath(src_dir) + "\n" + "\n".join(patterns)
+    key = hashlib.md5(key.encode()).hexdigest()
+    return snapshots_dir / f"{key}.pkl"
+
+
+def rows_path(src_dir:str, patterns:List[str]=[]) -> pathlib.Path:
+    """
+    Where the description of the files of a snapshot is stored (see
+    plan.describe_incremental).
+    """
+    return snapshot_path(src_dir, patterns).with_suffix(".rows.pkl")
+
+
+def load_snapshot(path:pathlib.Path) -> dict:
+
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_snapshot(path:pathlib.Path, snapshot:dict):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first, so a crash never leaves half a snapshot
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def describe_dir(path:str, cached:tuple, include_hidden:bool, matcher=None) -> tuple:
+    """
+    Returns (mtime_ns, subdirs, files) for a directory. Reuses the cached
+    listing if the directory mtime did not change, otherwise lists it again.
+    The second item of the output is True if the directory was rescanned.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as ex:
+        print(f"\tWARNING: could not stat {path} ({ex})")
+        return (None, [], []), True
+
+    if cached is not None and cached[0] == mtime:
+        return cached, False
+
+    files, subdirs = scan_dir(path, include_hidden, matcher)
+    return (mtime, subdirs, files), True
+
+
+def walk_incremental(src_dir:str, snapshot:dict, max_workers:int=8,
+                     include_hidden:bool=False, matcher=None,
+                     restat:bool=True) -> Tuple[List[WalkEntry], dict, int]:
+    """
+    Walks src_dir like walk.scandir_walk, but only lists directories whose
+    mtime changed since the snapshot (a directory mtime changes when files
+    are added, removed or renamed in it). Unchanged directories cost one
+    stat, and their files are taken from the snapshot.
+    Files modified in place don't change their directory mtime, so with
+    restat the files of unchanged directories are stat'd again (on the
+    stat pool, see statpool.stat_files): no listing, but fresh stats.
+    Returns the files, the new snapshot and the number of rescanned dirs.
+    """
+    entries = []
+    new_snapshot = {}
+    rescanned = 0
+    paths = {}
+    reused = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        def submit(path):
+            future = pool.submit(describe_dir, path, snapshot.get(path), include_hidden, matcher)
+            paths[future] = path
+            return future
+
+        pending = {submit(src_dir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                description, changed = future.result()
+                mtime, subdirs, files = description
+                path = paths.pop(future)
+                rescanned += changed
+                if mtime is not None:
+                    new_snapshot[path] = description
+                for subdir in subdirs:
+                    pending.add(submit(subdir))
+                if changed or not restat:
+                    entries.extend(files)
+                else:
+                    reused.append(path)
+
+    if reused:
+        entries.extend(refresh_stats(new_snapshot, reused, max_workers=max_workers))
+
+    return entries, new_snapshot, rescanned
+
+
+def refresh_stats(snapshot:dict, dirs:List[str], max_workers:int=8) -> List[WalkEntry]:
+    """
+    Stats again the files of dirs (taken from the snapshot), updating the
+    snapshot. Returns the files with their current stats (files that
+    vanished are left out).
+    """
+    files = [e.path for d in dirs for e in snapshot[d][2]]
+    stats = iter(stat_files(files, max_workers=max_workers)[0])
+
+    output = []
+    for d in dirs:
+        mtime, subdirs, cached = snapshot[d]
+        fresh = []
+        for entry in cached:
+            s = next(stats)
+            if s is not None:
+                fresh.append(WalkEntry(entry.path, s.st_mtime, s.st_ctime, s.st_size))
+        snapshot[d] = (mtime, subdirs, fresh)
+        output.extend(fresh)
+
+    return output
+
+
+def ls_incremental(*, src_dir:str, max_workers:int=8, matcher=None) -> List[WalkEntry]:
+    """
+    Lists all files in src_dir (with stats) reusing the snapshot of the
+    previous run, then saves the new snapshot. Files are sorted by path.
+    """
+    print(f"\nListing all files recursively (incremental, {max_workers} workers)...")
+
+    path = snapshot_path(src_dir, matcher.patterns if matcher else [])
+    snapshot = load_snapshot(path)
+    entries, new_snapshot, rescanned = walk_incremental(src_dir, snapshot, max_workers=max_workers,
+                                                        matcher=matcher)
+    save_snapshot(path, new_snapshot)
+
+    print(f"\t{rescanned}/{len(new_snapshot)} directories changed since last run")
+    return sorted(entries)
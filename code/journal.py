@@ -0,0 +1,94 @@
+from imports import *
+import json
+import threading
+
+PENDING = "pending"
+IN_PROGRESS = "in-progress"
+DONE = "done"
+
+
+class Journal:
+    """
+    Write-ahead log of a migration: one JSON line per state change of a
+    file (pending, in-progress, done), flushed and fsync'd before the
+    change happens, so a crashed run can be resumed where it stopped.
+    Reopening an existing journal loads the last state of each file.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.states = {}
+        self.reports = {}
+        self.lock = threading.Lock()
+        self.load()
+        self.file = open(path, "a")
+        if self.file.tell() > 0 and not self.ends_with_newline():
+            # Don't append to a line cut by a crash, the record would be lost
+            self.file.write("\n")
+
+    def __str__(self):
+        done = sum(s == DONE for s in self.states.values())
+        return f"Journal {self.path} ({done}/{len(self.states)} done)"
+
+    def load(self):
+
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line was cut by a crash
+                    continue
+                key = (record["src"], record["dst"])
+                self.states[key] = record["state"]
+                if record["state"] == DONE:
+                    self.reports[key] = record["report"]
+
+    def ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def close(self):
+        self.file.close()
+
+    def state(self, src:str, dst:str) -> str:
+        return self.states.get((src, dst))
+
+    def done(self, src:str, dst:str) -> dict:
+        """
+        The report of a file already migrated, None otherwise.
+        """
+        return self.reports.get((src, dst))
+
+    def write(self, records:List[dict]):
+        """
+        Appends records and waits for them to be on disk.
+        """
+        lines = "".join(json.dumps(r) + "\n" for r in records)
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            for r in records:
+                key = (r["src"], r["dst"])
+                self.states[key] = r["state"]
+                if r["state"] == DONE:
+                    self.reports[key] = r["report"]
+
+    def record(self, *, src:str, dst:str, state:str, report:dict=None):
+
+        record = {"src": src, "dst": dst, "state": state}
+        if report is not None:
+            record["report"] = report
+        self.write([record])
+
+    def pending(self, rows:List[Tuple[str, str]]):
+        """
+        Records a batch of files as pending (one fsync for all of them).
+        """
+        self.write([{"src": src, "dst": dst, "state": PENDING} for src, dst in rows
+                    if (src, dst) not in self.states])
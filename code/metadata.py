@@ -0,0 +1,246 @@
+from imports import *
+import struct
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from cache import FileCache
+from metrics import measured
+
+# Bytes read at the start of a file, most headers fit in there
+HEAD_SIZE = 64 * 1024
+
+# Extensions whose headers are read (others keep the stat based time)
+EXIF_EXTENSIONS = {".jpg", ".jpeg", ".tif", ".tiff", ".cr2", ".nef", ".dng", ".arw"}
+QUICKTIME_EXTENSIONS = {".mp4", ".mov", ".m4v", ".3gp"}
+
+# EXIF tags
+EXIF_IFD = 0x8769
+DATETIME = 0x0132
+DATETIME_ORIGINAL = 0x9003
+
+# QuickTime times are seconds since 1904-01-01 (UTC)
+QUICKTIME_EPOCH = datetime.datetime(1904, 1, 1)
+QUICKTIME_ATOMS = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot", b"uuid"}
+
+# Times pandas can store (nanoseconds since 1970 in an int64)
+TIME_MIN = pd.Timestamp.min.ceil("s").to_pydatetime()
+TIME_MAX = pd.Timestamp.max.floor("s").to_pydatetime()
+
+# Guards against malformed files
+MAX_SEGMENTS = 64
+MAX_ENTRIES = 1024
+
+
+class RangeReader:
+    """
+    Reads byte ranges of an open file. The first HEAD_SIZE bytes are read
+    once, ranges outside them cost one extra read each.
+    """
+
+    def __init__(self, f, head_size:int=HEAD_SIZE):
+        self.f = f
+        self.head = f.read(head_size)
+
+    def read(self, offset:int, size:int) -> bytes:
+        if offset + size <= len(self.head):
+            return self.head[offset:offset + size]
+        self.f.seek(offset)
+        return self.f.read(size)
+
+
+def exif_datetime(value:bytes):
+    """
+    Parses an EXIF date ("YYYY:MM:DD HH:MM:SS"), None if blank or invalid.
+    """
+    try:
+        return datetime.datetime.strptime(value[:19].decode("ascii"), "%Y:%m:%d %H:%M:%S")
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def tiff_time(reader:RangeReader, base:int=0):
+    """
+    Capture time of a TIFF structure starting at base (TIFF, CR2, NEF,
+    DNG files, or the EXIF block of a JPEG): DateTimeOriginal from the
+    EXIF IFD, or DateTime from IFD0.
+    """
+    order = reader.read(base, 2)
+    if order == b"II":
+        endian = "<"
+    elif order == b"MM":
+        endian = ">"
+    else:
+        return None
+
+    magic, offset = struct.unpack(endian + "HI", reader.read(base + 2, 6))
+    if magic != 42:
+        return None
+
+    def entries(offset:int) -> dict:
+        count, = struct.unpack(endian + "H", reader.read(base + offset, 2))
+        data = reader.read(base + offset + 2, 12 * min(count, MAX_ENTRIES))
+        tags = {}
+        for i in range(0, len(data) - 11, 12):
+            tag, kind, n = struct.unpack(endian + "HHI", data[i:i + 8])
+            tags[tag] = (kind, n, data[i + 8:i + 12])
+        return tags
+
+    def ascii_value(entry) -> bytes:
+        kind, n, value = entry
+        if n <= 4:
+            return value[:n]
+        pointer, = struct.unpack(endian + "I", value)
+        return reader.read(base + pointer, n)
+
+    ifd0 = entries(offset)
+    if EXIF_IFD in ifd0:
+        pointer, = struct.unpack(endian + "I", ifd0[EXIF_IFD][2])
+        exif = entries(pointer)
+        if DATETIME_ORIGINAL in exif:
+            captured = exif_datetime(ascii_value(exif[DATETIME_ORIGINAL]))
+            if captured is not None:
+                return captured
+    if DATETIME in ifd0:
+        return exif_datetime(ascii_value(ifd0[DATETIME]))
+    return None
+
+
+def jpeg_time(reader:RangeReader):
+    """
+    Capture time from the EXIF (APP1) segment of a JPEG.
+    """
+    offset = 2
+    for _ in range(MAX_SEGMENTS):
+        marker = reader.read(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        # Start of scan or end of image, no more metadata
+        if marker[1] in (0xDA, 0xD9):
+            return None
+        length, = struct.unpack(">H", marker[2:])
+        if marker[1] == 0xE1 and reader.read(offset + 4, 6) == b"Exif\x00\x00":
+            return tiff_time(reader, base=offset + 10)
+        offset += 2 + length
+    return None
+
+
+def quicktime_time(reader:RangeReader, size:int):
+    """
+    Creation time from the `mvhd` atom of an MP4/MOV file. Top level atoms
+    are skipped by their size, so `moov` is found even after `mdat`.
+    """
+    def atoms(start:int, end:int):
+        offset = start
+        while offset + 8 <= end:
+            length, kind = struct.unpack(">I4s", reader.read(offset, 8))
+            header = 8
+            if length == 1:
+                length, = struct.unpack(">Q", reader.read(offset + 8, 8))
+                header = 16
+            elif length == 0:
+                length = end - offset
+            if length < header:
+                return
+            yield kind, offset + header, offset + length
+            offset += length
+
+    for kind, start, end in atoms(0, size):
+        if kind != b"moov":
+            continue
+        for child, child_start, _ in atoms(start, end):
+            if child != b"mvhd":
+                continue
+            header = reader.read(child_start, 12)
+            if header[0] == 1:
+                seconds, = struct.unpack(">Q", header[4:12])
+            else:
+                seconds, = struct.unpack(">I", header[4:8])
+            # Many cameras leave it blank
+            if seconds == 0:
+                return None
+            return QUICKTIME_EPOCH + datetime.timedelta(seconds=seconds)
+        return None
+    return None
+
+
+def in_range(value):
+    """
+    The time if pandas can store it (1677-09-22 to 2262-04-11), None
+    otherwise: corrupt headers hold years like 2919 or 9999.
+    """
+    if value is None or not TIME_MIN < value < TIME_MAX:
+        return None
+    return value
+
+
+def capture_time(path:str, size:int):
+    """
+    Reads the time a photo or video was captured from its headers,
+    reading only the first HEAD_SIZE bytes (plus a few small ranges).
+    EXIF times are local times, QuickTime times are UTC.
+    Returns None if the file has no such metadata (or a time out of range).
+    """
+    with open(path, "rb", buffering=0) as f:
+        reader = RangeReader(f)
+        head = reader.head
+        try:
+            if head[:2] == b"\xff\xd8":
+                return in_range(jpeg_time(reader))
+            if head[:4] in (b"II*\x00", b"MM\x00*"):
+                return in_range(tiff_time(reader))
+            if head[4:8] in QUICKTIME_ATOMS:
+                return in_range(quicktime_time(reader, size))
+        except (struct.error, OverflowError, IndexError):
+            # Truncated or malformed headers
+            return None
+    return None
+
+
+@measured("capture_times")
+def capture_times(df:pd.DataFrame, workers:int=8, cache:FileCache=None) -> pd.DataFrame:
+    """
+    Adds a `captured_at` column to a files table (with abspath_src,
+    extension, st_size and st_mtime): the capture time read from the
+    EXIF or QuickTime headers of photos and videos (see capture_time),
+    NaT for other files. Headers are read in parallel, and results are
+    cached in _plans/cache (by path, size and mtime) across runs.
+    """
+    print(f"\nReading capture times from metadata ({workers} workers)...")
+    cache = FileCache("captured_at") if cache is None else cache
+
+    extensions = EXIF_EXTENSIONS | QUICKTIME_EXTENSIONS
+    candidates = df[df["extension"].isin(extensions)]
+    mtimes = candidates["st_mtime"].values.astype("datetime64[s]").astype("int64")
+    args = list(zip(candidates["abspath_src"], candidates["st_size"], mtimes))
+
+    missing = object()
+    hits = [0]
+
+    def task(a):
+        path, size, mtime = a
+        cached = cache.get(path, size, mtime, default=missing)
+        if cached is not missing:
+            hits[0] += 1
+            # Cached before times were checked
+            return in_range(cached)
+        try:
+            captured = capture_time(path, size)
+        except OSError as ex:
+            print(f"\tWARNING: could not read {path} ({ex})")
+            return None
+        cache.put(path, size, mtime, captured)
+        return captured
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        captured = list(pool.map(task, args))
+    cache.save()
+
+    df["captured_at"] = pd.NaT
+    df.loc[candidates.index, "captured_at"] = pd.to_datetime(pd.Series(captured, index=candidates.index,
+                                                                        dtype=object))
+    df["captured_at"] = pd.to_datetime(df["captured_at"])
+
+    found = df["captured_at"].notnull().sum()
+    print(f"\t{found}/{len(candidates)} photos and videos have a capture time "
+          f"({hits[0]} from cache)")
+
+    return df
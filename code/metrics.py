@@ -0,0 +1,255 @@
+from imports import *
+import builtins
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+
+# File system calls counted by SyscallCounter (when available on this OS)
+SYSCALLS = ["stat", "lstat", "scandir", "open", "replace", "fsync", "makedirs",
+            "remove", "sendfile", "copy_file_range"]
+
+METRICS_FORMATS = ["jsonl", "prometheus"]
+
+# Columns of a stage in the summary (see Metrics.summary)
+SUMMARY_COLUMNS = ["stage", "calls", "seconds", "wall", "files", "bytes", "files_per_s",
+                   "mb_per_s", "errors", "error_rate", "syscalls"]
+
+
+class Metrics:
+    """
+    Thread safe registry of the stages of a run. For each stage name it
+    accumulates the number of calls, the time spent in them, the files and
+    bytes processed, the errors (error_rate is per call), and the file
+    system calls made while the stage was running (see SyscallCounter).
+    `wall` is the time between the first start and the last end of the
+    stage: with parallel calls (migrate_file) it is the elapsed time, and
+    throughputs are computed on it.
+    Nothing is recorded until enable() is called (e.g. by run.py --metrics).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.reset()
+
+    def enable(self, enabled:bool=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.active = Counter()
+
+    def start(self, name:str) -> float:
+        started = time.perf_counter()
+        with self.lock:
+            self.active[name] += 1
+            self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "files": 0,
+                                          "bytes": 0, "errors": 0, "first": started,
+                                          "last": started, "syscalls": Counter()})
+        return started
+
+    def stop(self, name:str, started:float, *, files:int=0, size:int=0, errors:int=0):
+        ended = time.perf_counter()
+        with self.lock:
+            self.active[name] -= 1
+            if self.active[name] == 0:
+                del self.active[name]
+
+            s = self.stages[name]
+            s["calls"] += 1
+            s["seconds"] += ended - started
+            s["files"] += files
+            s["bytes"] += size
+            s["errors"] += errors
+            s["last"] = max(s["last"], ended)
+
+    def syscall(self, call:str):
+        # Attributed to every stage running at the time of the call
+        with self.lock:
+            for name in self.active:
+                self.stages[name]["syscalls"][call] += 1
+
+    def summary(self) -> List[dict]:
+        """
+        One record per stage, in the order the stages first ran.
+        """
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1]["first"])
+            records = []
+            for name, s in stages:
+                wall = max(s["last"] - s["first"], 1e-9)
+                records.append({"stage": name,
+                                "calls": s["calls"],
+                                "seconds": round(s["seconds"], 6),
+                                "wall": round(wall, 6),
+                                "files": s["files"],
+                                "bytes": s["bytes"],
+                                "files_per_s": round(s["files"] / wall, 1),
+                                "mb_per_s": round(s["bytes"] / wall / 1e6, 3),
+                                "errors": s["errors"],
+                                "error_rate": round(s["errors"] / s["calls"], 6) if s["calls"] else 0.0,
+                                "syscalls": dict(s["syscalls"])})
+            return records
+
+
+# Metrics of the current run
+METRICS = Metrics()
+
+
+@contextmanager
+def stage(name:str, files:int=0, size:int=0):
+    """
+    Records a stage in METRICS. Yields a dict where the block can set
+    the number of "files", "bytes" and "errors" it processed.
+    An exception raised by the block counts as one error.
+    Does nothing unless METRICS is enabled.
+    """
+    record = {"files": files, "bytes": size, "errors": 0}
+    if not METRICS.enabled:
+        yield record
+        return
+    started = METRICS.start(name)
+    try:
+        yield record
+    except Exception:
+        record["errors"] += 1
+        raise
+    finally:
+        METRICS.stop(name, started, files=record["files"], size=record["bytes"],
+                     errors=record["errors"])
+
+
+def measured(name:str, files=len, size=None):
+    """
+    Decorator recording each call of a function as a stage. files and
+    size are functions of the returned value (e.g. a table) counting
+    the files and bytes processed. Unless METRICS is enabled the
+    function is called directly.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return function(*args, **kwargs)
+            with stage(name) as record:
+                output = function(*args, **kwargs)
+                if output is not None:
+                    record["files"] = int(files(output)) if files else 0
+                    record["bytes"] = int(size(output)) if size else 0
+                return output
+        return wrapper
+    return decorator
+
+
+class SyscallCounter:
+    """
+    Counts the file system calls in SYSCALLS (os.* and open) and
+    attributes them to the stages running at the time. Calls made through
+    os.path (exists, getsize...) go through os.stat and count as stat.
+    Use install()/uninstall(), or as a context manager.
+    """
+
+    def __init__(self, metrics:Metrics=METRICS):
+        self.metrics = metrics
+        self.original = {}
+
+    def counting(self, call:str, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self.metrics.syscall(call)
+            return function(*args, **kwargs)
+        return wrapper
+
+    def install(self):
+        for call in SYSCALLS:
+            owner = builtins if call == "open" else os
+            if hasattr(owner, call) and call not in self.original:
+                self.original[call] = (owner, getattr(owner, call))
+                setattr(owner, call, self.counting(call, self.original[call][1]))
+        return self
+
+    def uninstall(self):
+        for call, (owner, function) in self.original.items():
+            setattr(owner, call, function)
+        self.original = {}
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+def with_summary(report:pd.DataFrame, records:List[dict]=None) -> pd.DataFrame:
+    """
+    A migration report with the columns of the summary (see
+    Metrics.summary) and, if records are passed, one row per stage
+    appended after the files (index "metrics", `stage` set). Reports
+    saved in chunks add the records to the last one only.
+    """
+    summary = pd.DataFrame(records or [], columns=SUMMARY_COLUMNS, index=["metrics"] * len(records or []))
+    summary["syscalls"] = summary["syscalls"].map(json.dumps)
+    output = report.reindex(columns=list(report.columns) + SUMMARY_COLUMNS)
+    if records:
+        # Files and stages share no column, rows are only saved together
+        output = pd.concat([output.astype(object), summary.reindex(columns=output.columns).astype(object)])
+    return output
+
+
+def to_jsonl(records:List[dict]) -> str:
+    return "".join(json.dumps(r) + "\n" for r in records)
+
+
+def to_prometheus(records:List[dict], prefix:str="synology") -> str:
+    """
+    Formats a summary in the Prometheus text exposition format
+    (e.g. for the node_exporter textfile collector).
+    """
+    counters = [("calls", "Number of calls of the stage."),
+                ("seconds", "Time spent in the stage, summed over calls."),
+                ("files", "Files processed by the stage."),
+                ("bytes", "Bytes processed by the stage."),
+                ("errors", "Errors in the stage.")]
+    lines = []
+    for key, description in counters:
+        metric = f"{prefix}_stage_{key}_total"
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{stage="{r["stage"]}"}} {r[key]}' for r in records]
+
+    metric = f"{prefix}_stage_wall_seconds"
+    lines += [f"# HELP {metric} Elapsed time from the first start to the last end of the stage.",
+              f"# TYPE {metric} gauge"]
+    lines += [f'{metric}{{stage="{r["stage"]}"}} {r["wall"]}' for r in records]
+
+    metric = f"{prefix}_syscalls_total"
+    lines += [f"# HELP {metric} File system calls made during the stage.",
+              f"# TYPE {metric} counter"]
+    lines += [f'{metric}{{stage="{r["stage"]}",call="{call}"}} {count}'
+              for r in records for call, count in r["syscalls"].items()]
+
+    return "\n".join(lines) + "\n"
+
+
+def save_metrics(path:str, metrics_format:str="jsonl", metrics:Metrics=METRICS) -> List[dict]:
+    """
+    Saves the summary of metrics to path, as JSON lines or Prometheus
+    text, prints it, and starts a new summary. Returns the records saved.
+    """
+    records = metrics.summary()
+    if metrics_format == "jsonl":
+        text = to_jsonl(records)
+    elif metrics_format == "prometheus":
+        text = to_prometheus(records)
+    else:
+        raise ValueError(f"metrics_format can be one of {METRICS_FORMATS}, passed {metrics_format}")
+
+    with open(path, "w") as f:
+        f.write(text)
+    metrics.reset()
+
+    table = [{k: v for k, v in r.items() if k != "syscalls"} for r in records]
+    print(f"\nMetrics ({os.path.basename(path)}):\n")
+    print(tabulate(table, headers="keys"))
+    return records
@@ -1,5 +1,13 @@
 from imports import *
 from helpers import *
+from walk import WalkEntry, scandir_walk
+from statpool import stat_files
+from dedup import content_hashes
+from catalog import Catalog, skip_cataloged
+from incremental import ls_incremental, rows_path, load_snapshot, save_snapshot
+from compact import save_plan, compact_plan, COMPACT_FORMATS
+from ignore import IgnoreMatcher
+from metrics import measured
 
 # Get the directory of this file
 here = pathlib.Path(__file__).parent.absolute()
@@ -7,37 +15,124 @@ here = pathlib.Path(__file__).parent.absolute()
 plans_dir = here.parent / "_plans"
 
 
-def plan(*, source:str, destinations:dict, ignore:bool) -> pd.DataFrame:
+def plan(*, source:str, destinations:dict, ignore:bool, engine:str="scandir",
+         stat_workers:int=0, dedup:bool=False, catalog:Catalog=None,
+         replace:bool=False, incremental:bool=False, plan_format:str="csv",
+         metadata:bool=False, similar:bool=False, drop_similar:bool=False,
+         takeout:bool=False) -> pd.DataFrame:
     """
-    From
+    From a source directory, builds the table of files to migrate.
+    `engine` selects how files are listed:
+        - "glob": glob.iglob, then one os.stat per file
+        - "scandir": parallel os.scandir walk, stats collected while listing
+    `stat_workers` > 0 stats files concurrently (glob engine only).
+    `dedup` hashes file contents and drops files with identical content.
+    `catalog` skips files already on the server (see migration_table).
+    `incremental` (scandir engine only) reuses the listing of the previous
+    run for directories that did not change (see incremental.py), and the
+    description of files that did not change (see describe_incremental).
+    `plan_format` is the format the plan is saved in (see compact.py),
+    with "parquet" or "feather" the plan is returned compact too.
+    `metadata` reads capture times from EXIF/QuickTime headers, used
+    instead of the file stats when found (see metadata.py).
+    `similar` groups near-duplicate images (see similar.py, requires
+    Pillow), `drop_similar` migrates only the best copy of each group.
+    `takeout` dates files by the photoTakenTime of their Google Takeout
+    sidecar (see takeout.py), listed even if ".json" files are ignored.
     """
+    check_engine(engine)
+    if incremental and engine != "scandir":
+        raise ValueError("incremental planning requires the scandir engine")
+
+    # Modules of optional stages are only imported when used (see imports.py)
+    if takeout:
+        from takeout import listing_patterns, split_sidecars, takeout_times
+    if metadata:
+        from metadata import capture_times
+    if similar or drop_similar:
+        from similar import similar_images
+
+    # Takeout sidecars are listed even if they are ignored
+    listing_ignore = listing_patterns(ignore) if takeout else ignore
+
+    if engine == "scandir":
+        # List files and their stats in one pass
+        entries = ls_entries(src_dir=source, ignore=listing_ignore, incremental=incremental)
+        files = [e.path for e in entries]
+    else:
+        # List files in src and ignore some
+        files = ls_recursive(src_dir=source, ignore=listing_ignore)
+
+    if takeout:
+        # Set the sidecars aside, then ignore what was not ignored while listing
+        keep, sidecars = split_sidecars(files, ignore)
+        files = [f for f, k in zip(files, keep) if k]
+        if engine == "scandir":
+            entries = [e for e, k in zip(entries, keep) if k]
+        print(f"\t{len(sidecars)} Google Takeout sidecars found")
 
-    # List files in src and ignore some
-    files = ls_recursive(src_dir=source, ignore=ignore)
     if len(files) == 0:
         return
 
-    # describe files (string ops, fast)
-    shallow = filedesc_shallow(files=files)
+    if incremental:
+        # Only describe files that changed since the last run
+        description = describe_incremental(entries=entries, src_dir=source, patterns=listing_ignore)
+    else:
+        # describe files (string ops, fast)
+        shallow = filedesc_shallow(files=files)
+
+        if engine == "scandir":
+            # stats were collected by the walker
+            deep = filedesc_entries(entries=entries)
+        else:
+            # grub stats for each file (slower)
+            deep = filedesc_deep(files=files, workers=stat_workers)
+
+        # Combine (files that vanished while listing have no stats)
+        description = pd.merge(shallow, deep, how="inner", on="abspath_src")
+
+    if metadata:
+        # Read capture times from photo and video headers
+        description = capture_times(description)
+
+    if takeout:
+        # Read photoTakenTime from the Takeout sidecars
+        description = takeout_times(description, sidecars)
 
-    # grub stats for each file (slower)
-    deep = filedesc_deep(files=files)
+    if dedup:
+        # Find identical files (reads only files that share their size)
+        description = content_hashes(description)
 
-    # Combine
-    description = pd.merge(shallow, deep, how="outer", on="abspath_src")
+    if similar or drop_similar:
+        # Find images that look the same (re-compressed, resized copies)
+        description = similar_images(description)
 
     # Build a migration table
-    table = migration_table(df=description, dirs=destinations)
+    table = migration_table(df=description, dirs=destinations, catalog=catalog,
+                            replace=replace, plan_format=plan_format, drop_similar=drop_similar)
 
     return table
 
 
-def ls_recursive(*, src_dir:str, ignore=[]) -> List[str]:
+def check_engine(engine:str):
+
+    allowed_engines = ["glob", "scandir"]
+    if engine not in allowed_engines:
+        raise ValueError(f"engine can be one of {allowed_engines}, passed {engine}")
+
+
+@measured("ls_recursive")
+def ls_recursive(*, src_dir:str, ignore=[], engine:str="glob") -> List[str]:
     """
     Returns a list of absolute paths (str) of all objects
     inside src_dir. If ignore is passed, it drops all files
-    containing any of the patterns to ignore.
+    matching any of the patterns to ignore (see ignore.IgnoreMatcher).
     """
+    check_engine(engine)
+    if engine == "scandir":
+        # Measured as ls_recursive only, not as ls_entries too
+        return [e.path for e in ls_entries.__wrapped__(src_dir=src_dir, ignore=ignore)]
+
     # Search for all files recursively
     print("\nListing all files recursively...")
     files = []
@@ -46,9 +141,9 @@ def ls_recursive(*, src_dir:str, ignore=[]) -> List[str]:
         files.append(fn)
 
     if ignore:
-        files = pd.DataFrame(files, index=range(len(files)), columns=["files"])
-        where = any_words_in_column(files, column="files", words=ignore, verbose=False)
-        output = files.loc[~where, "files"].to_list()
+        files = pd.Series(files, dtype=object)
+        where = IgnoreMatcher(ignore).ignore_paths(files, root=src_dir)
+        output = files[~where].to_list()
         print(f"\t{where.sum()}/{len(files)} ignored (patterns {ignore})")
     else:
         output = files
@@ -57,6 +152,34 @@ def ls_recursive(*, src_dir:str, ignore=[]) -> List[str]:
     return output
 
 
+@measured("ls_entries")
+def ls_entries(*, src_dir:str, ignore=[], max_workers:int=8,
+               incremental:bool=False) -> List[WalkEntry]:
+    """
+    Like ls_recursive, but walks src_dir with a pool of os.scandir workers
+    and returns WalkEntry tuples (path + stats), sorted by path. Unlike the
+    glob pattern "*.*", files without a dot in their name are included.
+    Ignored files are skipped and ignored directories are not descended into.
+    """
+    matcher = IgnoreMatcher(ignore)
+    if incremental:
+        entries = ls_incremental(src_dir=src_dir, max_workers=max_workers, matcher=matcher)
+    else:
+        print(f"\nListing all files recursively ({max_workers} workers)...")
+        entries = []
+        for entry in tqdm(scandir_walk(src_dir, max_workers=max_workers, matcher=matcher)):
+            entries.append(entry)
+        # Threads finish in any order, sort for reproducible plans
+        entries.sort()
+
+    if ignore:
+        print(f"\tignored patterns {ignore}")
+
+    print(f"\t{len(entries)} total files found in src_dir")
+    return entries
+
+
+@measured("filedesc_shallow")
 def filedesc_shallow(files:List[str]) -> pd.DataFrame:
     """
     Returns a table with basename, extension and file type as inferred
@@ -64,19 +187,18 @@ def filedesc_shallow(files:List[str]) -> pd.DataFrame:
     """
     # Search for all files recursively
     print("\nDescribing files (shallow)...")
-    # Extract basenames
-    df = pd.DataFrame()
-    df["abspath_src"] = files
-    df["basename_src"] = [os.path.basename(f) for f in files]
-
-    # Add file anme and extension
-    df["filename_src"] = df["basename_src"].apply(lambda x: os.path.splitext(x)[0])
-    df["extension_src"] = df["basename_src"].apply(lambda x: os.path.splitext(x)[1])
-    df["extension"] = df["extension_src"].str.lower()
-
-    # Left join table with file_types
-    lookup = extensions_and_types()
-    output = pd.merge(df, lookup, how="left", left_on="extension", right_on="file_ext")
+    # Extract basenames, file names and extensions
+    basenames = [os.path.basename(f) for f in files]
+    names = [os.path.splitext(b) for b in basenames]
+    output = pd.DataFrame({"abspath_src": files,
+                           "basename_src": basenames,
+                           "filename_src": [n for n, _ in names],
+                           "extension_src": [e for _, e in names]})
+    output["extension"] = output["extension_src"].str.lower()
+
+    # Map extensions to file types
+    output["file_type"] = file_types(output["extension"])
+    output["file_ext"] = output["extension"].where(output["file_type"].notnull())
 
     missing_types = output["file_type"].isnull()
     missing = missing_types.sum()
@@ -88,19 +210,102 @@ def filedesc_shallow(files:List[str]) -> pd.DataFrame:
     return output
 
 
-def filedesc_deep(files:List[str]) -> pd.DataFrame:
+@measured("filedesc_deep", size=lambda df: df["st_size"].sum())
+def filedesc_deep(files:List[str], workers:int=0, mount_limit:int=8,
+                  adaptive:bool=True) -> pd.DataFrame:
     """
     Takes a list of absolute pahts to files on a mounted volume,
     and returns a table with file stats like ctime, mtime, size...
     Requires file system access, and may be slow on a remote drive.
+
+    With workers > 0 stats run on a thread pool, with at most mount_limit
+    requests in flight per mount (adapted to the observed latency if
+    adaptive). Files that vanish are dropped and listed in
+    df.attrs["missing"] instead of raising.
     """
 
-    # Search for all files recursively
-    print("\nDescribing files (deep)...")
+    if workers <= 0:
+        # Search for all files recursively
+        print("\nDescribing files (deep)...")
+
+        # Collect file stats for each file
+        file_stats = [os.stat(f) for f in files]
+
+        return stats_table(file_stats=file_stats, files=files)
 
-    # Collect file stats for each file
-    file_stats = [os.stat(f) for f in files]
+    print(f"\nDescribing files (deep, {workers} workers)...")
+    file_stats, missing = stat_files(files, max_workers=workers,
+                                     mount_limit=mount_limit, adaptive=adaptive)
 
+    found = [(f, s) for f, s in zip(files, file_stats) if s is not None]
+    df = stats_table(file_stats=[s for _, s in found], files=[f for f, _ in found])
+    df.attrs["missing"] = missing
+
+    if missing:
+        print(f"\tWARNING: {len(missing)} file(s) vanished or could not be read while describing them, e.g. {missing[:3]}")
+
+    return df
+
+
+@measured("filedesc_entries", size=lambda df: df["st_size"].sum())
+def filedesc_entries(entries:List[WalkEntry]) -> pd.DataFrame:
+    """
+    Same output as filedesc_deep, built from the stats collected
+    by the scandir walker. Does not touch the file system.
+    """
+    print("\nDescribing files (deep, from listing)...")
+    return stats_table(file_stats=entries, files=[e.path for e in entries])
+
+
+@measured("describe_incremental", size=lambda df: df["st_size"].sum())
+def describe_incremental(*, entries:List[WalkEntry], src_dir:str, patterns:List[str]=[]) -> pd.DataFrame:
+    """
+    Same as merging filedesc_shallow and filedesc_entries, plus the time
+    found in the names (`has_time`, `time_src`, see helpers.detect_time_info).
+    Rows of files whose stats did not change are taken from the previous
+    run (the other rows are described and saved for the next one), so the
+    output is the same as describing every file again.
+    """
+    deep = filedesc_entries(entries=entries)
+
+    path = rows_path(src_dir, patterns)
+    cached = load_snapshot(path)
+    if isinstance(cached, pd.DataFrame):
+        cached = cached.set_index("abspath_src")
+        stats = cached.reindex(deep["abspath_src"])
+        reused = ((stats["st_size"].to_numpy() == deep["st_size"].to_numpy())
+                  & (stats["st_mtime"].to_numpy() == deep["st_mtime"].to_numpy())
+                  & (stats["st_ctime"].to_numpy() == deep["st_ctime"].to_numpy()))
+    else:
+        reused = np.zeros(len(deep), dtype=bool)
+
+    changed = deep[~reused]
+    shallow = filedesc_shallow(files=changed["abspath_src"].to_list())
+    fresh = pd.merge(shallow, changed, how="inner", on="abspath_src")
+    times = detect_time_info(fresh["basename_src"])
+    fresh["has_time"] = times["has_time"]
+    fresh["time_src"] = times["time_src"]
+
+    if reused.any():
+        rows = cached.loc[deep.loc[reused, "abspath_src"]].reset_index()
+        description = pd.concat([rows[fresh.columns], fresh])
+        # Back to the order of the listing
+        order = pd.Series(range(len(deep)), index=deep["abspath_src"])
+        description = description.iloc[np.argsort(order[description["abspath_src"]].to_numpy())]
+        description = description.reset_index(drop=True)
+    else:
+        description = fresh
+
+    save_snapshot(path, description)
+    print(f"\t{reused.sum()}/{len(deep)} files described in a previous run")
+    return description
+
+
+def stats_table(*, file_stats:list, files:List[str]) -> pd.DataFrame:
+    """
+    Builds the deep description table from objects exposing
+    st_mtime, st_ctime and st_size (os.stat_result, WalkEntry).
+    """
     # Unpack metrics. Full list of metrics at:
     # https://docs.python.org/3.8/library/os.html#os.stat_result.st_size
     all_stats = [{"st_mtime": int(fstats.st_mtime),
@@ -108,7 +313,7 @@ def filedesc_deep(files:List[str]) -> pd.DataFrame:
                   "st_size": int(fstats.st_size)} for fstats in file_stats]
 
     # Build a table
-    df = pd.DataFrame(all_stats)
+    df = pd.DataFrame(all_stats, columns=["st_mtime", "st_ctime", "st_size"])
     # Cast datetimes
     df["st_mtime"] = pd.to_datetime(df["st_mtime"], unit="s")
     df["st_ctime"] = pd.to_datetime(df["st_ctime"], unit="s")
@@ -120,7 +325,10 @@ def filedesc_deep(files:List[str]) -> pd.DataFrame:
     return df
 
 
-def migration_table(*, df: pd.DataFrame, dirs:dict) -> pd.DataFrame:
+@measured("migration_table")
+def migration_table(*, df: pd.DataFrame, dirs:dict, catalog:Catalog=None,
+                    replace:bool=False, save:bool=True, plan_format:str="csv",
+                    drop_similar:bool=False) -> pd.DataFrame:
     """
     Extends a files table with two columns:
         - `dirname_dst` (absolute path to the destination directory)
@@ -130,10 +338,27 @@ def migration_table(*, df: pd.DataFrame, dirs:dict) -> pd.DataFrame:
         - filename_src:
         - extension_src:
         - created_at:
+    If df has `captured_at` (see metadata.py) or `taken_at` (see
+    takeout.py), they are preferred over created_at, in this order:
+    taken_at, captured_at, then the file stats.
+    If df has `similar_best` (see similar.py), near-duplicate images are
+    only reported, or dropped (all but the best copy) if drop_similar.
+    If a server catalog is passed, files already on the server (at the
+    same path unless replace, or elsewhere with the same content_hash)
+    are dropped without accessing the server.
+    Unless save is False, the table is saved to _plans for inspection,
+    as plan_format ("csv", or "parquet"/"feather" for a compact table).
+    With a compact plan_format the compact table is returned (paths are
+    only built by execute, see compact.expand_plan).
     """
     # Search for all files recursively
     print("\nCreating migration table...")
 
+    # Prefer the time in the file metadata, then in the Takeout sidecar
+    for column in ["captured_at", "taken_at"]:
+        if column in df.columns:
+            df = df.assign(created_at=df[column].fillna(df["created_at"]))
+
     # Create basename of file at destination
     df = create_basename_dst(df)
 
@@ -148,23 +373,53 @@ def migration_table(*, df: pd.DataFrame, dirs:dict) -> pd.DataFrame:
     df["dirname_dst"] = df["parentdir_dst"] + "/" + df["created_at"].dt.date.astype(str)
     df["abspath_dst"] = df["dirname_dst"] + "/" + df["basename_dst"]
 
+    # Drop files with missing file_type first, a copy with a known
+    # extension must not be dropped as a duplicate of one of them
+    n_files = len(df)
+    unknowns = df["file_type"].isnull().sum()
+    df = df.dropna(axis=0, how="any", subset=["file_type"]).reset_index(drop=True)
+
     # Deduplicate files based on the destination basename (includes timestamp)
     is_duplicate = df.duplicated(subset=["basename_dst"], keep="first")
+
+    # Deduplicate files with the same content (see dedup.content_hashes)
+    if "dup_group" in df.columns:
+        same_content = df.duplicated(subset=["dup_group"], keep="first")
+        print(f"\t{(same_content & ~is_duplicate).sum()}/{n_files} ignored (same content)")
+        is_duplicate = is_duplicate | same_content
+
+    # Keep the best of near-duplicate images (see similar.similar_images)
+    if "similar_best" in df.columns:
+        similar_image = ~df["similar_best"]
+        if drop_similar:
+            print(f"\t{(similar_image & ~is_duplicate).sum()}/{n_files} ignored (similar image)")
+            is_duplicate = is_duplicate | similar_image
+        else:
+            print(f"\t{similar_image.sum()}/{n_files} similar images (kept, see similar_group)")
+
     output = df[~is_duplicate].reset_index(drop=True)
 
-    # Drop files with missing file_type
-    unknowns = output["file_type"].isnull().sum()
-    output = output.dropna(axis=0, how="any",subset=["file_type"]).reset_index(drop=True)
+    print(f"\t{is_duplicate.sum()}/{n_files} ignored (duplicated)")
+    print(f"\t{unknowns}/{n_files} ignored (extension)")
+
+    if catalog is not None:
+        output = skip_cataloged(df=output, catalog=catalog, replace=replace)
+
+    print(f"\t{output.shape[0]}/{n_files} to migrate")
+
+    if plan_format in COMPACT_FORMATS:
+        output = compact_plan(output)
 
-    print(f"\t{is_duplicate.sum()}/{len(df)} ignored (duplicated)")
-    print(f"\t{unknowns}/{len(df)} ignored (extension)")
-    print(f"\t{output.shape[0]}/{len(df)} to migrate")
+    if not save:
+        return output
 
     # Save plan to file for inspection
     timenow = pd.Timestamp.now()
     timestring = timenow.strftime("%Y%m%d_%H%M%S_%f")
-    saveas = plans_dir / f"{timestring}_plan.csv"
-    output.to_csv(saveas)
+    saveas = plans_dir / f"{timestring}_plan.{plan_format}"
+    save_plan(output, saveas, plan_format=plan_format)
+    # So that what is computed from the plan can be saved next to it
+    output.attrs["plan_path"] = str(saveas)
     print(f"\n\tMigration plan ready ({os.path.basename(saveas)})")
 
     return output
@@ -6,23 +6,31 @@ based on the date of creation, as well as loading it to the
 server while keeping track of any errors thet might arise.
 
 Example 1:
-    python run.py -r "True" -m "copy" -i "['.jsonl', '.json', '.aae']" --dump "~/dump" --staging "~/stg" --server "~/server"
+    python run.py -r True -m "copy" -i .jsonl .json .aae --dump "~/dump" --staging "~/stg" --server "~/server"
+
+Example 2 (scheduled, never prompts):
+    python run.py --yes -m "move" --dump "~/dump" --server "~/server"
 """
 
 from imports import *
 from helpers import *
 from plan import *
 from execute import *
+from stream import run_stream
+from metrics import SyscallCounter, METRICS
+from schedule import Bandwidth, TimeWindow
+from estimate import estimate, show_estimate, save_estimate, total_seconds
+from takeout import stamp_taken_times
 
 code = pathlib.Path(__file__).parent.absolute()
 data = code.parent / "data"
 
 
-def optionally_clean_dir(directory):
+def optionally_clean_dir(directory, answer=None):
     # Cleanup
     options = ["y", "n"]
     question = (f"\nDo you want to clean {directory}? {'/'.join(options)}: ")
-    clean = cli_ask_question(question=question, options=options)
+    clean = cli_answer(question=question, options=options, answer=answer)
     if clean == "y":
         clean_directory(directory)
     return
@@ -40,66 +48,225 @@ def main() -> None:
     parser.set_defaults(dump="",
                         staging=str(data / "staging"),
                         server=str(data / "server"),
-                        ignore=['.jsonl', '.json', '.aae'],
+                        ignore=['.jsonl', '.json', '.aae', '@eaDir/', '#recycle/'],
                         replace=False,
-                        mode="copy")
+                        mode="copy",
+                        engine="scandir")
 
     parser.add_argument('-d', '--dump', type=str, required=False, help=mode_help)
     parser.add_argument('--staging', type=str, required=False, help=mode_help)
     parser.add_argument('--server', type=str, required=False, help=mode_help)
-    parser.add_argument('-i', '--ignore', type=list, required=False, help=mode_help)
-    parser.add_argument('-r', '--replace', type=bool, required=False, help=mode_help)
+    parser.add_argument('-i', '--ignore', type=str, nargs="*", required=False, help=mode_help)
+    parser.add_argument('-r', '--replace', type=str_to_bool, required=False, help=mode_help)
     parser.add_argument('-m', '--mode', type=str, required=False, help=mode_help)
+    parser.add_argument('-e', '--engine', type=str, required=False, choices=["glob", "scandir"],
+                        help="How to list files in dump: 'glob' or 'scandir' (parallel, faster on a NAS).")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Skip files with identical content (hashes files that share their size).")
+    parser.add_argument('--similar', action='store_true',
+                        help="Group near-duplicate images in the plan (similar_group, needs Pillow).")
+    parser.add_argument('--drop-similar', action='store_true',
+                        help="Migrate only the best copy of near-duplicate images (needs Pillow).")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only list directories that changed since the last run (scandir engine).")
+    parser.add_argument('--metadata', action='store_true',
+                        help="Date photos and videos by the capture time in their EXIF/QuickTime headers.")
+    parser.add_argument('--takeout', action='store_true',
+                        help="Date files by the photoTakenTime of their Google Takeout .json sidecars.")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="Number of files migrated in parallel.")
+    parser.add_argument('--volume-limit', type=int, default=2,
+                        help="Maximum number of files migrated in parallel to each destination volume.")
+    parser.add_argument('--journal', type=str, default=None,
+                        help="Log progress to this file, and resume from it if it exists.")
+    parser.add_argument('--verify', type=str, default=None, choices=["readback", "stat"],
+                        help="Hash files while copying and check each copy (moves delete src only if valid).")
+    parser.add_argument('--schedule', action='store_true',
+                        help="Migrate small files in batches and interleave large ones, per destination volume.")
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help="Maximum MB/s copied overall.")
+    parser.add_argument('--volume-bandwidth', type=float, default=None,
+                        help="Maximum MB/s copied to each destination volume.")
+    parser.add_argument('--window', type=str, default=None,
+                        help="Time of day migrations may start, e.g. '22:00-07:00'.")
+    parser.add_argument('--compare', type=str, default=None, choices=["size_mtime", "partial_hash", "full_hash"],
+                        help="With replace, skip files identical to the existing one instead of copying them again.")
+    parser.add_argument('--bundle', type=int, default=0,
+                        help="Send files smaller than this many KB as one tar per destination folder.")
+    parser.add_argument('--bundle-keep', action='store_true',
+                        help="Keep bundles as indexed archives, instead of unpacking them with unbundle.py.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Plan and load to the server in chunks, copying while listing (no staging).")
+    parser.add_argument('--plan-format', type=str, default="csv", choices=["csv", "parquet", "feather"],
+                        help="Format of the plans saved in _plans (parquet and feather need pyarrow).")
+    parser.add_argument('--extensions', type=str, default=None,
+                        help="JSON file of extra extensions per file type, e.g. {\"image\": [\".heic\"]}.")
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help="Headless: never prompt, use --stage and --clean to answer the questions.")
+    parser.add_argument('--stage', action='store_true',
+                        help="With --yes, stage files before loading them to the server.")
+    parser.add_argument('--clean', action='store_true',
+                        help="With --yes, clean the staging directory at the end.")
+    parser.add_argument('--metrics', type=str, default=None, choices=["jsonl", "prometheus"],
+                        help="Save timings, throughput, file system calls and errors of each stage next to the report.")
+    parser.add_argument('--probe', action='store_true',
+                        help="Estimate the duration of the migration by writing test files to the server (16MB per mount).")
+    parser.add_argument('--catalog', action='store_true',
+                        help="Use (and build on first run) a local index of the server to skip existing files.")
+    parser.add_argument('--catalog-hashes', action='store_true',
+                        help="Build the catalog with content hashes (reads the server once), to skip files stored elsewhere.")
 
     # Parse parameters
     cli_args = parser.parse_args()
 
+    if cli_args.bundle_keep and cli_args.mode == "move":
+        parser.error("--bundle-keep keeps copies in archives, use it with -m copy")
+
+    if cli_args.compare and not cli_args.replace:
+        parser.error("--compare only chooses which existing files to replace, use it with -r True")
+
+    if cli_args.takeout and cli_args.stream:
+        parser.error("--takeout matches sidecars across the whole dump, it can't be used with --stream")
+
+    # Time each stage, the summary is added to the migration report
+    METRICS.enable()
+    # Count the file system calls of each stage, only while migrating
+    counter = SyscallCounter().install() if cli_args.metrics else None
+    try:
+        migrate(cli_args)
+    finally:
+        if counter is not None:
+            counter.uninstall()
+
+
+def migrate(cli_args:argparse.Namespace) -> None:
+    """
+    Plans and executes the migration described by the arguments of main().
+    """
+    if cli_args.extensions:
+        load_extensions(cli_args.extensions)
+
     # Instantiate default args object
     args = Arguments(cli_args.dump,
                     staging_paths(cli_args.staging),
                     server_paths(cli_args.server),
                     cli_args.ignore,
                     cli_args.replace,
-                    cli_args.mode)
+                    cli_args.mode,
+                    cli_args.engine)
     print(args)
 
+    # Answers to the questions, in headless mode
+    def headless(flag:bool) -> str:
+        if not cli_args.yes:
+            return None
+        return "y" if flag else "n"
+
+    # Limits of the transfers
+    bandwidth = None
+    if cli_args.bandwidth or cli_args.volume_bandwidth:
+        # MB/s to bytes/s
+        limit = cli_args.bandwidth * 1e6 if cli_args.bandwidth else None
+        volume_limit = cli_args.volume_bandwidth * 1e6 if cli_args.volume_bandwidth else None
+        bandwidth = Bandwidth(limit=limit, volume_limit=volume_limit)
+    window = TimeWindow(cli_args.window) if cli_args.window else None
+    transfer_options = dict(schedule=cli_args.schedule, bandwidth=bandwidth, window=window,
+                            bundle=cli_args.bundle * 1024, bundle_keep=cli_args.bundle_keep,
+                            compare=cli_args.compare)
+
+    catalog = None
+    if cli_args.catalog or cli_args.catalog_hashes:
+        catalog = Catalog()
+        if len(catalog) == 0 or (cli_args.catalog_hashes and catalog.hashed() == 0):
+            catalog.build(args.server, hashes=cli_args.catalog_hashes)
+        print(catalog)
+
+    if cli_args.stream:
+        # The plan is built while loading, so confirm before starting
+        load_options = ["y", "n"]
+        load_question = (f"\nReady to stream data to the server? {'/'.join(load_options)}: ")
+        if cli_answer(question=load_question, options=load_options, answer=headless(True)) == "y":
+            run_stream(source=args.dump, destinations=args.server, ignore=args.ignore,
+                       mode=args.mode, replace=args.replace, catalog=catalog,
+                       journal=cli_args.journal, workers=cli_args.workers,
+                       volume_limit=cli_args.volume_limit, verify=cli_args.verify,
+                       metrics=cli_args.metrics, metadata=cli_args.metadata,
+                       **transfer_options)
+        return
+
     # Get user input
     stage_opts = ["y", "n"]
     stage_question = (f"\nDo you want to stage files? {'/'.join(stage_opts)}: ")
-    stage_answer = cli_ask_question(question=stage_question, options=stage_opts)
+    stage_answer = cli_answer(question=stage_question, options=stage_opts,
+                              answer=headless(cli_args.stage))
 
     if stage_answer == "y":
 
         validate_staging(args)
 
         # Prepare migration from dump
-        plan_staging = plan(source=args.dump, destinations=args.staging, ignore=args.ignore)
+        plan_staging = plan(source=args.dump, destinations=args.staging, ignore=args.ignore,
+                            engine=args.engine, dedup=cli_args.dedup, similar=cli_args.similar,
+                            drop_similar=cli_args.drop_similar,
+                            incremental=cli_args.incremental, metadata=cli_args.metadata,
+                            takeout=cli_args.takeout, plan_format=cli_args.plan_format)
 
         # Execute migration
-        execute(df=plan_staging, mode=args.mode, replace=args.replace)
+        execute(df=plan_staging, mode=args.mode, replace=args.replace,
+                workers=cli_args.workers, volume_limit=cli_args.volume_limit,
+                metrics=cli_args.metrics, **transfer_options)
+
+        if cli_args.takeout:
+            # Sidecars stay in the dump, staged files carry the time in their mtime
+            stamped = stamp_taken_times(plan_staging)
+            print(f"\n{stamped} staged files dated by photoTakenTime")
 
         # Prepare migration to server from staging
-        plan_server = plan(source=args.staging["HOME"], destinations=args.server, ignore=args.ignore)
+        plan_server = plan(source=args.staging["HOME"], destinations=args.server, ignore=args.ignore,
+                           engine=args.engine, dedup=cli_args.dedup, similar=cli_args.similar,
+                           drop_similar=cli_args.drop_similar,
+                           incremental=cli_args.incremental, metadata=cli_args.metadata,
+                           plan_format=cli_args.plan_format,
+                           catalog=catalog, replace=args.replace)
 
     else:
         # Prepare direct migration to server
-        plan_server = plan(source=args.dump, destinations=args.server, ignore=args.ignore)
+        plan_server = plan(source=args.dump, destinations=args.server, ignore=args.ignore,
+                           engine=args.engine, dedup=cli_args.dedup, similar=cli_args.similar,
+                           drop_similar=cli_args.drop_similar,
+                           incremental=cli_args.incremental, metadata=cli_args.metadata,
+                           takeout=cli_args.takeout, plan_format=cli_args.plan_format,
+                           catalog=catalog, replace=args.replace)
+
+    if plan_server is not None:
+        # How much will move, and for how long
+        estimate_table = estimate(df=plan_server, mode=args.mode, replace=args.replace,
+                                  compare=cli_args.compare, workers=cli_args.workers,
+                                  volume_limit=cli_args.volume_limit, bandwidth=bandwidth,
+                                  probe=cli_args.probe)
+        show_estimate(estimate_table, total_seconds(estimate_table, workers=cli_args.workers,
+                                                    bandwidth=bandwidth))
+        save_estimate(estimate_table, plan_server.attrs.get("plan_path"))
 
     # Confirm load job
     load_options = ["y", "n"]
     load_question = (f"\nReady to load data to the server? {'/'.join(load_options)}: ")
-    load_answer = cli_ask_question(question=load_question, options=load_options)
+    load_answer = cli_answer(question=load_question, options=load_options,
+                             answer=headless(True))
 
     if load_answer == "y":
         # Execute migration
-        execute(df=plan_server, mode=args.mode, replace=args.replace)
+        execute(df=plan_server, mode=args.mode, replace=args.replace, catalog=catalog,
+                workers=cli_args.workers, volume_limit=cli_args.volume_limit,
+                journal=cli_args.journal, verify=cli_args.verify,
+                metrics=cli_args.metrics, **transfer_options)
     else:
         print(f"\nAll files are ready to load in staging. Abortng.")
         return
 
     if stage_answer == "y":
         # Cleanup
-        optionally_clean_dir(args.staging["HOME"])
+        optionally_clean_dir(args.staging["HOME"], answer=headless(cli_args.clean))
 
 if __name__ == "__main__":
     main()
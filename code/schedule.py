@@ -0,0 +1,146 @@
+from imports import *
+import datetime
+import threading
+from itertools import zip_longest
+
+# Files below this size are batched together
+SMALL_FILE = 1024 * 1024
+# Maximum number of small files in a batch
+BATCH_SIZE = 64
+
+
+def interleave(*sequences) -> list:
+    """
+    Takes one item from each sequence in turn: a1, b1, a2, b2, b3...
+    """
+    output = []
+    for items in zip_longest(*sequences):
+        output.extend(i for i in items if i is not None)
+    return output
+
+
+def schedule_units(df:pd.DataFrame, volumes:pd.Series, small_size:int=SMALL_FILE,
+                   batch_size:int=BATCH_SIZE) -> List[List[int]]:
+    """
+    Splits the rows of a migration table into units of work, in the order
+    they should run. Units are lists of row positions migrated one after
+    the other by the same worker:
+        - small files (below small_size) are sorted by destination, so
+          files going to the same folder travel together, and packed in
+          batches of batch_size to amortise the per-file overhead
+        - larger files are units on their own, largest first
+    On each volume small batches and large files alternate, so a few big
+    videos don't hold back thousands of thumbnails (or the other way
+    around), and volumes take turns.
+    """
+    sizes = df["st_size"].to_numpy() if "st_size" in df.columns else np.zeros(len(df))
+    rows = pd.DataFrame({"volume": volumes.to_numpy(), "size": sizes,
+                         "dst": df["abspath_dst"].to_numpy()})
+
+    per_volume = []
+    for _, group in rows.groupby("volume", sort=False):
+        small = group[group["size"] < small_size].sort_values("dst").index.to_list()
+        large = group[group["size"] >= small_size].sort_values("size", ascending=False).index
+        batches = [small[i:i + batch_size] for i in range(0, len(small), batch_size)]
+        per_volume.append(interleave(batches, [[p] for p in large]))
+
+    return interleave(*per_volume)
+
+
+class TokenBucket:
+    """
+    Thread safe bytes/sec limiter. consume(n) blocks until n more bytes
+    fit in the rate, allowing bursts of up to one second of traffic.
+    """
+
+    def __init__(self, rate:float):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n:int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Tokens go negative: callers queue up behind the debt
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Bandwidth:
+    """
+    Bytes/sec caps for migrations: `limit` for all transfers together,
+    `volume_limit` for each destination volume (either can be None).
+    """
+
+    def __init__(self, limit:float=None, volume_limit:float=None):
+        self.global_bucket = TokenBucket(limit) if limit else None
+        self.volume_limit = volume_limit
+        self.volume_buckets = {}
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"Bandwidth(limit={self.global_bucket and self.global_bucket.rate}, volume_limit={self.volume_limit})"
+
+    def throttle(self, volume:str=None):
+        """
+        A function to call with the size of each chunk written to volume,
+        None if there is no cap.
+        """
+        buckets = [self.global_bucket] if self.global_bucket else []
+        if self.volume_limit:
+            with self.lock:
+                if volume not in self.volume_buckets:
+                    self.volume_buckets[volume] = TokenBucket(self.volume_limit)
+                buckets.append(self.volume_buckets[volume])
+
+        if not buckets:
+            return None
+
+        def throttle(n:int):
+            for bucket in buckets:
+                bucket.consume(n)
+        return throttle
+
+
+class TimeWindow:
+    """
+    Time of day when migrations may start, as "HH:MM-HH:MM" (local time,
+    can span midnight, e.g. "22:00-07:00"). Files in flight when the
+    window closes are completed.
+    """
+
+    def __init__(self, window:str):
+        try:
+            start, end = window.split("-")
+            self.start = datetime.datetime.strptime(start.strip(), "%H:%M").time()
+            self.end = datetime.datetime.strptime(end.strip(), "%H:%M").time()
+        except ValueError:
+            raise ValueError(f"window should look like '22:00-07:00', passed {window}")
+        self.window = window
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"TimeWindow({self.window})"
+
+    def contains(self, moment:datetime.time) -> bool:
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+    def wait(self):
+        """
+        Blocks until the window is open.
+        """
+        if self.contains(datetime.datetime.now().time()):
+            return
+        with self.lock:
+            now = datetime.datetime.now()
+            if not self.contains(now.time()):
+                print(f"\n{now:%H:%M:%S} - waiting for the migration window ({self.window})")
+            while not self.contains(datetime.datetime.now().time()):
+                time.sleep(30)
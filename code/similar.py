@@ -0,0 +1,185 @@
+from imports import *
+from concurrent.futures import ProcessPoolExecutor
+from cache import FileCache
+from metrics import measured
+
+try:
+    from PIL import Image
+except ImportError:
+    # Optional, only needed to find similar images
+    Image = None
+
+# Side of the grid compared by the difference hash (HASH_SIZE**2 bits)
+HASH_SIZE = 8
+# Images whose hashes differ by at most this many bits are similar
+MAX_DISTANCE = 4
+# Hashes with fewer bits set (or unset) come from blank or flat images
+DEGENERATE_BITS = 8
+
+
+def image_hash(path:str) -> Tuple[int, int, int]:
+    """
+    Difference hash (dHash) of an image: the image is shrunk to a grey
+    9x8 grid and each bit tells if a pixel is brighter than its right
+    neighbour. Re-compressed, resized or slightly edited copies of a photo
+    get the same hash, or one that differs by a few bits.
+    Returns (hash, width, height), or None if the image can't be read.
+    """
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            # JPEGs are decoded at a fraction of their size, much faster
+            image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            grid = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE))
+            pixels = list(grid.getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value, width, height
+
+
+def hamming(a:int, b:int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of hashes under the Hamming distance. Searching
+    for the hashes within a small radius only visits the branches whose
+    distance to the node allows a match (triangle inequality), instead
+    of comparing against every hash.
+    """
+
+    def __init__(self):
+        # Nodes are [hash, items, {distance: child}]
+        self.root = None
+
+    def add(self, value:int, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value:int, radius:int) -> list:
+        """
+        Items whose hash is at most radius bits away from value.
+        """
+        output = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                output.extend(node[1])
+            for d, child in node[2].items():
+                if distance - radius <= d <= distance + radius:
+                    stack.append(child)
+        return output
+
+
+def degenerate(value:int, margin:int=DEGENERATE_BITS) -> bool:
+    """
+    True for near-constant hashes (blank, flat or uniform gradient images),
+    which say nothing about what the image looks like.
+    """
+    ones = bin(value).count("1")
+    return ones < margin or ones > HASH_SIZE ** 2 - margin
+
+
+def similarity_groups(hashes:List[int], distance:int=MAX_DISTANCE) -> List[int]:
+    """
+    Groups hashes around representatives, taken in order: each hash not
+    grouped yet starts a group with the hashes (not grouped yet) within
+    distance bits of it. Every member is close to its representative, so
+    chains of similar hashes don't merge images that look different.
+    Degenerate hashes are not grouped. Returns, for each hash, the
+    position of the representative of its group (its own if alone).
+    """
+    tree = BKTree()
+    for i, value in enumerate(hashes):
+        if not degenerate(value):
+            tree.add(value, i)
+
+    groups = list(range(len(hashes)))
+    grouped = [False] * len(hashes)
+    for i, value in enumerate(hashes):
+        if grouped[i] or degenerate(value):
+            continue
+        for j in tree.search(value, distance):
+            if not grouped[j]:
+                grouped[j] = True
+                groups[j] = i
+
+    return groups
+
+
+@measured("similar_images")
+def similar_images(df:pd.DataFrame, distance:int=MAX_DISTANCE, workers:int=4,
+                   cache:FileCache=None) -> pd.DataFrame:
+    """
+    Finds near-duplicate images (file_type "image") and adds two columns:
+        - similar_group: same id for images that look the same
+        - similar_best: True for the copy to keep in each group (most
+          pixels, then largest file), and for all other files
+    Groups are formed around their best copy (see similarity_groups).
+    Hashes are computed on a pool of processes (requires Pillow) and
+    cached in _plans/cache by path, size and mtime.
+    """
+    if Image is None:
+        raise ImportError("finding similar images requires Pillow (pip install Pillow)")
+
+    print(f"\nFinding similar images ({workers} workers)...")
+    cache = FileCache("dhash") if cache is None else cache
+
+    images = df[df["file_type"] == "image"]
+    mtimes = images["st_mtime"].values.astype("datetime64[s]").astype("int64")
+    keys = list(zip(images["abspath_src"], images["st_size"], mtimes))
+
+    missing = object()
+    values = [cache.get(*k, default=missing) for k in keys]
+    todo = [i for i, v in enumerate(values) if v is missing]
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            paths = [keys[i][0] for i in todo]
+            for i, value in zip(todo, pool.map(image_hash, paths, chunksize=64)):
+                values[i] = value
+                cache.put(*keys[i], value)
+        cache.save()
+
+    hashed = [i for i, v in enumerate(values) if v is not None]
+
+    # Best copies first (most pixels, then most bytes), they represent their group
+    sizes = images["st_size"].to_numpy()
+    hashed.sort(key=lambda i: (-values[i][1] * values[i][2], -sizes[i]))
+    groups = similarity_groups([values[i][0] for i in hashed], distance=distance)
+
+    # Files that were not hashed are in a group of their own
+    key = pd.Series("row:" + df.index.astype(str), index=df.index)
+    key[images.index[hashed]] = ["similar:" + str(hashed[g]) for g in groups]
+    df["similar_group"] = pd.factorize(key)[0]
+    df["similar_best"] = True
+    df.loc[images.index[[i for i, g in zip(hashed, groups) if hashed[g] != i]], "similar_best"] = False
+
+    similar = (~df["similar_best"]).sum()
+    print(f"\t{len(todo)}/{len(images)} images hashed ({len(images) - len(todo)} from cache), "
+          f"{len(images) - len(hashed)} unreadable")
+    grouped = df.loc[df["similar_group"].duplicated(keep=False), "similar_group"].nunique()
+    print(f"\t{similar} near-duplicate images found ({grouped} groups)")
+
+    return df
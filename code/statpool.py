@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+
+@lru_cache(maxsize=None)
+def mount_point(dirname:str) -> str:
+    """
+    Returns the mount point a directory lives on.
+    Cached per directory, so it costs a few stats per folder, not per file.
+    """
+    path = os.path.abspath(dirname)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class AdaptiveLimit:
+    """
+    Caps the number of concurrent operations on one mount.
+    When adaptive, the cap grows by one while latency stays close to
+    the best latency seen so far, and halves when the server slows down
+    (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, maximum:int, adaptive:bool=True, window:int=64):
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.window = window
+        self.limit = max(1, maximum // 2) if adaptive else maximum
+        self.active = 0
+        self.baseline = None
+        self._samples = []
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def record(self, latency:float):
+
+        if not self.adaptive:
+            return
+
+        with self._cond:
+            self._samples.append(latency)
+            if len(self._samples) < self.window:
+                return
+
+            mean = sum(self._samples) / len(self._samples)
+            self._samples = []
+
+            if self.baseline is None or mean < self.baseline:
+                self.baseline = mean
+
+            if mean > 2 * self.baseline:
+                self.limit = max(1, self.limit // 2)
+            elif self.limit < self.maximum:
+                self.limit += 1
+            self._cond.notify_all()
+
+
+def stat_files(files:List[str], max_workers:int=32, mount_limit:int=8,
+               adaptive:bool=True) -> Tuple[List[Optional[os.stat_result]], List[str]]:
+    """
+    Stats files concurrently with a pool of max_workers threads, allowing at
+    most mount_limit stats in flight on each mount point.
+    Returns the stats (aligned with files, None for files that vanished
+    or could not be stat'ed) and the list of those files.
+    """
+    limits = {}
+    lock = threading.Lock()
+
+    def limit_for(path:str) -> AdaptiveLimit:
+        mount = mount_point(os.path.dirname(path))
+        with lock:
+            if mount not in limits:
+                limits[mount] = AdaptiveLimit(mount_limit, adaptive=adaptive)
+            return limits[mount]
+
+    def task(path:str) -> Optional[os.stat_result]:
+        limit = limit_for(path)
+        with limit:
+            start = time.perf_counter()
+            try:
+                stats = os.stat(path)
+            except OSError:
+                # Vanished after listing (or unreadable, e.g. a stale
+                # handle on a share), recorded below
+                return None
+            limit.record(time.perf_counter() - start)
+        return stats
+
+    # Submit in windows to avoid holding one future per file in memory
+    output = []
+    window = max_workers * 256
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for start in range(0, len(files), window):
+            output.extend(pool.map(task, files[start:start + window]))
+
+    missing = [f for f, stats in zip(files, output) if stats is None]
+    return output, missing
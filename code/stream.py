@@ -0,0 +1,175 @@
+from imports import *
+from helpers import *
+import queue
+import threading
+from itertools import islice
+from walk import scandir_walk
+from plan import filedesc_shallow, filedesc_entries, migration_table
+from execute import run_migrations, new_report
+from journal import Journal
+from ignore import IgnoreMatcher
+from metrics import save_metrics, with_summary, METRICS
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd plans directory
+plans_dir = here.parent / "_plans"
+
+
+def chunked(iterable, size:int) -> Iterator[list]:
+    """
+    Splits an iterable into lists of (at most) size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefetch(iterable, size:int=2) -> Iterator:
+    """
+    Consumes an iterable in a background thread, keeping at most `size`
+    items ready. The producer (listing, describing) then keeps working
+    while the consumer (copying) handles the previous items.
+    """
+    items = queue.Queue(maxsize=size)
+    end = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            items.put(end)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        item = items.get()
+        if item is end:
+            break
+        yield item
+
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+class SeenKeys:
+    """
+    Compact set of the destination basenames planned so far, stored as a
+    sorted array of 64 bit hashes (8 bytes per file) to deduplicate
+    across chunks.
+    """
+
+    def __init__(self):
+        self.keys = np.array([], dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_new(self, values:pd.Series) -> pd.Series:
+        """
+        Adds values to the set. Returns True for values already seen
+        (in previous calls, or earlier in values).
+        """
+        keys = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        seen = np.isin(keys, self.keys) | pd.Series(keys).duplicated().to_numpy()
+        self.keys = np.union1d(self.keys, keys[~seen])
+        return pd.Series(seen, index=values.index)
+
+
+def plan_stream(*, source:str, destinations:dict, ignore:list, chunk_size:int=10000,
+                max_workers:int=8, catalog=None, replace:bool=False,
+                metadata:bool=False) -> Iterator[pd.DataFrame]:
+    """
+    Same as plan(), but yields the migration table in chunks of
+    chunk_size files, as soon as they are listed. Memory is bounded
+    by the size of a chunk (plus 8 bytes per file for deduplication).
+    """
+    seen = SeenKeys()
+    entries = scandir_walk(source, max_workers=max_workers, matcher=IgnoreMatcher(ignore))
+    for chunk in chunked(entries, chunk_size):
+
+        shallow = filedesc_shallow(files=[e.path for e in chunk])
+        deep = filedesc_entries(entries=chunk)
+        description = pd.merge(shallow, deep, how="inner", on="abspath_src")
+        if metadata:
+            from metadata import capture_times
+            description = capture_times(description)
+        table = migration_table(df=description, dirs=destinations, catalog=catalog,
+                                replace=replace, save=False)
+
+        # Deduplicate against previous chunks
+        duplicated = seen.add_new(table["basename_dst"])
+        yield table[~duplicated].reset_index(drop=True)
+
+
+def run_stream(*, source:str, destinations:dict, ignore:list, mode:str, replace:bool,
+               chunk_size:int=10000, catalog=None, journal:str=None, metrics:str=None,
+               metadata:bool=False, **options):
+    """
+    Plans and executes a migration chunk by chunk: files are copied while
+    the rest of the source is still being listed. Plans and reports are
+    appended to one CSV each in _plans. Options are passed to
+    execute.run_migrations (workers, volume_limit, verify). The timings of
+    the stages are added to the report, metrics also saves them next to
+    it (see execute), metadata
+    reads capture times from photo and video headers (see plan).
+    """
+    print(f"\nStreaming migration (chunks of {chunk_size} files)...")
+
+    METRICS.enable()
+
+    timestring = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S_%f")
+    plan_path = plans_dir / f"{timestring}_plan.csv"
+    report_path = plans_dir / f"{timestring}_migration_report.csv"
+
+    if journal is not None:
+        journal = Journal(journal)
+
+    first = True
+    totals = pd.Series(0, index=["planned", "copied", "moved", "skipped", "errors"])
+    chunks = plan_stream(source=source, destinations=destinations, ignore=ignore,
+                         chunk_size=chunk_size, catalog=catalog, replace=replace,
+                         metadata=metadata)
+    for table in prefetch(chunks):
+
+        report = run_migrations(df=table, mode=mode, replace=replace, journal=journal, **options)
+        if catalog is not None:
+            catalog.update_from_report(report=report, df=table)
+
+        # Append to plan and report
+        table.index += totals["planned"]
+        report.index = table.index
+        table.to_csv(plan_path, mode="a", header=first)
+        with_summary(report).to_csv(report_path, mode="a", header=first)
+        first = False
+
+        totals += [len(table), report["copied"].sum(), report["moved"].sum(),
+                   report["skipped"].sum(), report["error"].count()]
+
+    if journal is not None:
+        journal.close()
+
+    print(f"\n - planned {totals['planned']}"
+          f"\n - copied {totals['copied']}"
+          f"\n - moved {totals['moved']}"
+          f"\n - skipped {totals['skipped']}"
+          f"\n - errors {totals['errors']}")
+    # Timings of the stages after the files
+    records = METRICS.summary()
+    with_summary(pd.DataFrame(columns=list(new_report("", ""))), records).to_csv(
+        report_path, mode="a", header=first)
+    if metrics is not None:
+        extension = "prom" if metrics == "prometheus" else metrics
+        save_metrics(plans_dir / f"{timestring}_metrics.{extension}", metrics_format=metrics)
+    else:
+        METRICS.reset()
+
+    print(f"\nPlan and report ready ({os.path.basename(plan_path)}, {os.path.basename(report_path)})")
@@ -0,0 +1,210 @@
+from imports import *
+from concurrent.futures import ThreadPoolExecutor
+from ignore import IgnoreMatcher
+from metrics import measured
+from compact import plan_paths
+
+SIDECAR_SUFFIX = ".json"
+# Newer takeouts name sidecars "IMG_1234.jpg.supplemental-metadata.json"
+SUPPLEMENTAL = "supplemental-metadata"
+# Google truncates sidecar names to this many characters (with ".json")
+MAX_NAME = 51
+# Suffixes of the edited copies, which share the sidecar of the original
+EDITED_SUFFIXES = ["-edited", "-effects", "-smile", "-mix", "-modifié", "-bearbeitet", "-editado"]
+
+# Counter added to duplicated names, "IMG(1).jpg" -> "IMG.jpg(1).json"
+COUNTER = re.compile(r"^(.*?)(\(\d+\))$")
+
+
+def split_counter(name:str) -> Tuple[str, str]:
+    """
+    Splits the "(n)" counter at the end of a name: ("IMG", "(1)").
+    """
+    match = COUNTER.match(name)
+    return (match.group(1), match.group(2)) if match else (name, "")
+
+
+def sidecar_key(basename:str) -> Tuple[str, str, bool]:
+    """
+    The (name, counter) of the media file a sidecar describes, from the
+    name of the sidecar, and True if the name was truncated by Google:
+        "IMG.jpg.json"                            -> ("IMG.jpg", "")
+        "IMG.jpg(1).json"                         -> ("IMG.jpg", "(1)")
+        "IMG.jpg.supplemental-metadata(1).json"   -> ("IMG.jpg", "(1)")
+        "IMG.jpg.supplemental-meta.json"          -> ("IMG.jpg", "")
+    """
+    stem = basename[:-len(SIDECAR_SUFFIX)]
+    name, counter = split_counter(stem)
+    truncated = len(name) + len(SIDECAR_SUFFIX) >= MAX_NAME
+
+    # The supplemental suffix may be truncated too (".supplemental-me")
+    head, dot, tail = name.rpartition(".")
+    if dot and head and tail and SUPPLEMENTAL.startswith(tail):
+        return head, counter, False
+
+    return name, counter, truncated
+
+
+def media_keys(basename:str) -> List[Tuple[str, str]]:
+    """
+    The (name, counter) keys a media file can have in the sidecar index,
+    most specific first: "IMG(1).jpg" -> ("IMG(1).jpg", ""), ("IMG.jpg", "(1)");
+    "IMG-edited.jpg" -> ("IMG-edited.jpg", ""), ("IMG.jpg", ""); some
+    takeouts drop the extension: ("IMG", "").
+    """
+    filename, extension = os.path.splitext(basename)
+    keys = [(basename, "")]
+
+    name, counter = split_counter(filename)
+    if counter:
+        keys.append((name + extension, counter))
+
+    for suffix in EDITED_SUFFIXES:
+        if name.lower().endswith(suffix):
+            keys.append((name[:-len(suffix)] + extension, counter))
+            break
+
+    keys.append((filename, ""))
+    return keys
+
+
+class SidecarIndex:
+    """
+    Hash index from media files to their Takeout sidecars, built from the
+    sidecar names only (no file is opened). Sidecars are looked up in the
+    directory of the media file: exactly, and by prefix for names that
+    Google truncated (a few dict lookups, one per truncated length).
+    """
+
+    def __init__(self, sidecars:List[str]):
+        self.exact = {}
+        self.truncated = {}
+        self.lengths = {}
+
+        for path in sidecars:
+            dirname, basename = os.path.split(path)
+            name, counter, truncated = sidecar_key(basename)
+            self.exact.setdefault((dirname, name, counter), path)
+            if truncated:
+                self.truncated.setdefault((dirname, name, counter), path)
+                self.lengths.setdefault(dirname, set()).add(len(name))
+
+    def __len__(self):
+        return len(self.exact)
+
+    def lookup(self, path:str) -> str:
+        """
+        The sidecar of a media file, None if it has none.
+        """
+        dirname, basename = os.path.split(path)
+        keys = media_keys(basename)
+
+        for name, counter in keys:
+            sidecar = self.exact.get((dirname, name, counter))
+            if sidecar is not None:
+                return sidecar
+
+        # The counter of "IMG(1).jpg" would be cut from a truncated name,
+        # keys that keep it apart are tried first
+        keys = [k for k in keys if k[1]] + [k for k in keys if not k[1]]
+        for length in sorted(self.lengths.get(dirname, ()), reverse=True):
+            for name, counter in keys:
+                if len(name) > length:
+                    sidecar = self.truncated.get((dirname, name[:length], counter))
+                    if sidecar is not None:
+                        return sidecar
+
+        return None
+
+
+def is_sidecar(path:str) -> bool:
+    return path.lower().endswith(SIDECAR_SUFFIX)
+
+
+def listing_patterns(ignore:List[str]) -> List[str]:
+    """
+    Ignore patterns to list a takeout with: the ones that would drop the
+    sidecars (e.g. ".json") are applied after listing (see split_sidecars).
+    """
+    return [p for p in ignore or [] if not IgnoreMatcher([p]).ignore_file("sidecar.json")]
+
+
+def split_sidecars(files:List[str], ignore:List[str]) -> Tuple[List[bool], List[str]]:
+    """
+    Sets the sidecars of a listing aside. Returns which files to keep (not
+    sidecars, not ignored) and the paths of the sidecars. A .json file is
+    a sidecar only if a file of the listing matches it (see SidecarIndex),
+    other .json files are the user's, kept unless ignored.
+    """
+    index = SidecarIndex([path for path in files if is_sidecar(path)])
+    sidecars = {index.lookup(path) for path in files if not is_sidecar(path)}
+    sidecars.discard(None)
+
+    matcher = IgnoreMatcher(ignore)
+    keep = [path not in sidecars and not matcher.ignore_file(os.path.basename(path))
+            for path in files]
+    return keep, [path for path in files if path in sidecars]
+
+
+def taken_time(path:str):
+    """
+    photoTakenTime of a sidecar (UTC, naive like the file stats),
+    None if it has none or can't be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            content = json.load(f)
+        return pd.Timestamp(int(content["photoTakenTime"]["timestamp"]), unit="s")
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+@measured("takeout_times")
+def takeout_times(df:pd.DataFrame, sidecars:List[str], workers:int=16) -> pd.DataFrame:
+    """
+    Adds a `taken_at` column to a files table: the photoTakenTime of the
+    Google Takeout sidecar of each file (see SidecarIndex), NaT for files
+    without one. Sidecars are parsed in parallel, each once (edited copies
+    share the sidecar of the original).
+    """
+    print(f"\nReading Google Takeout sidecars ({workers} workers)...")
+
+    index = SidecarIndex(sidecars)
+    matches = [index.lookup(p) for p in df["abspath_src"]]
+    unique = list(dict.fromkeys(m for m in matches if m is not None))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        times = dict(zip(unique, pool.map(taken_time, unique)))
+
+    df["taken_at"] = pd.to_datetime(pd.Series([times.get(m) for m in matches],
+                                              index=df.index, dtype=object))
+
+    found = df["taken_at"].notnull().sum()
+    print(f"\t{len(unique)}/{len(index)} sidecars matched, "
+          f"{found}/{len(df)} files dated by photoTakenTime")
+
+    return df
+
+
+def stamp_taken_times(df:pd.DataFrame) -> int:
+    """
+    Sets the mtime of the migrated files of a plan (abspath_dst, full or
+    compact plan) to their taken_at, so that plans made from them (e.g.
+    from staging, where the sidecars are not copied) date them the same
+    way. Returns the number of files updated.
+    """
+    if df is None or "taken_at" not in df.columns:
+        return 0
+
+    stamped = 0
+    # Compact plans store times as int64
+    taken_at = pd.to_datetime(df["taken_at"])
+    taken = taken_at.notnull()
+    for path, timestamp in zip(plan_paths(df[taken], "abspath_dst"), taken_at[taken]):
+        seconds = timestamp.value / 1e9
+        try:
+            os.utime(path, (seconds, seconds))
+            stamped += 1
+        except FileNotFoundError:
+            continue
+    return stamped
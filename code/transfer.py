@@ -0,0 +1,212 @@
+from imports import *
+import errno
+from functools import lru_cache
+from dedup import new_hash, full_hash
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+# ioctl request to clone a file on Linux (btrfs, xfs...), from linux/fs.h
+FICLONE = 0x40049409
+
+# Errors meaning "this primitive is not supported here, try the next one"
+UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP,
+               errno.EINVAL, errno.ENOTTY, errno.EBADF}
+
+# Read size when copying through userspace
+CHUNK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def device_of(dirname:str) -> int:
+    """
+    The device id of a directory (cached, directories don't change device).
+    """
+    return os.stat(dirname).st_dev
+
+
+def same_device(src:str, dst:str) -> bool:
+    """
+    True if src and the destination directory of dst are on the same device.
+    """
+    return device_of(os.path.dirname(src)) == device_of(os.path.dirname(dst))
+
+
+def reflink(fsrc:int, fdst:int, size:int):
+    """
+    Clones the file: the copy shares blocks with src, no data is moved.
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOSYS, "reflink not supported")
+    fcntl.ioctl(fdst, FICLONE, fsrc)
+
+
+def copy_range(fsrc:int, fdst:int, size:int):
+    """
+    Copies with copy_file_range, data stays in the kernel (or on the server
+    for network file systems supporting server-side copy).
+    """
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range not supported")
+    while os.copy_file_range(fsrc, fdst, CHUNK_SIZE * 64) > 0:
+        pass
+
+
+def send_file(fsrc:int, fdst:int, size:int):
+    """
+    Copies with sendfile, data stays in the kernel.
+    """
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOSYS, "sendfile not supported")
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(fdst, fsrc, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def partial_path(dst:str) -> str:
+    """
+    Temporary name of a file being written to dst (hidden, so that
+    listings ignore it).
+    """
+    dirname, basename = os.path.split(dst)
+    return os.path.join(dirname, f".{basename}.partial")
+
+
+def copy_file(src:str, dst:str, atomic:bool=False, throttle=None) -> str:
+    """
+    Copies src to dst preserving metadata (like shutil.copy2), using the
+    cheapest primitive that works: a reflink clone on the same device, then
+    copy_file_range, sendfile, and finally a plain userspace copy.
+    If atomic, the copy is written to a temporary name and renamed to dst
+    once complete, so dst is never a partial file.
+    If throttle is passed (see schedule.Bandwidth), it is called with the
+    size of each chunk written, and the copy goes through userspace (kernel
+    copies can't be paced) unless it can be a reflink.
+    Returns the name of the strategy used.
+    """
+    strategies = [("copy_file_range", copy_range), ("sendfile", send_file)]
+    if throttle is not None:
+        strategies = []
+    if same_device(src, dst):
+        strategies.insert(0, ("reflink", reflink))
+
+    target = partial_path(dst) if atomic else dst
+    with open(src, "rb") as fsrc, open(target, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for strategy, function in strategies:
+            try:
+                function(fsrc.fileno(), fdst.fileno(), size)
+                break
+            except OSError as ex:
+                if ex.errno not in UNSUPPORTED:
+                    raise
+                # Start over with the next strategy
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        else:
+            strategy = "userspace" if throttle is None else "throttled"
+            for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b""):
+                if throttle is not None:
+                    throttle(len(chunk))
+                fdst.write(chunk)
+        if atomic:
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+    shutil.copystat(src, target)
+    if atomic:
+        os.replace(target, dst)
+    return strategy
+
+
+def copy_verified(src:str, dst:str, verify:str, atomic:bool=False, throttle=None) -> str:
+    """
+    Copies src to dst through userspace, hashing the bytes while they are
+    copied (no extra read of src), then checks the copy:
+        - "readback": reads dst back and compares the hashes
+        - "stat": compares size and mtime of dst with src (no extra read)
+    Raises ValueError and removes the copy if the check fails. Chunks
+    are paced by throttle, if passed (see copy_file).
+    Returns the digest of the content (same hash as dedup.full_hash).
+    """
+    h = new_hash()
+    written = 0
+    target = partial_path(dst) if atomic else dst
+    with open(src, "rb") as fsrc, open(target, "wb") as fdst:
+        for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b""):
+            if throttle is not None:
+                throttle(len(chunk))
+            h.update(chunk)
+            fdst.write(chunk)
+            written += len(chunk)
+        if atomic:
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+    shutil.copystat(src, target)
+    digest = h.hexdigest()
+
+    if verify == "readback":
+        valid = full_hash(target) == digest
+    elif verify == "stat":
+        src_stats = os.stat(src)
+        dst_stats = os.stat(target)
+        valid = (dst_stats.st_size == written == src_stats.st_size
+                 and int(dst_stats.st_mtime) == int(src_stats.st_mtime))
+    else:
+        raise ValueError(f"verify can be one of ['readback', 'stat'], passed {verify}")
+
+    if not valid:
+        os.remove(target)
+        raise ValueError(f"DATA INTEGRITY: copy of {src} failed verification ({verify}).")
+
+    if atomic:
+        os.replace(target, dst)
+    return digest
+
+
+def move_file(src:str, dst:str, atomic:bool=False, verify:str=None,
+              throttle=None) -> Tuple[str, str]:
+    """
+    Moves src to dst. On the same device this is a rename (no data moved),
+    otherwise the file is copied with copy_file() and src removed. If
+    verify is passed, the copy is made with copy_verified() and src is
+    only removed once the copy has been verified. Renames are checked
+    with a stat of dst (size and mtime, renamed back if they don't match),
+    and dst is hashed if verify is "readback". Copies are paced by
+    throttle (see copy_file), renames are not.
+    Returns the name of the strategy used and the digest (if verified).
+    """
+    if same_device(src, dst):
+        src_stats = os.stat(src) if verify else None
+        try:
+            os.replace(src, dst)
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+        else:
+            if not verify:
+                return "rename", None
+            dst_stats = os.stat(dst)
+            if (dst_stats.st_size != src_stats.st_size
+                    or dst_stats.st_mtime_ns != src_stats.st_mtime_ns):
+                os.replace(dst, src)
+                raise ValueError(f"DATA INTEGRITY: rename of {src} failed verification (stat).")
+            return "rename", full_hash(dst) if verify == "readback" else None
+
+    if verify:
+        strategy = "verified"
+        digest = copy_verified(src, dst, verify, atomic=atomic, throttle=throttle)
+    else:
+        strategy = copy_file(src, dst, atomic=atomic, throttle=throttle)
+        digest = None
+
+    os.remove(src)
+    return strategy, digest
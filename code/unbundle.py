@@ -0,0 +1,53 @@
+#!/Users/lorismarini/anaconda3/bin/python
+
+USAGE = """
+Unpacks the bundles of small files written by execute(bundle=...).
+Run it on the server (e.g. as a scheduled task on the NAS), where
+files are local and unpacking is cheap. Files that already exist are
+kept in the bundle, and the sources of moved files are only removed
+(by the next run.py) once they have been extracted.
+
+Example 1:
+    python unbundle.py --server "/volume1"
+"""
+
+from imports import *
+from helpers import *
+import tarfile
+from bundle import find_bundles, unbundle
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     usage=USAGE)
+    parser.add_argument('--server', type=str, required=True,
+                        help="Directory to search for bundles (recursively).")
+    parser.add_argument('-r', '--replace', type=str_to_bool, default=False,
+                        help="Replace files that already exist.")
+    cli_args = parser.parse_args()
+
+    bundles = find_bundles(os.path.expanduser(cli_args.server))
+    print(f"\nUnpacking {len(bundles)} bundles...")
+
+    extracted = skipped = errors = 0
+    for path in tqdm(bundles):
+        try:
+            e, s = unbundle(path, replace=cli_args.replace)
+            extracted += e
+            skipped += s
+        except (OSError, tarfile.TarError) as ex:
+            print(f"\tWARNING: could not unpack {path} ({ex})")
+            errors += 1
+
+    print(f"\n - extracted {extracted}"
+          f"\n - skipped {skipped}"
+          f"\n - errors {errors}")
+
+    if skipped:
+        print("\nSkipped files already existed, and are kept in their bundles. "
+              "Run again with -r True to replace them.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, NamedTuple, Tuple
+
+
+class WalkEntry(NamedTuple):
+    """
+    A file found while walking a directory, with the stats
+    collected from its DirEntry (no second stat round trip).
+    """
+    path: str
+    st_mtime: float
+    st_ctime: float
+    st_size: int
+
+
+def scan_dir(path:str, include_hidden:bool=False,
+             matcher=None) -> Tuple[List[WalkEntry], List[str]]:
+    """
+    Lists a single directory with os.scandir. Returns the files
+    it contains (with stats) and the paths of its subdirectories.
+    Directories that can't be read are reported and skipped.
+    Files and directories ignored by matcher (an ignore.IgnoreMatcher)
+    are left out.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                # glob ignores hidden files and directories, so do we
+                if not include_hidden and entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not (matcher and matcher.prune_dir(entry.name)):
+                            subdirs.append(entry.path)
+                    elif matcher and matcher.ignore_file(entry.name):
+                        continue
+                    elif entry.is_file():
+                        stats = entry.stat()
+                        files.append(WalkEntry(entry.path,
+                                               stats.st_mtime,
+                                               stats.st_ctime,
+                                               stats.st_size))
+                except FileNotFoundError:
+                    # Removed between listing and stat
+                    continue
+    except OSError as ex:
+        print(f"\tWARNING: could not list {path} ({ex})")
+
+    return files, subdirs
+
+
+def scandir_walk(src_dir:str, max_workers:int=8, include_hidden:bool=False,
+                 matcher=None) -> Iterator[WalkEntry]:
+    """
+    Walks src_dir recursively with os.scandir, fanning out subdirectories
+    to a bounded thread pool. Yields files as soon as their directory has
+    been listed, so the caller can start working before the walk is over.
+    On a remote volume most of the time is spent waiting for the network,
+    so threads give a near-linear speedup up to the server's limit.
+    Ignored directories (see scan_dir) are never listed.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(scan_dir, src_dir, include_hidden, matcher)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(pool.submit(scan_dir, subdir, include_hidden, matcher))
+                yield from files
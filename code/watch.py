@@ -0,0 +1,435 @@
+#!/Users/lorismarini/anaconda3/bin/python
+
+USAGE = """
+Watches a dump directory and migrates new files to the server as soon
+as they are completely written. Stop with Ctrl+C.
+
+Example 1:
+    python watch.py -m "copy" --dump "~/dump" --server "~/server"
+
+Example 2 (dump on a network share, poll every 30 seconds):
+    python watch.py --backend poll --interval 30 --dump "/Volumes/dump" --server "~/server"
+"""
+
+from imports import *
+from helpers import *
+import select
+import struct
+import ctypes
+import ctypes.util
+from walk import WalkEntry, scandir_walk
+from incremental import walk_incremental
+from ignore import IgnoreMatcher
+from plan import filedesc_shallow, filedesc_entries, migration_table
+from execute import run_migrations
+from compact import plan_paths
+from stream import chunked
+from journal import Journal
+from catalog import Catalog
+
+# Get the directory of this file
+here = pathlib.Path(__file__).parent.absolute()
+# FInd plans directory
+plans_dir = here.parent / "_plans"
+
+# inotify flags, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+# Changes made by other clients of these file systems are not notified
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afpfs", "fuse.sshfs", "9p"}
+
+BACKENDS = ["auto", "inotify", "poll"]
+
+
+def filesystem_type(path:str) -> str:
+    """
+    File system type of the mount path is on (from /proc/mounts),
+    None if unknown.
+    """
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                mount = parts[1].replace("\\040", " ")
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                    best, fstype = mount, parts[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def load_libc():
+    """
+    The C library, if it exposes inotify (Linux), else None.
+    """
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """
+    Reports files created, written or moved into a directory tree,
+    using inotify through ctypes. Every directory gets a watch, new
+    directories are watched (and listed) as they appear.
+    """
+
+    def __init__(self, root:str, matcher:IgnoreMatcher=None):
+        self.root = root
+        self.matcher = matcher
+        self.libc = load_libc()
+        if self.libc is None:
+            raise OSError("inotify is not available on this system")
+
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self.changed = set()
+        self.add_tree(root, report=False)
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path:str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            print(f"\tWARNING: could not watch {path} ({os.strerror(ctypes.get_errno())})")
+            return
+        self.dirs[wd] = path
+
+    def add_tree(self, path:str, report:bool=True):
+        """
+        Watches path and its subdirectories. If report, files already
+        in there (written before the watch existed) are reported.
+        """
+        self.add_watch(path)
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames if self.keep(d, directory=True)]
+            for d in dirnames:
+                self.add_watch(os.path.join(dirpath, d))
+            if report:
+                self.changed.update(os.path.join(dirpath, f) for f in filenames if self.keep(f))
+
+    def keep(self, name:str, directory:bool=False) -> bool:
+        if name.startswith("."):
+            return False
+        if self.matcher is None:
+            return True
+        return not (self.matcher.prune_dir(name) if directory else self.matcher.ignore_file(name))
+
+    def changes(self, timeout:float) -> set:
+        """
+        Waits up to timeout seconds for events, returns the paths of
+        the files that changed since the last call.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                self.handle(wd, mask, name)
+
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def handle(self, wd:int, mask:int, name:str):
+
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, find files by listing everything again
+            print("\tWARNING: inotify queue overflow, listing the whole dump")
+            self.changed.update(e.path for e in scandir_walk(self.root, matcher=self.matcher))
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            self.dirs.pop(wd, None)
+            return
+
+        parent = self.dirs.get(wd)
+        if parent is None or not name:
+            return
+        path = os.path.join(parent, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and self.keep(name, directory=True):
+                self.add_tree(path)
+        elif self.keep(name):
+            self.changed.add(path)
+
+
+class PollingWatcher:
+    """
+    Reports new or changed files by listing the tree every interval.
+    Only directories whose mtime changed are listed again (see
+    incremental.walk_incremental), so a quiet dump costs one stat per
+    directory and per file (files being written don't change the mtime
+    of their directory). Works on network mounts, where inotify sees nothing.
+    """
+
+    def __init__(self, root:str, matcher:IgnoreMatcher=None, max_workers:int=8):
+        self.root = root
+        self.matcher = matcher
+        self.max_workers = max_workers
+        self.snapshot = {}
+        self.known = {}
+        self.scan()
+
+    def close(self):
+        pass
+
+    def scan(self) -> set:
+        entries, self.snapshot, _ = walk_incremental(self.root, self.snapshot,
+                                                     max_workers=self.max_workers,
+                                                     matcher=self.matcher)
+        known = {e.path: (e.st_size, e.st_mtime) for e in entries}
+        changed = {p for p, stats in known.items() if self.known.get(p) != stats}
+        self.known = known
+        return changed
+
+    def changes(self, timeout:float) -> set:
+        time.sleep(timeout)
+        return self.scan()
+
+
+class Debouncer:
+    """
+    Holds files until they are completely written: a file is ready once
+    its size and mtime have not changed for `settle` seconds. Files of a
+    batch that failed are held again with retry(), for twice as long after
+    each failure (from `backoff` up to `max_backoff` seconds).
+    """
+
+    def __init__(self, settle:float=2.0, backoff:float=10.0, max_backoff:float=600.0):
+        self.settle = settle
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pending = {}
+        self.failures = {}
+        self.delayed = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, paths):
+        for path in paths:
+            # A new event restarts the clock
+            self.pending[path] = (None, time.monotonic())
+
+    def retry(self, paths) -> float:
+        """
+        Holds paths again after a failed migration. Returns the delay
+        before they are ready, in seconds.
+        """
+        now = time.monotonic()
+        delay = self.backoff
+        for path in paths:
+            failures = self.failures.get(path, 0) + 1
+            self.failures[path] = failures
+            delay = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+            self.delayed[path] = now + delay
+            self.pending[path] = (None, now)
+        return delay
+
+    def done(self, paths):
+        for path in paths:
+            self.failures.pop(path, None)
+
+    def ready(self) -> List[WalkEntry]:
+        now = time.monotonic()
+        output = []
+        for path, (last, since) in list(self.pending.items()):
+            if self.delayed.get(path, now) > now:
+                continue
+            self.delayed.pop(path, None)
+            try:
+                stats = os.stat(path)
+            except FileNotFoundError:
+                # Removed or renamed while being written
+                del self.pending[path]
+                continue
+
+            current = (stats.st_size, stats.st_mtime_ns)
+            if current != last:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                output.append(WalkEntry(path, stats.st_mtime, stats.st_ctime, stats.st_size))
+
+        return sorted(output)
+
+
+def migrate_batch(*, entries:List[WalkEntry], destinations:dict, mode:str, replace:bool,
+                  catalog:Catalog=None, **options) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Runs a batch of files through filedesc_shallow, filedesc_entries,
+    migration_table and run_migrations. Returns the plan and the report.
+    """
+    shallow = filedesc_shallow(files=[e.path for e in entries])
+    deep = filedesc_entries(entries=entries)
+    description = pd.merge(shallow, deep, how="inner", on="abspath_src")
+    table = migration_table(df=description, dirs=destinations, catalog=catalog,
+                            replace=replace, save=False)
+
+    report = run_migrations(df=table, mode=mode, replace=replace, **options)
+    if catalog is not None:
+        catalog.update_from_report(report=report, df=table)
+    return table, report
+
+
+def migrate_ready(*, batch:List[WalkEntry], debouncer:Debouncer, **options):
+    """
+    Migrates a batch of ready files (see migrate_batch). Files of a batch
+    that raised, and files reported with an error, go back to the
+    debouncer to be tried again later (see Debouncer.retry). Returns the
+    plan and the report, None if the batch failed.
+    """
+    paths = [e.path for e in batch]
+    try:
+        table, report = migrate_batch(entries=batch, **options)
+    except Exception as e:
+        # e.g. the server is unreachable, try the batch again later
+        delay = debouncer.retry(paths)
+        print(f"\n{pd.Timestamp.now():%H:%M:%S} - {len(batch)} files failed "
+              f"({e!r}), retrying in {delay:.0f}s")
+        return None
+
+    failed = (report["outcome"] == "error").to_numpy()
+    retried = plan_paths(table[failed], "abspath_src").to_list()
+    if retried:
+        delay = debouncer.retry(retried)
+        print(f"\n{pd.Timestamp.now():%H:%M:%S} - {len(retried)} files failed, "
+              f"retrying in {delay:.0f}s")
+    debouncer.done(set(paths) - set(retried))
+    return table, report
+
+
+def watch(*, source:str, destinations:dict, ignore:list, mode:str, replace:bool,
+          backend:str="auto", interval:float=1.0, settle:float=2.0, batch_size:int=100,
+          initial:bool=False, catalog:Catalog=None, journal:str=None, **options):
+    """
+    Watches source and migrates new files in batches of at most batch_size,
+    once they are stable for settle seconds (see Debouncer). backend is
+    "inotify", "poll" (every interval seconds) or "auto" (inotify, unless
+    source is on a network file system). With initial, files already in
+    source are migrated too. Plans and reports are appended to one CSV
+    each in _plans. Options are passed to execute.run_migrations.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend can be one of {BACKENDS}, passed {backend}")
+
+    matcher = IgnoreMatcher(ignore)
+    if backend == "auto":
+        network = filesystem_type(source) in NETWORK_FILESYSTEMS
+        backend = "inotify" if load_libc() is not None and not network else "poll"
+
+    print(f"\nWatching {source} ({backend})...")
+    if backend == "inotify":
+        watcher = InotifyWatcher(source, matcher=matcher)
+    else:
+        watcher = PollingWatcher(source, matcher=matcher)
+
+    debouncer = Debouncer(settle=settle)
+    if initial:
+        debouncer.add(e.path for e in scandir_walk(source, matcher=matcher))
+
+    timestring = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S_%f")
+    plan_path = plans_dir / f"{timestring}_plan.csv"
+    report_path = plans_dir / f"{timestring}_migration_report.csv"
+
+    if journal is not None:
+        journal = Journal(journal)
+
+    migrated = 0
+    try:
+        while True:
+            debouncer.add(watcher.changes(timeout=interval))
+            for batch in chunked(debouncer.ready(), batch_size):
+                output = migrate_ready(batch=batch, debouncer=debouncer,
+                                       destinations=destinations, mode=mode, replace=replace,
+                                       catalog=catalog, journal=journal, **options)
+                if output is None:
+                    continue
+                table, report = output
+
+                # Append to plan and report
+                table.index += migrated
+                report.index = table.index
+                table.to_csv(plan_path, mode="a", header=not os.path.exists(plan_path))
+                report.to_csv(report_path, mode="a", header=not os.path.exists(report_path))
+                migrated += len(table)
+
+                print(f"\n{pd.Timestamp.now():%H:%M:%S} - {len(table)} files migrated "
+                      f"({report['error'].count()} errors, {len(debouncer)} pending)")
+
+    except KeyboardInterrupt:
+        print(f"\nStopped watching, {migrated} files migrated "
+              f"({os.path.basename(report_path)})")
+    finally:
+        watcher.close()
+        if journal is not None:
+            journal.close()
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     usage=USAGE)
+    parser.add_argument('-d', '--dump', type=str, required=True, help="Directory to watch.")
+    parser.add_argument('--server', type=str, required=True, help="See run.py.")
+    parser.add_argument('-i', '--ignore', type=str, nargs="*",
+                        default=['.jsonl', '.json', '.aae', '@eaDir/', '#recycle/'])
+    parser.add_argument('-r', '--replace', type=str_to_bool, default=False)
+    parser.add_argument('-m', '--mode', type=str, default="copy", choices=["copy", "move"])
+    parser.add_argument('--backend', type=str, default="auto", choices=BACKENDS,
+                        help="inotify, poll (network mounts), or auto.")
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help="Seconds between checks (between listings when polling).")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Seconds a file must stay unchanged before it is migrated.")
+    parser.add_argument('--batch-size', type=int, default=100, help="Maximum files per batch.")
+    parser.add_argument('--initial', action='store_true', help="Migrate the files already in dump.")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="See run.py.")
+    parser.add_argument('--journal', type=str, default=None, help="See run.py.")
+    parser.add_argument('--verify', type=str, default=None, choices=["readback", "stat"],
+                        help="See run.py.")
+    parser.add_argument('--catalog', action='store_true', help="See run.py.")
+    cli_args = parser.parse_args()
+
+    destinations = server_paths(cli_args.server)
+
+    catalog = None
+    if cli_args.catalog:
+        catalog = Catalog()
+        if len(catalog) == 0:
+            catalog.build(destinations)
+
+    watch(source=os.path.expanduser(cli_args.dump), destinations=destinations,
+          ignore=cli_args.ignore, mode=cli_args.mode, replace=cli_args.replace,
+          backend=cli_args.backend, interval=cli_args.interval, settle=cli_args.settle,
+          batch_size=cli_args.batch_size, initial=cli_args.initial, catalog=catalog,
+          journal=cli_args.journal, workers=cli_args.workers, verify=cli_args.verify)
+
+
+if __name__ == "__main__":
+    main()
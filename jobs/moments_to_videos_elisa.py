@@ -32,12 +32,13 @@ def main() -> None:
     # EXPENSIVE OPERATION: List files
     files = ls_recursive(src_dir=arguments.dump, ignore=arguments.ignore)
 
-    # Select only video files
-    keep = ['.3gp', '.mp4', '.MP4', '.mov', '.MOV', '.MPG', '.AVI', '.WAV', '.wav']
-    files_to_move = list(pd.Series([f for f in files if os.path.splitext(f)[1] in keep]))
+    # Select only video files (and .wav recordings), any case
+    extensions = pd.Series([os.path.splitext(f)[1] for f in files])
+    keep = (file_types(extensions) == "video") | (extensions.str.lower() == ".wav")
+    files_to_move = list(pd.Series(files)[keep])
 
     # Find extensions of files to keep
-    leave = pd.Series([os.path.splitext(f)[1] for f in files if os.path.splitext(f)[1] not in keep]).unique()
+    leave = extensions[~keep].unique()
 
     # describe files (string ops, fast)
     shallow = filedesc_shallow(files=files_to_move)
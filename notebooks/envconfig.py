@@ -1,5 +1,11 @@
 from imports import *
 
+# Plotting dependencies (not imported by the migration code)
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib import rcParams
+import seaborn as sns
+
 from IPython.display import SVG
 from IPython.display import set_matplotlib_formats
 from IPython.core.interactiveshell import InteractiveShell
@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+
+# Modules in code/ import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+
+
+@pytest.fixture
+def plans(tmp_path, monkeypatch):
+    """
+    Redirects everything written to _plans to a temporary directory.
+    """
+    import plan
+    import incremental
+    import bundle
+    import cache
+
+    plans_dir = tmp_path / "_plans"
+    plans_dir.mkdir()
+    monkeypatch.setattr(plan, "plans_dir", plans_dir)
+    monkeypatch.setattr(incremental, "snapshots_dir", plans_dir / "snapshots")
+    monkeypatch.setattr(bundle, "PENDING_PATH", plans_dir / "pending_bundles.jsonl")
+    monkeypatch.setattr(cache, "cache_dir", plans_dir / "cache")
+    return plans_dir
+
+
+def write(path, content:bytes=b"data", mtime:float=None):
+    """
+    Writes a file (creating its directory), optionally with an mtime.
+    """
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
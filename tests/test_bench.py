@@ -0,0 +1,32 @@
+import os
+from bench import generate_dump, slow_mount, benchmark
+
+
+def tree(root) -> list:
+    return sorted((os.path.relpath(os.path.join(d, f), root), os.path.getsize(os.path.join(d, f)))
+                  for d, _, files in os.walk(root) for f in files)
+
+
+def test_generated_dumps_are_reproducible(tmp_path):
+    summary = generate_dump(str(tmp_path / "a"), files=30, depth=2, fanout=2, seed=1)
+    generate_dump(str(tmp_path / "b"), files=30, depth=2, fanout=2, seed=1)
+
+    assert summary["files"] == 30 and summary["dirs"] == 7
+    assert tree(tmp_path / "a") == tree(tmp_path / "b")
+    assert sum(size for _, size in tree(tmp_path / "a")) == summary["bytes"]
+
+
+def test_small_benchmark_on_a_slow_mount(tmp_path, plans):
+    dump = str(tmp_path / "dump")
+    generate_dump(dump, files=20, depth=1, fanout=2, seed=2)
+
+    scandir = os.scandir
+    with slow_mount(dump, stat=0.001, readdir=0.001) as counts:
+        results = benchmark(dump=dump, server=str(tmp_path / "server"))
+
+    assert [r["stage"] for r in results] == ["ls_recursive", "filedesc_shallow", "filedesc_deep",
+                                             "migration_table", "execute"]
+    assert results[0]["files"] == 20 and all(r["errors"] == 0 for r in results)
+    assert counts["readdir"] == 3 and counts["stat"] > 0
+    # Back to the real calls
+    assert os.scandir is scandir
@@ -0,0 +1,63 @@
+import os
+import pandas as pd
+from conftest import write
+from bundle import find_bundles, bundle_index, unbundle, release_sources, RESULTS_SUFFIX
+from execute import run_migrations
+
+
+def small_files(tmp_path, n:int=8) -> pd.DataFrame:
+    dump, server = tmp_path / "dump", tmp_path / "server" / "photo"
+    names = [f"IMG_{i}.xmp" for i in range(n)]
+    sources = [write(dump / name, name.encode()) for name in names]
+    return pd.DataFrame({"abspath_src": sources,
+                         "abspath_dst": [str(server / name) for name in names],
+                         "st_size": [os.path.getsize(s) for s in sources]})
+
+
+def test_bundled_files_are_reported_and_not_bundled_again(tmp_path, plans):
+    df = small_files(tmp_path, 9)
+    write(df["abspath_dst"][0], b"already there")
+
+    report = run_migrations(df=df, mode="copy", replace=False, bundle=1024)
+
+    assert report["outcome"].to_list() == ["skipped"] + ["bundled"] * 8
+    assert report["strategy"].to_list()[1:] == ["bundle"] * 8
+    assert not report["copied"].any() and not report["moved"].any()
+    bundles = find_bundles(str(tmp_path / "server"))
+    assert len(bundles) == 1
+
+    # Files waiting in a bundle are not sent again
+    report = run_migrations(df=df, mode="copy", replace=False, bundle=1024)
+    assert report["outcome"].to_list() == ["skipped"] * 9
+    assert find_bundles(str(tmp_path / "server")) == bundles
+
+    assert unbundle(bundles[0]) == (8, 0)
+    assert find_bundles(str(tmp_path / "server")) == []
+    assert [open(p, "rb").read() for p in df["abspath_dst"][1:]] == \
+           [os.path.basename(p).encode() for p in df["abspath_dst"][1:]]
+
+
+def test_moved_sources_are_kept_until_unbundled(tmp_path, plans):
+    df = small_files(tmp_path)
+
+    report = run_migrations(df=df, mode="move", replace=False, bundle=1024)
+
+    assert report["outcome"].to_list() == ["bundled"] * 8
+    assert all(os.path.exists(p) for p in df["abspath_src"])
+    assert release_sources() == (0, 8)
+
+    # A file was written at the destination of a member meanwhile
+    conflict = write(df["abspath_dst"][1], b"newer")
+    path, = find_bundles(str(tmp_path / "server"))
+
+    assert unbundle(path) == (7, 1)
+    assert open(conflict, "rb").read() == b"newer"
+    assert list(bundle_index(path)) == ["IMG_1.xmp"]
+    assert release_sources() == (7, 1)
+    assert [os.path.exists(p) for p in df["abspath_src"]] == [False, True] + [False] * 6
+
+    assert unbundle(path, replace=True) == (1, 0)
+    assert open(conflict, "rb").read() == b"IMG_1.xmp"
+    assert not os.path.exists(path)
+    assert release_sources() == (1, 0)
+    assert not os.path.exists(path + RESULTS_SUFFIX)
@@ -0,0 +1,74 @@
+import pandas as pd
+from conftest import write
+from catalog import Catalog, skip_cataloged
+
+
+def test_content_on_server_is_skipped_without_dedup(tmp_path):
+    server = tmp_path / "server"
+    write(server / "photo" / "2020" / "a.jpg", b"hello")
+    catalog = Catalog(str(tmp_path / "catalog.sqlite"))
+    catalog.build({"HOME": str(server), "image": str(server / "photo")}, hashes=True)
+
+    # Unique sizes in the dump: the planner never hashed them
+    df = pd.DataFrame({"abspath_src": [write(tmp_path / "dump" / "b.jpg", b"hello"),
+                                       write(tmp_path / "dump" / "c.jpg", b"world!")],
+                       "abspath_dst": [str(server / "photo" / "2021" / "b.jpg"),
+                                       str(server / "photo" / "2021" / "c.jpg")],
+                       "st_size": [5, 6]})
+
+    output = skip_cataloged(df=df, catalog=catalog, replace=False)
+
+    assert output["abspath_src"].to_list() == [str(tmp_path / "dump" / "c.jpg")]
+    # Only the file with the size of a hashed file on the server was read
+    assert df["content_hash"].notnull().to_list() == [True, False]
+
+
+def test_existing_destination_is_skipped_unless_replace(tmp_path):
+    server = tmp_path / "server"
+    dst = write(server / "photo" / "a.jpg", b"old")
+    catalog = Catalog(str(tmp_path / "catalog.sqlite"))
+    catalog.build({"HOME": str(server), "image": str(server / "photo")})
+
+    df = pd.DataFrame({"abspath_src": [write(tmp_path / "dump" / "a.jpg", b"new")],
+                       "abspath_dst": [dst], "st_size": [3]})
+
+    assert len(skip_cataloged(df=df.copy(), catalog=catalog, replace=False)) == 0
+    assert len(skip_cataloged(df=df.copy(), catalog=catalog, replace=True)) == 1
+
+
+def test_bundled_files_are_cataloged(tmp_path, plans):
+    from execute import run_migrations
+
+    server = tmp_path / "server" / "photo"
+    names = [f"IMG_{i}.xmp" for i in range(8)]
+    df = pd.DataFrame({"abspath_src": [write(tmp_path / "dump" / n, n.encode()) for n in names],
+                       "abspath_dst": [str(server / n) for n in names],
+                       "st_size": [len(n) for n in names],
+                       "st_mtime": pd.Timestamp("2020-01-01")})
+    catalog = Catalog(str(tmp_path / "catalog.sqlite"))
+
+    report = run_migrations(df=df, mode="copy", replace=False, bundle=1024)
+    catalog.update_from_report(report=report, df=df)
+
+    assert report["outcome"].to_list() == ["bundled"] * 8
+    assert catalog.contains(df["abspath_dst"]).all()
+
+
+def test_unreadable_files_are_cataloged_without_hash(tmp_path, monkeypatch):
+    import catalog as module
+    from dedup import full_hash
+
+    server = tmp_path / "server"
+    good = write(server / "photo" / "a.jpg", b"hello")
+    bad = write(server / "photo" / "b.jpg", b"world")
+    def failing_hash(path):
+        if path == bad:
+            raise OSError("stale file handle")
+        return full_hash(path)
+    monkeypatch.setattr(module, "full_hash", failing_hash)
+
+    catalog = Catalog(str(tmp_path / "catalog.sqlite"))
+    catalog.build({"HOME": str(server), "image": str(server / "photo")}, hashes=True)
+
+    assert len(catalog) == 2 and catalog.hashed() == 1
+    assert catalog.find_content(pd.Series([full_hash(good)])).to_list() == [good]
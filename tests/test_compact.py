@@ -0,0 +1,63 @@
+import os
+import pytest
+import pandas as pd
+from conftest import write
+from helpers import server_paths
+from plan import plan
+from compact import is_compact, expand_plan, load_plan, save_plan
+from catalog import Catalog
+from estimate import estimate
+from execute import run_migrations
+
+
+def test_compact_plans_are_expanded_only_to_migrate(tmp_path, plans):
+    for i in range(3):
+        write(tmp_path / "dump" / "2020" / f"IMG_2020010{i + 1}_120000.jpg", b"x" * (i + 1),
+              mtime=1577880000)
+    server = server_paths(str(tmp_path / "server"))
+
+    table = plan(source=str(tmp_path / "dump"), destinations=server, ignore=[],
+                 plan_format="parquet")
+
+    assert is_compact(table)
+    pd.testing.assert_frame_equal(load_plan(table.attrs["plan_path"]), table, check_like=True)
+
+    counts = estimate(df=table, mode="copy", replace=False, probe=False)
+    assert counts["files_new"].sum() == 3
+
+    report = run_migrations(df=table, mode="copy", replace=False)
+    assert report["outcome"].to_list() == ["copied"] * 3
+    assert all(os.path.exists(p) for p in expand_plan(table)["abspath_dst"])
+
+    catalog = Catalog(str(plans / "catalog.sqlite"))
+    catalog.update_from_report(report=report, df=table)
+    assert len(catalog) == 3
+
+
+@pytest.mark.parametrize("plan_format", ["parquet", "feather"])
+def test_categories_and_missing_times_survive_a_round_trip(tmp_path, plan_format):
+    full = pd.DataFrame({"abspath_src": ["/dump/a/IMG_1.jpg", "/dump/a/IMG_2.mov", "/dump/b/IMG_3.jpg"],
+                         "basename_src": ["IMG_1.jpg", "IMG_2.mov", "IMG_3.jpg"],
+                         "filename_src": ["IMG_1", "IMG_2", "IMG_3"],
+                         "extension_src": [".jpg", ".mov", ".jpg"],
+                         "extension": [".jpg", ".mov", ".jpg"],
+                         "file_ext": [".jpg", ".mov", ".jpg"],
+                         "file_type": ["image", "video", "image"],
+                         "abspath_dst": ["/server/photo/IMG_1.jpg", "/server/video/IMG_2.mov",
+                                         "/server/photo/IMG_3.jpg"],
+                         "basename_dst": ["IMG_1.jpg", "IMG_2.mov", "IMG_3.jpg"],
+                         "dirname_dst": ["/server/photo", "/server/video", "/server/photo"],
+                         "parentdir_dst": ["/server/photo", "/server/video", None],
+                         "st_size": [1, 2, 3],
+                         "st_mtime": pd.Series([pd.Timestamp("2020-01-01 12:00:00.5"), pd.Timestamp("2020-01-02"),
+                                                pd.Timestamp("2020-01-03")]),
+                         "time_src": pd.Series([pd.Timestamp("2020-01-01"), None, pd.NaT], dtype="datetime64[ns]")})
+    path = str(tmp_path / f"plan.{plan_format}")
+
+    save_plan(full, path, plan_format=plan_format)
+    loaded = load_plan(path)
+
+    assert is_compact(loaded)
+    assert loaded["dirname_src"].cat.categories.to_list() == ["/dump/a", "/dump/b"]
+    output = expand_plan(loaded)
+    pd.testing.assert_frame_equal(output[full.columns], full)
@@ -0,0 +1,57 @@
+import os
+import pytest
+from conftest import write
+from compare import DestinationIndex, identical, COMPARE_POLICIES
+from execute import migrate_file
+
+
+@pytest.fixture
+def files(tmp_path):
+    """
+    A source, a copy with the same mtime, and a file of the same size
+    and mtime with different first and last bytes.
+    """
+    src = write(tmp_path / "src.jpg", b"a" + b"x" * 1000 + b"a", mtime=1000)
+    same = write(tmp_path / "same.jpg", b"a" + b"x" * 1000 + b"a", mtime=1000)
+    edited = write(tmp_path / "edited.jpg", b"b" + b"x" * 1000 + b"b", mtime=1000)
+    return src, same, edited
+
+
+@pytest.mark.parametrize("policy", COMPARE_POLICIES)
+def test_identical(files, policy):
+    src, same, edited = files
+    stats = os.stat(src)
+
+    assert identical(src, same, src_stats=stats, dst_stats=os.stat(same), policy=policy)
+    # Same size and mtime are enough for size_mtime only
+    assert identical(src, edited, src_stats=stats, dst_stats=os.stat(edited),
+                     policy=policy) == (policy == "size_mtime")
+
+    os.utime(same, (5000, 5000))
+    assert identical(src, same, src_stats=stats, dst_stats=os.stat(same),
+                     policy=policy) == (policy != "size_mtime")
+
+
+def test_identical_rejects_unknown_policies(files):
+    src, same, _ = files
+    with pytest.raises(ValueError):
+        identical(src, same, src_stats=os.stat(src), dst_stats=os.stat(same), policy="name")
+
+
+def test_index_is_updated_on_write(tmp_path):
+    src = write(tmp_path / "dump" / "IMG_1.jpg", mtime=1000)
+    dst = str(tmp_path / "server" / "IMG_1.jpg")
+    os.makedirs(os.path.dirname(dst))
+    index = DestinationIndex()
+    assert index.lookup(dst) is None
+
+    report = migrate_file(src=src, dst=dst, mode="copy", replace=False, index=index)
+    assert report["outcome"] == "copied"
+    assert index.lookup(dst).stat().st_size == 4
+
+    report = migrate_file(src=src, dst=dst, mode="copy", replace=False, index=index)
+    assert report["outcome"] == "skipped"
+
+    report = migrate_file(src=src, dst=dst, mode="copy", replace=True, index=index,
+                          compare="size_mtime")
+    assert report["outcome"] == "skipped-identical"
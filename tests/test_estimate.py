@@ -0,0 +1,44 @@
+import os
+import pytest
+import pandas as pd
+import estimate as estimate_module
+from conftest import write
+from estimate import estimate, total_seconds, show_estimate, probe_mount
+
+
+def test_volumes_that_cant_be_probed_are_only_counted(tmp_path, monkeypatch):
+    src = write(tmp_path / "dump" / "IMG_1.jpg", b"x" * 100)
+    df = pd.DataFrame({"abspath_src": [src],
+                       "abspath_dst": [str(tmp_path / "server" / "photo" / "IMG_1.jpg")],
+                       "parentdir_dst": [str(tmp_path / "server" / "photo")],
+                       "st_size": [100],
+                       "st_mtime": pd.to_datetime([0], unit="s")})
+
+    def read_only(dirname):
+        raise PermissionError(30, "Read-only file system", dirname)
+    monkeypatch.setattr(estimate_module, "probe_mount", read_only)
+
+    table = estimate(df=df, mode="copy", replace=False, probe=True)
+
+    assert table.loc[0, "files_new"] == 1 and table.loc[0, "bytes_new"] == 100
+    assert pd.isnull(table.loc[0, "seconds"])
+    assert total_seconds(table) is None
+    show_estimate(table, total_seconds(table))
+
+
+def test_probe_files_are_removed(tmp_path, monkeypatch):
+    probe = probe_mount(str(tmp_path), size=1024 * 1024 + 1, files=2)
+    assert probe["mb_per_s"] > 0 and os.listdir(tmp_path) == []
+
+    # Interrupted between the files, and one of them can't be removed
+    remove = os.remove
+    def failing_remove(path):
+        if path.endswith("_0"):
+            raise PermissionError(13, "Permission denied", path)
+        remove(path)
+    monkeypatch.setattr(estimate_module.os, "utime", lambda *args: 1 / 0)
+    monkeypatch.setattr(estimate_module.os, "remove", failing_remove)
+
+    with pytest.raises(ZeroDivisionError):
+        probe_mount(str(tmp_path), size=1024, files=2)
+    assert [p[-2:] for p in os.listdir(tmp_path)] == ["_0"]
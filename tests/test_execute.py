@@ -0,0 +1,46 @@
+import threading
+import time
+import pandas as pd
+import execute
+from conftest import write
+from execute import run_migrations
+
+
+def test_parallel_reports_keep_the_plan_order(tmp_path, plans, monkeypatch):
+    names = [f"IMG_{i}.jpg" for i in range(12)]
+    volumes = [str(tmp_path / "server" / v) for v in ["photo", "video", "documents"]]
+    df = pd.DataFrame({"abspath_src": [write(tmp_path / "dump" / n, n.encode()) for n in names],
+                       "abspath_dst": [f"{volumes[i % 3]}/{n}" for i, n in enumerate(names)],
+                       "parentdir_dst": [volumes[i % 3] for i in range(12)]})
+
+    # Count the files in flight on each volume, and overall
+    active = {v: 0 for v in volumes + ["all"]}
+    peaks = dict(active)
+    lock = threading.Lock()
+    migrate_file = execute.migrate_file
+    def slow_migrate_file(*, dst, **options):
+        volume = dst.rsplit("/", 1)[0]
+        with lock:
+            for key in [volume, "all"]:
+                active[key] += 1
+                peaks[key] = max(peaks[key], active[key])
+        time.sleep(0.02)
+        with lock:
+            active[volume] -= 1
+            active["all"] -= 1
+        return migrate_file(dst=dst, **options)
+    monkeypatch.setattr(execute, "migrate_file", slow_migrate_file)
+
+    report = run_migrations(df=df, mode="copy", replace=False, workers=4, volume_limit=2)
+
+    assert report["src"].to_list() == names
+    assert report["outcome"].to_list() == ["copied"] * 12
+    assert max(peaks[v] for v in volumes) <= 2 and 1 < peaks["all"] <= 4
+
+
+def test_empty_plan(tmp_path, plans):
+    df = pd.DataFrame(columns=["abspath_src", "abspath_dst", "parentdir_dst"])
+
+    report = run_migrations(df=df, mode="copy", replace=False)
+
+    assert len(report) == 0
@@ -0,0 +1,72 @@
+import json
+import pytest
+import pandas as pd
+import helpers
+from helpers import (detect_time_info, has_time_info, file_types, register_extensions,
+                     load_extensions, add_filetype, EXTENSION_TYPES)
+
+
+def times(*names) -> list:
+    return detect_time_info(pd.Series(names))["time_src"].to_list()
+
+
+def test_names_parsed_before():
+    # Dates that pd.to_datetime reads in the name or one of its parts
+    assert times("2020-01-01.jpg", "20200101_123456.jpg", "holidays 2020-01-01.mov") == \
+           [pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-01 12:34:56"), pd.Timestamp("2020-01-01")]
+
+
+def test_camera_phone_and_app_names():
+    assert times("IMG_20200101_123456.jpg", "PXL_20200101_123456789.jpg",
+                 "IMG-20200101-WA0001.jpg", "FILE_20200101.jpg",
+                 "Screenshot_2020-01-01-12-34-56.png", "2020-01-01 12.34.56.jpg",
+                 "20200101_123456(1).jpg") == \
+           [pd.Timestamp("2020-01-01 12:34:56"), pd.Timestamp("2020-01-01 12:34:56"),
+            pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-01"),
+            pd.Timestamp("2020-01-01 12:34:56"), pd.Timestamp("2020-01-01 12:34:56"),
+            pd.Timestamp("2020-01-01 12:34:56")]
+
+
+def test_names_without_time():
+    names = pd.Series(["IMG_1234.jpg", "DSC01234.JPG", "notes.txt", "20201345.jpg",
+                       "invoice 123456789.pdf", ".2020"], index=[3, 5, 7, 9, 11, 13])
+
+    output = detect_time_info(names)
+
+    assert output.index.to_list() == [3, 5, 7, 9, 11, 13]
+    assert not output["has_time"].any() and output["time_src"].isnull().all()
+    assert not has_time_info("IMG_1234.jpg") and has_time_info("IMG_20200101_123456.jpg")
+
+
+def test_extensions_are_classified_in_any_case():
+    extensions = pd.Series([".jpg", ".JPG", ".Mov", ".mp3", ".pdf", ".heic", ""])
+
+    types = file_types(extensions)
+
+    assert types[:5].to_list() == ["image", "image", "video", "audio", "archive"]
+    assert types[5:].isnull().all()
+
+    table = add_filetype(table=pd.DataFrame({"basename_src": ["A.JPG", "b.heic"],
+                                             "extension_src": [".JPG", ".heic"]}))
+    assert table[["extension_src", "file_type", "file_ext"]].values.tolist() == \
+           [[".jpg", "image", ".jpg"]]
+
+
+def test_registered_extensions(tmp_path, monkeypatch):
+    # Restored after the test
+    monkeypatch.setattr(helpers, "EXTENSION_TYPES", EXTENSION_TYPES)
+
+    register_extensions({"image": [".HEIC"]})
+    config = tmp_path / "extensions.json"
+    config.write_text(json.dumps({"video": [".mts", ".txt"]}))
+    load_extensions(str(config))
+
+    assert file_types(pd.Series([".heic", ".MTS", ".txt"])).to_list() == ["image", "video", "video"]
+    with pytest.raises(ValueError):
+        register_extensions({"photo": [".raw"]})
+
+
+def test_registry_is_frozen():
+    with pytest.raises(TypeError):
+        EXTENSION_TYPES[".heic"] = "image"
+    assert ".heic" not in EXTENSION_TYPES
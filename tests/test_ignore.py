@@ -0,0 +1,41 @@
+import pandas as pd
+from ignore import IgnoreMatcher
+
+
+def test_suffixes_match_the_end_of_names_in_any_case():
+    matcher = IgnoreMatcher([".json"])
+
+    assert matcher.ignore_file("IMG_1.jpg.json") and matcher.ignore_file("A.JSON")
+    # Not a regex: the dot is a dot
+    assert not matcher.ignore_file("xjson") and not matcher.ignore_file("a.json.jpg")
+    # Directories with exactly that name are pruned
+    assert matcher.prune_dir(".json") and not matcher.prune_dir("a.json")
+
+
+def test_globs_exact_names_and_directories():
+    matcher = IgnoreMatcher(["*.tmp", "Thumbs.db", "@eaDir/", "#recycle"])
+
+    assert matcher.ignore_file("a.tmp") and not matcher.ignore_file("a.tmp.jpg")
+    assert matcher.ignore_file("Thumbs.db") and not matcher.ignore_file("MyThumbs.db")
+    # "name/" only prunes directories, "name" ignores both
+    assert matcher.prune_dir("@eaDir") and not matcher.ignore_file("@eaDir")
+    assert matcher.prune_dir("#recycle") and matcher.ignore_file("#recycle")
+    assert not matcher.prune_dir("a.tmp")
+
+
+def test_paths_below_the_root():
+    matcher = IgnoreMatcher(["@eaDir/", ".DS_Store"])
+    paths = pd.Series(["/dump/a.jpg", "/dump/@eaDir/a.jpg", "/dump/b/.DS_Store", "/dump/b/c.jpg"])
+
+    assert matcher.ignore_paths(paths, root="/dump").to_list() == [False, True, True, False]
+    # Only directories below the root are checked
+    assert not matcher.ignore_path("/@eaDir/dump/a.jpg", root="/@eaDir/dump")
+    assert not IgnoreMatcher([]) and not IgnoreMatcher(None).ignore_paths(paths).any()
+
+
+def test_hidden_names():
+    matcher = IgnoreMatcher([".*"])
+
+    assert matcher.ignore_file(".hidden.jpg") and not matcher.ignore_file("visible.jpg")
+    assert not matcher.prune_dir(".thumbnails")
+    assert IgnoreMatcher([".thumbnails"]).prune_dir(".thumbnails")
@@ -0,0 +1,31 @@
+import os
+import pandas as pd
+from conftest import write
+from plan import plan
+from helpers import server_paths
+
+
+def plan_table(source, server, incremental):
+    return plan(source=str(source), destinations=server_paths(str(server)), ignore=[],
+                incremental=incremental)
+
+
+def test_incremental_plan_matches_full_plan(tmp_path, plans):
+    dump = tmp_path / "dump"
+    for i in range(5):
+        write(dump / "a" / f"IMG_2020010{i}_120000.jpg", b"x" * i, mtime=1.6e9 + i)
+        write(dump / "b" / f"photo_{i}.png", b"y" * i, mtime=1.5e9 + i)
+
+    plan_table(dump, tmp_path / "server", incremental=True)
+
+    # Edited in place: the mtime of the directory does not change
+    directory_mtime = os.stat(dump / "b").st_mtime_ns
+    write(dump / "b" / "photo_3.png", b"edited content", mtime=1.7e9)
+    os.utime(dump / "b", ns=(directory_mtime, directory_mtime))
+
+    incremental = plan_table(dump, tmp_path / "server", incremental=True)
+    full = plan_table(dump, tmp_path / "server", incremental=False)
+
+    pd.testing.assert_frame_equal(incremental, full)
+    edited = full[full["basename_src"] == "photo_3.png"].iloc[0]
+    assert edited["st_size"] == len(b"edited content")
@@ -0,0 +1,62 @@
+import json
+import os
+import pandas as pd
+from conftest import write
+from journal import Journal, PENDING, IN_PROGRESS, DONE
+from execute import run_migrations, new_report
+from transfer import partial_path
+
+
+def test_move_is_resumed_after_a_crash(tmp_path, plans):
+    """
+    The previous run crashed while moving b.jpg: a.jpg was moved but not
+    logged as done, b.jpg left a partial copy, c.jpg was done, and the
+    last line of the journal was cut.
+    """
+    dump, server = tmp_path / "dump", tmp_path / "server"
+    names = ["a.jpg", "b.jpg", "c.jpg"]
+    df = pd.DataFrame({"abspath_src": [str(dump / n) for n in names],
+                       "abspath_dst": [str(server / n) for n in names]})
+    src, dst = df["abspath_src"].to_list(), df["abspath_dst"].to_list()
+
+    write(dst[0], b"a")
+    write(src[1], b"b")
+    write(partial_path(dst[1]), b"half")
+    write(dst[2], b"c")
+    done = new_report(src[2], dst[2])
+    done.update(moved=True, outcome="moved", strategy="rename")
+
+    path = str(tmp_path / "journal.jsonl")
+    with open(path, "w") as f:
+        for s, d in zip(src, dst):
+            f.write(json.dumps({"src": s, "dst": d, "state": PENDING}) + "\n")
+        f.write(json.dumps({"src": src[0], "dst": dst[0], "state": IN_PROGRESS}) + "\n")
+        f.write(json.dumps({"src": src[2], "dst": dst[2], "state": DONE, "report": done}) + "\n")
+        f.write(json.dumps({"src": src[1], "dst": dst[1], "state": IN_PROGRESS}) + "\n")
+        f.write('{"src": "' + src[1][:5])
+
+    journal = Journal(path)
+    report = run_migrations(df=df, mode="move", replace=False, journal=journal)
+    journal.close()
+
+    assert report["outcome"].to_list() == ["moved"] * 3
+    assert report["strategy"].to_list() == ["journal", "rename", "rename"]
+    assert [open(d, "rb").read() for d in dst] == [b"a", b"b", b"c"]
+    assert not any(os.path.exists(s) for s in src)
+
+    journal = Journal(path)
+    assert [journal.state(s, d) for s, d in zip(src, dst)] == [DONE] * 3
+    journal.close()
+
+
+def test_failed_files_stay_in_progress(tmp_path, plans):
+    df = pd.DataFrame({"abspath_src": [str(tmp_path / "dump" / "missing.jpg")],
+                       "abspath_dst": [str(tmp_path / "server" / "missing.jpg")]})
+    path = str(tmp_path / "journal.jsonl")
+
+    journal = Journal(path)
+    report = run_migrations(df=df, mode="copy", replace=False, journal=journal)
+    journal.close()
+
+    assert report["outcome"].to_list() == ["error"]
+    assert Journal(path).state(df["abspath_src"][0], df["abspath_dst"][0]) == IN_PROGRESS
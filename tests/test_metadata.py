@@ -0,0 +1,41 @@
+import os
+import struct
+import pandas as pd
+from conftest import write
+from metadata import capture_times, QUICKTIME_EPOCH
+
+
+def jpeg(timestamp:bytes) -> bytes:
+    """
+    A JPEG header with an EXIF block holding DateTimeOriginal.
+    """
+    ifd0 = struct.pack("<H", 1) + struct.pack("<HHII", 0x8769, 4, 1, 26) + struct.pack("<I", 0)
+    exif = struct.pack("<H", 1) + struct.pack("<HHII", 0x9003, 2, 20, 44) + struct.pack("<I", 0)
+    tiff = b"II" + struct.pack("<HI", 42, 8) + ifd0 + exif + timestamp + b"\x00"
+    app1 = b"Exif\x00\x00" + tiff
+    return b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xd9"
+
+
+def mp4(seconds:int) -> bytes:
+    # Version 1, 64 bits times
+    mvhd = struct.pack(">I4s", 20, b"mvhd") + struct.pack(">IQ", 1 << 24, seconds)
+    moov = struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+    return struct.pack(">I4s", 16, b"ftyp") + b"isom\x00\x00\x00\x00" + moov
+
+
+def test_out_of_range_times_are_discarded(tmp_path, plans):
+    from cache import FileCache
+    past_2262 = int((pd.Timestamp("2263-01-01") - pd.Timestamp(QUICKTIME_EPOCH)).total_seconds())
+    files = [write(tmp_path / "good.jpg", jpeg(b"2020:01:02 03:04:05")),
+             write(tmp_path / "year_2919.jpg", jpeg(b"2919:01:02 03:04:05")),
+             write(tmp_path / "year_9999.jpg", jpeg(b"9999:12:31 23:59:59")),
+             write(tmp_path / "late.mp4", mp4(past_2262))]
+    df = pd.DataFrame({"abspath_src": files,
+                       "extension": [".jpg", ".jpg", ".jpg", ".mp4"],
+                       "st_size": [os.path.getsize(f) for f in files],
+                       "st_mtime": pd.to_datetime([0] * 4, unit="s")})
+
+    df = capture_times(df, workers=2, cache=FileCache("test"))
+
+    assert df["captured_at"].to_list()[0] == pd.Timestamp("2020-01-02 03:04:05")
+    assert df["captured_at"].iloc[1:].isnull().all()
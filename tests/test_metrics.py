@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+from conftest import write
+from metrics import METRICS, SyscallCounter
+from plan import ls_recursive
+
+
+@pytest.fixture
+def metrics():
+    METRICS.reset()
+    METRICS.enable()
+    yield METRICS
+    METRICS.enable(False)
+    METRICS.reset()
+
+
+def test_nothing_is_recorded_unless_enabled(tmp_path):
+    write(tmp_path / "a.jpg")
+    METRICS.reset()
+
+    ls_recursive(src_dir=str(tmp_path), engine="scandir")
+
+    assert METRICS.summary() == []
+
+
+def test_scandir_listing_is_measured_once(tmp_path, metrics):
+    for i in range(3):
+        write(tmp_path / str(i) / "a.jpg")
+
+    with SyscallCounter():
+        ls_recursive(src_dir=str(tmp_path), engine="scandir")
+
+    records = {r["stage"]: r for r in metrics.summary()}
+    assert list(records) == ["ls_recursive"]
+    assert records["ls_recursive"]["files"] == 3
+    assert records["ls_recursive"]["syscalls"]["scandir"] == 4
+
+
+def test_summary_is_added_to_the_report(tmp_path, plans, monkeypatch):
+    import execute
+    monkeypatch.setattr(execute, "plans_dir", plans)
+    src = write(tmp_path / "dump" / "a.jpg")
+    df = pd.DataFrame({"abspath_src": [src], "abspath_dst": [str(tmp_path / "server" / "a.jpg")]})
+
+    execute.execute(df=df, mode="copy", replace=False)
+
+    path, = plans.glob("*_migration_report.csv")
+    report = pd.read_csv(path, index_col=0)
+    files, stages = report[report["stage"].isnull()], report[report["stage"].notnull()]
+    assert files["outcome"].to_list() == ["copied"]
+    assert stages["stage"].to_list() == ["migrate_file"]
+    assert stages["files"].to_list() == [1]
+    # Nothing is exported without metrics
+    assert list(plans.glob("*_metrics.*")) == []
+    METRICS.enable(False)
+
+
+def test_syscalls_are_only_counted_while_installed():
+    import os
+    stat = os.stat
+    with SyscallCounter():
+        assert os.stat is not stat
+    assert os.stat is stat
@@ -0,0 +1,14 @@
+from conftest import write
+from helpers import server_paths
+from plan import plan
+
+
+def test_content_duplicates_of_unknown_files_dont_drop_photos(tmp_path, plans):
+    jpeg = b"\xff\xd8" + b"x" * 100
+    write(tmp_path / "dump" / "a" / "README", jpeg, mtime=1577880000)
+    write(tmp_path / "dump" / "photo.jpg", jpeg, mtime=1577880000)
+
+    table = plan(source=str(tmp_path / "dump"), destinations=server_paths(str(tmp_path / "server")),
+                 ignore=[], dedup=True)
+
+    assert table["basename_src"].to_list() == ["photo.jpg"]
@@ -0,0 +1,58 @@
+import os
+import sys
+import subprocess
+import builtins
+import pytest
+import imports
+import execute
+import run
+from conftest import write
+from helpers import cli_answer
+from metrics import METRICS
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code")
+
+
+def test_plotting_libraries_are_not_imported_to_migrate():
+    script = "import sys, run; print(sorted({'matplotlib', 'seaborn', 'requests'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", script], cwd=CODE, check=True,
+                            capture_output=True, text=True).stdout
+
+    assert output.strip().splitlines()[-1] == "[]"
+
+
+def test_lazy_imports_resolve_on_first_use(monkeypatch):
+    monkeypatch.setitem(imports.LAZY_IMPORTS, "lazy_dumps", ("json", "dumps"))
+
+    assert imports.lazy_dumps([1]) == "[1]"
+    assert "lazy_dumps" in vars(imports)
+    monkeypatch.delitem(vars(imports), "lazy_dumps")
+    with pytest.raises(AttributeError):
+        imports.not_a_module
+
+
+def test_headless_answers():
+    assert cli_answer(question="Stage? y/n: ", options=["y", "n"], answer="n") == "n"
+    with pytest.raises(ValueError):
+        cli_answer(question="Stage? y/n: ", options=["y", "n"], answer="yes")
+
+
+def test_yes_migrates_without_prompting(tmp_path, plans, monkeypatch):
+    src = write(tmp_path / "dump" / "IMG_20200101_123456.jpg", b"\xff\xd8data", mtime=1577880000)
+    server = tmp_path / "server"
+    for folder in ["photo", "video", "documents"]:
+        os.makedirs(server / folder)
+    monkeypatch.setattr(execute, "plans_dir", plans)
+    monkeypatch.setattr(METRICS, "enabled", METRICS.enabled)
+    def prompt(question):
+        raise AssertionError(f"prompted: {question}")
+    monkeypatch.setattr(builtins, "input", prompt)
+    monkeypatch.setattr(sys, "argv", ["run.py", "--yes", "--dump", str(tmp_path / "dump"),
+                                      "--server", str(server), "--staging", str(tmp_path / "stg")])
+
+    run.main()
+
+    copy, = server.glob("photo/*/IMG_20200101_123456.jpg")
+    assert copy.read_bytes() == b"\xff\xd8data"
+    assert os.path.exists(src)
+    assert len(list(plans.glob("*_migration_report.csv"))) == 1
@@ -0,0 +1,46 @@
+import time
+import datetime
+import pytest
+import pandas as pd
+from schedule import schedule_units, Bandwidth, TimeWindow
+
+MB = 1024 * 1024
+
+
+def test_small_batches_and_large_files_alternate_across_volumes():
+    df = pd.DataFrame({"abspath_dst": ["/p/b/1.jpg", "/p/a/2.jpg", "/p/a/3.jpg", "/p/4.mov",
+                                       "/p/5.mov", "/v/6.mp4", "/v/a/7.jpg"],
+                       "st_size": [10, 10, 10, 2 * MB, 5 * MB, 3 * MB, 10]})
+    volumes = pd.Series(["/p"] * 5 + ["/v"] * 2)
+
+    units = schedule_units(df, volumes, batch_size=2)
+
+    # /p: batch [a/2, a/3], 5.mov, batch [b/1], 4.mov; /v: batch [a/7], 6.mp4
+    assert units == [[1, 2], [6], [4], [5], [0], [3]]
+    assert sorted(p for unit in units for p in unit) == list(range(7))
+
+
+def test_bandwidth_caps_the_transfers():
+    bandwidth = Bandwidth(limit=1e6, volume_limit=0.5e6)
+    assert Bandwidth().throttle("/p") is None
+
+    throttle = bandwidth.throttle("/p")
+    started = time.monotonic()
+    # One second of traffic goes in a burst, the rest waits: 0.25MB over the volume cap
+    for _ in range(3):
+        throttle(0.25e6)
+    assert time.monotonic() - started == pytest.approx(0.5, abs=0.1)
+    # Each volume has its own bucket, the global one is shared
+    assert bandwidth.throttle("/p") is not throttle and len(bandwidth.volume_buckets) == 1
+    bandwidth.throttle("/v")
+    assert len(bandwidth.volume_buckets) == 2
+
+
+def test_time_windows():
+    night, day = TimeWindow("22:00-07:00"), TimeWindow("09:30-17:00")
+
+    assert night.contains(datetime.time(23)) and night.contains(datetime.time(6, 59))
+    assert not night.contains(datetime.time(7)) and not night.contains(datetime.time(12))
+    assert day.contains(datetime.time(9, 30)) and not day.contains(datetime.time(17))
+    with pytest.raises(ValueError, match="22:00-07:00"):
+        TimeWindow("10pm to 7am")
@@ -0,0 +1,63 @@
+import random
+import pytest
+import pandas as pd
+
+Image = pytest.importorskip("PIL.Image")
+
+from similar import similarity_groups, similar_images, degenerate, hamming
+
+
+def flip(value:int, bits:list) -> int:
+    for b in bits:
+        value ^= 1 << b
+    return value
+
+
+def test_groups_do_not_chain():
+    a = 0x0F0F0F0F0F0F0F0F
+    b = flip(a, [0, 1, 2, 3])
+    c = flip(b, [8, 9, 10, 11])
+    assert hamming(a, c) == 8
+
+    groups = similarity_groups([a, b, c], distance=4)
+
+    # b is close to a, c is close to b but not to a
+    assert groups == [0, 0, 2]
+
+
+def test_degenerate_hashes_are_not_grouped():
+    blank = 0
+    almost_blank = flip(0, [5])
+    assert degenerate(blank) and degenerate(almost_blank)
+    assert similarity_groups([blank, almost_blank], distance=4) == [0, 1]
+
+
+def noise_image(path, seed, size=(64, 48)):
+    rng = random.Random(seed)
+    image = Image.new("L", size)
+    image.putdata([rng.randrange(256) for _ in range(size[0] * size[1])])
+    image = image.resize((size[0] * 4, size[1] * 4), Image.BILINEAR)
+    image.save(path)
+    return str(path)
+
+
+def test_similar_images_keeps_the_largest_copy(tmp_path, plans):
+    original = noise_image(tmp_path / "original.png", seed=1)
+    with Image.open(original) as image:
+        image.resize((128, 96)).save(tmp_path / "small.png")
+    other = noise_image(tmp_path / "other.png", seed=2)
+    Image.new("L", (64, 64), 255).save(tmp_path / "white.png")
+    Image.new("L", (32, 32), 255).save(tmp_path / "white_small.png")
+
+    paths = [original, str(tmp_path / "small.png"), other,
+             str(tmp_path / "white.png"), str(tmp_path / "white_small.png")]
+    df = pd.DataFrame({"abspath_src": paths, "file_type": "image",
+                       "st_size": [1000, 500, 1000, 10, 5],
+                       "st_mtime": pd.to_datetime([0] * 5, unit="s")})
+
+    df = similar_images(df, workers=1)
+
+    assert df["similar_best"].to_list() == [True, False, True, True, True]
+    assert df["similar_group"].iloc[0] == df["similar_group"].iloc[1]
+    # Blank images look the same, but their hash says nothing
+    assert df["similar_group"].iloc[3] != df["similar_group"].iloc[4]
@@ -0,0 +1,14 @@
+from conftest import write
+from statpool import stat_files
+
+
+def test_files_that_cannot_be_stated_are_skipped(tmp_path):
+    found = write(tmp_path / "a.jpg", b"hello")
+    vanished = str(tmp_path / "b.jpg")
+    # NotADirectoryError, not FileNotFoundError
+    unreadable = str(tmp_path / "a.jpg" / "c.jpg")
+
+    stats, missing = stat_files([found, vanished, unreadable], max_workers=2)
+
+    assert stats[0].st_size == 5 and stats[1:] == [None, None]
+    assert missing == [vanished, unreadable]
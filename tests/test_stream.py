@@ -0,0 +1,38 @@
+import pandas as pd
+import stream
+from conftest import write
+from helpers import server_paths
+from stream import plan_stream, run_stream, SeenKeys
+
+
+def test_seen_keys_span_calls():
+    seen = SeenKeys()
+
+    assert seen.add_new(pd.Series(["a", "b", "a"])).to_list() == [False, False, True]
+    assert seen.add_new(pd.Series(["c", "b"], index=[7, 8])).to_dict() == {7: False, 8: True}
+    assert len(seen) == 3
+
+
+def test_chunks_are_deduplicated_across_each_other(tmp_path, plans, monkeypatch):
+    # Same name and time in two folders: same destination
+    for folder in ["a", "b", "c"]:
+        write(tmp_path / "dump" / folder / "IMG_20200101_123456.jpg", folder.encode())
+    write(tmp_path / "dump" / "a" / "IMG_20200102_123456.jpg")
+    server = str(tmp_path / "server")
+    monkeypatch.setattr(stream, "plans_dir", plans)
+
+    chunks = list(plan_stream(source=str(tmp_path / "dump"), destinations=server_paths(server),
+                              ignore=[], chunk_size=1, max_workers=1))
+
+    assert len(chunks) == 4
+    assert sorted(c for chunk in chunks for c in chunk["basename_dst"]) == \
+           ["IMG_20200101_123456.jpg", "IMG_20200102_123456.jpg"]
+
+    run_stream(source=str(tmp_path / "dump"), destinations=server_paths(server), ignore=[],
+               mode="copy", replace=False, chunk_size=1)
+
+    plan_path, = plans.glob("*_plan.csv")
+    report_path, = plans.glob("*_migration_report.csv")
+    assert len(pd.read_csv(plan_path, index_col=0)) == 2
+    report = pd.read_csv(report_path, index_col=0)
+    assert report.loc[report["outcome"].notnull(), "outcome"].to_list() == ["copied"] * 2
@@ -0,0 +1,59 @@
+from takeout import SidecarIndex, MAX_NAME, split_sidecars
+
+LONG = "Screenshot_20200101-123456_A very long application name.png"
+
+
+def sidecars(*names, dirname="/takeout/Photos from 2020"):
+    return SidecarIndex([f"{dirname}/{name}" for name in names])
+
+
+def lookup(index, name, dirname="/takeout/Photos from 2020"):
+    sidecar = index.lookup(f"{dirname}/{name}")
+    return None if sidecar is None else sidecar.rsplit("/", 1)[1]
+
+
+def test_exact_and_supplemental_names():
+    index = sidecars("IMG_1.jpg.json", "IMG_2.jpg.supplemental-metadata.json",
+                     "IMG_3.jpg.supplemental-me.json")
+
+    assert lookup(index, "IMG_1.jpg") == "IMG_1.jpg.json"
+    assert lookup(index, "IMG_2.jpg") == "IMG_2.jpg.supplemental-metadata.json"
+    assert lookup(index, "IMG_3.jpg") == "IMG_3.jpg.supplemental-me.json"
+    assert lookup(index, "IMG_4.jpg") is None
+    # Sidecars are only looked up in the directory of the file
+    assert lookup(index, "IMG_1.jpg", dirname="/takeout/Photos from 2021") is None
+
+
+def test_counters_and_edited_copies():
+    index = sidecars("IMG_1.jpg.json", "IMG_1.jpg(1).json",
+                     "IMG_2.jpg.supplemental-metadata(2).json")
+
+    assert lookup(index, "IMG_1.jpg") == "IMG_1.jpg.json"
+    assert lookup(index, "IMG_1(1).jpg") == "IMG_1.jpg(1).json"
+    assert lookup(index, "IMG_1-edited.jpg") == "IMG_1.jpg.json"
+    assert lookup(index, "IMG_2(2).jpg") == "IMG_2.jpg.supplemental-metadata(2).json"
+    assert lookup(index, "IMG_2(1).jpg") is None
+
+
+def test_truncated_names():
+    truncated = LONG[:MAX_NAME - len(".json")] + ".json"
+    index = sidecars(truncated, LONG[:MAX_NAME - len(".json")] + "(1).json")
+
+    assert len(truncated) == MAX_NAME
+    assert lookup(index, LONG) == truncated
+    assert lookup(index, LONG.replace(".png", "-edited.png")) == truncated
+    assert lookup(index, LONG.replace(".png", "(1).png")) == LONG[:46] + "(1).json"
+    # Same prefix, but the name fits: not truncated, no match
+    assert lookup(index, LONG[:40] + ".png") is None
+
+
+def test_json_files_without_media_are_not_sidecars():
+    files = [f"/takeout/Photos from 2020/{name}" for name in
+             ["IMG_1.jpg", "IMG_1.jpg.json", "IMG_2.jpg.json", "settings.json", ".DS_Store"]]
+
+    keep, found = split_sidecars(files, [".DS_Store"])
+
+    assert keep == [True, False, True, True, False]
+    assert found == [files[1]]
+    # The user's .json files can still be ignored
+    assert split_sidecars(files, [".json"])[0] == [True, False, False, False, True]
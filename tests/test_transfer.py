@@ -0,0 +1,97 @@
+import os
+import pytest
+import transfer
+from conftest import write
+from dedup import full_hash
+from transfer import copy_verified, move_file, partial_path
+
+
+def test_verified_rename_hashes_the_destination(tmp_path):
+    src = write(tmp_path / "src.jpg", b"data", mtime=1000)
+    digest = full_hash(src)
+
+    assert move_file(src, str(tmp_path / "a.jpg")) == ("rename", None)
+    assert move_file(str(tmp_path / "a.jpg"), str(tmp_path / "b.jpg"), verify="stat") == ("rename", None)
+    assert move_file(str(tmp_path / "b.jpg"), str(tmp_path / "c.jpg"), verify="readback") == ("rename", digest)
+    assert os.stat(tmp_path / "c.jpg").st_mtime == 1000
+
+
+def test_rename_that_fails_verification_is_undone(tmp_path, monkeypatch):
+    src = write(tmp_path / "src.jpg", b"data")
+    dst = str(tmp_path / "dst.jpg")
+    # The destination doesn't look like the source after the rename
+    replace = os.replace
+    def truncating_replace(a, b):
+        replace(a, b)
+        if b == dst:
+            open(dst, "wb").close()
+    monkeypatch.setattr(transfer.os, "replace", truncating_replace)
+
+    with pytest.raises(ValueError, match="DATA INTEGRITY"):
+        move_file(src, dst, verify="stat")
+    assert os.path.exists(src) and not os.path.exists(dst)
+
+
+@pytest.mark.parametrize("verify", ["readback", "stat"])
+def test_verified_copy(tmp_path, verify):
+    src = write(tmp_path / "src.jpg", b"x" * 100000, mtime=1000)
+    dst = str(tmp_path / "dst.jpg")
+
+    digest = copy_verified(src, dst, verify, atomic=True)
+
+    assert digest == full_hash(src) == full_hash(dst)
+    assert os.stat(dst).st_mtime == 1000
+    assert not os.path.exists(partial_path(dst))
+
+
+def test_readback_mismatch_removes_the_copy(tmp_path, monkeypatch):
+    src = write(tmp_path / "src.jpg", b"data")
+    dst = str(tmp_path / "dst.jpg")
+    # The copy reads back different bytes
+    monkeypatch.setattr(transfer, "full_hash", lambda path: "corrupt")
+
+    for atomic in [False, True]:
+        with pytest.raises(ValueError, match="DATA INTEGRITY"):
+            copy_verified(src, dst, "readback", atomic=atomic)
+        assert not os.path.exists(dst)
+        assert not os.path.exists(partial_path(dst))
+
+
+def test_stat_mismatch_removes_the_copy(tmp_path, monkeypatch):
+    src = write(tmp_path / "src.jpg", b"data", mtime=1000)
+    dst = str(tmp_path / "dst.jpg")
+    # The copy doesn't get the mtime of the source
+    monkeypatch.setattr(transfer.shutil, "copystat", lambda src, dst: None)
+
+    with pytest.raises(ValueError, match="DATA INTEGRITY"):
+        copy_verified(src, dst, "stat")
+    assert not os.path.exists(dst)
+
+
+def test_source_is_kept_when_a_verified_move_fails(tmp_path, monkeypatch):
+    src = write(tmp_path / "src.jpg", b"data")
+    dst = str(tmp_path / "dst.jpg")
+    # Another device: copied, not renamed
+    monkeypatch.setattr(transfer, "same_device", lambda src, dst: False)
+    monkeypatch.setattr(transfer, "full_hash", lambda path: "corrupt")
+
+    with pytest.raises(ValueError):
+        move_file(src, dst, verify="readback")
+    assert os.path.exists(src) and not os.path.exists(dst)
+
+
+@pytest.mark.parametrize("mode", ["copy", "move"])
+def test_digest_is_reported(tmp_path, monkeypatch, mode):
+    from execute import migrate_file
+
+    src = write(tmp_path / "src.jpg", b"x" * 1000)
+    digest = full_hash(src)
+    # Another device: moves go through a verified copy too
+    monkeypatch.setattr(transfer, "same_device", lambda src, dst: False)
+
+    report = migrate_file(src=src, dst=str(tmp_path / "dst.jpg"), mode=mode,
+                          replace=False, verify="stat")
+
+    assert report["outcome"] == ("copied" if mode == "copy" else "moved")
+    assert report["strategy"] == "verified" and report["digest"] == digest
+    assert os.path.exists(src) == (mode == "copy")
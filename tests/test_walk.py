@@ -0,0 +1,48 @@
+import os
+from conftest import write
+from walk import scandir_walk
+from plan import ls_entries, ls_recursive
+
+
+def dump(tmp_path) -> str:
+    for name in ["a.jpg", "b/c.jpg", "b/d/e.mov", "b/README", ".hidden.jpg", ".cache/f.jpg"]:
+        write(tmp_path / "dump" / name, mtime=1577880000)
+    return str(tmp_path / "dump")
+
+
+def test_scandir_finds_what_glob_finds_and_files_without_dots(tmp_path):
+    source = dump(tmp_path)
+
+    found = ls_recursive(src_dir=source, engine="scandir")
+
+    assert set(ls_recursive(src_dir=source)) | {f"{source}/b/README"} == set(found)
+    assert found == sorted(found)
+
+
+def test_entries_carry_the_stats_of_the_listing(tmp_path):
+    source = dump(tmp_path)
+
+    entries = list(scandir_walk(source, max_workers=2))
+
+    assert len(entries) == 4
+    for entry in entries:
+        stats = os.stat(entry.path)
+        assert (entry.st_size, entry.st_mtime) == (stats.st_size, stats.st_mtime) == (4, 1577880000)
+    # Hidden files and directories are left out like with glob, unless asked for
+    assert len(list(scandir_walk(source, include_hidden=True))) == 6
+
+
+def test_ignored_directories_are_not_listed(tmp_path, monkeypatch):
+    import walk
+    source = dump(tmp_path)
+    listed = []
+    scandir = os.scandir
+    def recording_scandir(path):
+        listed.append(path)
+        return scandir(path)
+    monkeypatch.setattr(walk.os, "scandir", recording_scandir)
+
+    entries = ls_entries(src_dir=source, ignore=["d/", "README"])
+
+    assert [e.path for e in entries] == [f"{source}/a.jpg", f"{source}/b/c.jpg"]
+    assert sorted(listed) == [source, f"{source}/b"]
@@ -0,0 +1,54 @@
+import time
+from watch import Debouncer
+
+
+def test_failed_batches_are_held_with_backoff(tmp_path):
+    path = tmp_path / "IMG_1.jpg"
+    path.write_bytes(b"x")
+    debouncer = Debouncer(settle=0, backoff=0.2, max_backoff=0.3)
+
+    debouncer.add([str(path)])
+    debouncer.ready()
+    assert [e.path for e in debouncer.ready()] == [str(path)]
+
+    assert debouncer.retry([str(path)]) == 0.2
+    assert debouncer.ready() == [] and len(debouncer) == 1
+    time.sleep(0.25)
+    debouncer.ready()
+    assert [e.path for e in debouncer.ready()] == [str(path)]
+
+    # Longer after each failure, up to max_backoff
+    assert debouncer.retry([str(path)]) == 0.3
+    debouncer.done([str(path)])
+    assert debouncer.retry([str(path)]) == 0.2
+
+
+def test_files_reported_with_errors_are_retried(tmp_path, plans, monkeypatch):
+    import watch
+    from conftest import write
+    from helpers import server_paths
+
+    good = write(tmp_path / "dump" / "IMG_1.jpg", b"\xff\xd8one", mtime=1577880000)
+    bad = write(tmp_path / "dump" / "IMG_2.jpg", b"\xff\xd8two", mtime=1577880000)
+
+    def run_migrations(*, df, **options):
+        # The second file fails on its own, the batch goes through
+        report = run(df=df, **options)
+        failed = report["src"] == "IMG_2.jpg"
+        report.loc[failed, ["copied", "error", "outcome"]] = [False, "OSError()", "error"]
+        return report
+    run = watch.run_migrations
+    monkeypatch.setattr(watch, "run_migrations", run_migrations)
+
+    debouncer = Debouncer(settle=0, backoff=10)
+    debouncer.add([good, bad])
+    debouncer.ready()
+    batch = debouncer.ready()
+    assert len(batch) == 2
+
+    table, report = watch.migrate_ready(batch=batch, debouncer=debouncer,
+                                        destinations=server_paths(str(tmp_path / "server")),
+                                        mode="copy", replace=False)
+
+    assert len(report) == 2
+    assert list(debouncer.delayed) == [bad] and len(debouncer) == 1